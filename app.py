@@ -1,21 +1,48 @@
 # Arabs Stock AI Metadata Generator
 # Python Backend for Browser Extension
 
+import atexit
 import json
 import requests
 import base64
-from PIL import Image
+import bisect
+from PIL import Image, ImageOps
 import io
+import math
+import numpy as np
 from typing import Dict, List, Tuple, Optional
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import openai
 import google.generativeai as genai
 from googletrans import Translator
 import random
+import re
 import os
+import time
+import asyncio
+import contextvars
+import copy
+import csv
+import functools
+import hashlib
+import heapq
+import shutil
+import signal
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape as xml_escape
 
 app = Flask(__name__)
 CORS(app)   # Enable CORS for browser extension
@@ -25,42 +52,2382 @@ class AIProvider(Enum):
     GEMINI = 'gemini'
     OFFLINE ='offline'
 
+# Default vision model per provider
+DEFAULT_MODELS = {
+    AIProvider.OPENAI: "gpt-4-vision-preview",
+    AIProvider.GEMINI: "gemini-pro-vision",
+    AIProvider.OFFLINE: "offline"
+}
+
 @dataclass
 class AIConfig:
     provider: AIProvider
     api_key: str
     model: str = None
+    # Pre-built provider client (OpenAI client or Gemini model), swapped together with the config
+    client: object = field(default=None, repr=False, compare=False)
+    # Async OpenAI client used by the ASGI server
+    async_client: object = field(default=None, repr=False, compare=False)
+
+# Images are downscaled before analysis; stock uploads are often 20-50 MP
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+IMAGE_PROFILES = {
+    AIProvider.OPENAI: {
+        "max_edge": int(os.getenv('OPENAI_IMAGE_MAX_EDGE', '1024')),
+        "image_format": os.getenv('OPENAI_IMAGE_FORMAT', 'JPEG').upper()
+    },
+    AIProvider.GEMINI: {
+        "max_edge": int(os.getenv('GEMINI_IMAGE_MAX_EDGE', '1024')),
+        "image_format": os.getenv('GEMINI_IMAGE_FORMAT', 'JPEG').upper()
+    },
+    AIProvider.OFFLINE: {
+        "max_edge": int(os.getenv('OFFLINE_IMAGE_MAX_EDGE', '512')),
+        "image_format": 'JPEG'
+    }
+}
+
+# Raw uploads larger than this are spooled to a temp file instead of kept in memory
+UPLOAD_SPOOL_SIZE = int(os.getenv('UPLOAD_SPOOL_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+EMPTY_DIGEST = hashlib.sha256(b'').hexdigest()
+
+class ImageUpload:
+    """Raw image bytes (in memory or in a seekable file) plus their content hash"""
+
+    def __init__(self, source, digest: str = None, prepared: 'PreparedImage' = None):
+        self.source = source
+        self._digest = digest
+        # Already decoded and downsized with the provider's profile, e.g. by a bulk ingest worker
+        self.prepared = prepared
+
+    @classmethod
+    def from_data(cls, image_data) -> 'ImageUpload':
+        """Wrap base64 text, raw bytes or a binary file object"""
+        if isinstance(image_data, ImageUpload):
+            return image_data
+        if isinstance(image_data, str):
+            image_data = base64.b64decode(image_data)
+        if isinstance(image_data, (bytearray, memoryview)):
+            image_data = bytes(image_data)
+        if isinstance(image_data, bytes):
+            return cls(image_data)
+        try:
+            return cls.from_file(image_data)
+        except (AttributeError, OSError):
+            # Not seekable, e.g. a raw request stream
+            return cls.from_stream(image_data)
+
+    @classmethod
+    def from_file(cls, file) -> 'ImageUpload':
+        """Hash a seekable file in chunks and use it in place"""
+        digest = hashlib.sha256()
+        file.seek(0)
+        for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        file.seek(0)
+        return cls(file, digest.hexdigest())
+
+    @classmethod
+    def from_stream(cls, stream) -> 'ImageUpload':
+        """Copy a request stream into a spooled temp file, hashing as it goes"""
+        spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+        return cls(spool, digest.hexdigest())
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.source).hexdigest()
+        return self._digest
+
+    def open(self):
+        """Binary file object for PIL, without copying in-memory bytes"""
+        if isinstance(self.source, bytes):
+            # BytesIO shares the bytes buffer until it is written to
+            return io.BytesIO(self.source)
+        self.source.seek(0)
+        return self.source
+
+    @property
+    def size(self) -> int:
+        """Upload size in bytes"""
+        if isinstance(self.source, bytes):
+            return len(self.source)
+        position = self.source.tell()
+        size = self.source.seek(0, io.SEEK_END)
+        self.source.seek(position)
+        return size
+
+    def read(self) -> bytes:
+        if isinstance(self.source, bytes):
+            return self.source
+        self.source.seek(0)
+        return self.source.read()
+
+class PreparedImage:
+    """A decoded, size-capped image shared by every analyzer"""
+
+    def __init__(self, image: Image.Image, original_size: Tuple[int, int], image_format: str,
+                 quality: int, source_bytes: bytes = None):
+        self.image = image
+        self.original_size = original_size
+        self.image_format = image_format
+        self.quality = quality
+        self._encoded = source_bytes
+        self._features = None
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.image_format.lower()}"
+
+    def encoded(self) -> bytes:
+        """Upload payload for the provider, encoded on first use"""
+        if self._encoded is None:
+            buffer = io.BytesIO()
+            self.image.save(buffer, self.image_format, quality=self.quality)
+            self._encoded = buffer.getvalue()
+        return self._encoded
+
+    def features(self) -> Dict:
+        """compute_image_features of the image, computed once and shared by the router and offline analysis"""
+        if self._features is None:
+            self._features = compute_image_features(self.image)
+        return self._features
+
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.encoded()).decode('ascii')}"
+
+    def __getstate__(self) -> Dict:
+        # Pickled as the encoded image rather than raw pixels, e.g. from an ingest worker to the parent
+        return {"encoded": self.encoded(), "original_size": self.original_size, "image_format": self.image_format,
+                "quality": self.quality, "features": self._features}
+
+    def __setstate__(self, state: Dict):
+        image = Image.open(io.BytesIO(state["encoded"]))
+        image.load()
+        self.__init__(image, state["original_size"], state["image_format"], state["quality"], state["encoded"])
+        self._features = state["features"]
+
+def prepare_image(image_data, max_edge: int = 1024, image_format: str = 'JPEG',
+                  quality: int = IMAGE_QUALITY) -> PreparedImage:
+    """Decode an upload at reduced size and cap it to max_edge pixels"""
+    upload = ImageUpload.from_data(image_data)
+    image = Image.open(upload.open())
+    original_format = image.format
+    original_size = image.size
+    if image.getexif().get(0x0112) in (5, 6, 7, 8):
+        # Rotated by EXIF orientation, report the size as displayed
+        original_size = original_size[::-1]
+
+    # JPEG can decode straight to 1/2, 1/4 or 1/8 scale, skipping most of the pixel work
+    image.draft('RGB', (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    # Small uploads already in the target format are forwarded untouched
+    source_bytes = None
+    if image.size == original_size and original_format == image_format:
+        source_bytes = upload.read()
+
+    return PreparedImage(image, original_size, image_format, quality, source_bytes)
+
+# Reference colours for naming dominant colours in offline mode
+NAMED_COLORS = {
+    "black": (20, 20, 20),
+    "white": (245, 245, 245),
+    "gray": (128, 128, 128),
+    "red": (200, 30, 35),
+    "orange": (240, 140, 30),
+    "yellow": (240, 215, 50),
+    "gold": (200, 160, 60),
+    "beige": (225, 205, 165),
+    "brown": (120, 75, 40),
+    "green": (50, 150, 60),
+    "teal": (30, 140, 140),
+    "blue": (35, 80, 190),
+    "light blue": (135, 190, 235),
+    "purple": (120, 60, 160),
+    "pink": (235, 145, 185)
+}
+_COLOR_NAMES = list(NAMED_COLORS)
+_COLOR_TABLE = np.array([NAMED_COLORS[name] for name in _COLOR_NAMES], dtype=np.float32)
+
+# 4 levels per channel -> 64 colour bins, each mapped once to its nearest named colour
+_BIN_CENTERS = (np.stack(np.meshgrid(np.arange(4), np.arange(4), np.arange(4), indexing='ij'), -1)
+                .reshape(-1, 3) * 64 + 32).astype(np.float32)
+_BIN_COLOR_INDEX = ((_BIN_CENTERS[:, None, :] - _COLOR_TABLE[None, :, :]) ** 2).sum(-1).argmin(1)
+
+def compute_image_features(image: Image.Image, max_edge: int = 96) -> Dict:
+    """Deterministic colour, tone and composition statistics from a tiny thumbnail"""
+    width, height = image.size
+    scale = max_edge / max(width, height)
+    if scale < 1:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    rgb = np.asarray(image)
+    hsv = np.asarray(image.convert('HSV'))
+    ycbcr = np.asarray(image.convert('YCbCr')).astype(np.int16)
+    luma = ycbcr[..., 0].astype(np.float32)
+    pixels = luma.size
+
+    # Tone
+    brightness = float(luma.mean() / 255)
+    contrast = float(luma.std() / 128)
+    saturation = float(hsv[..., 1].mean() / 255)
+
+    hist = np.bincount((luma // 4).astype(np.intp).ravel(), minlength=64) / pixels
+    nonzero = hist[hist > 0]
+    entropy = float(-(nonzero * np.log2(nonzero)).sum())
+
+    # Edges: share of pixels with a strong horizontal + vertical gradient
+    gradient = np.abs(np.diff(luma, axis=1))[:-1, :] + np.abs(np.diff(luma, axis=0))[:, :-1]
+    edge_density = float((gradient > 24).mean()) if gradient.size else 0.0
+
+    # Dominant colours from a 64-bin histogram folded onto the named palette
+    bins = (rgb[..., 0] >> 6).astype(np.intp) * 16 + (rgb[..., 1] >> 6) * 4 + (rgb[..., 2] >> 6)
+    bin_counts = np.bincount(bins.ravel(), minlength=64)
+    color_shares = np.bincount(_BIN_COLOR_INDEX, weights=bin_counts, minlength=len(_COLOR_NAMES)) / pixels
+    order = np.argsort(-color_shares, kind='stable')
+    dominant_colors = [(_COLOR_NAMES[i], float(color_shares[i])) for i in order if color_shares[i] >= 0.05]
+    color_count = int((bin_counts / pixels >= 0.005).sum())
+
+    # Skin tones (YCbCr rule) and how much of them sit in the upper-centre "face" window
+    cb, cr = ycbcr[..., 1], ycbcr[..., 2]
+    skin = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173) & (ycbcr[..., 0] > 40)
+    skin_ratio = float(skin.mean())
+    rows, cols = skin.shape
+    face_window = skin[: max(1, rows * 3 // 5), cols // 4: max(cols // 4 + 1, cols * 3 // 4)]
+    face_likelihood = min(1.0, float(face_window.mean()) / 0.3)
+    if skin_ratio > 0.6:
+        # Skin tones filling the frame are sand, wood or walls rather than people
+        face_likelihood = 0.0
+
+    # Sky in the top third, vegetation anywhere
+    hue = hsv[..., 0].astype(np.int16)
+    top = slice(0, max(1, rows // 3))
+    sky = (hue[top] >= 125) & (hue[top] <= 175) & (hsv[top][..., 2] > 110)
+    vegetation = (hue >= 45) & (hue <= 110) & (hsv[..., 1] > 60)
+
+    return {
+        "brightness": brightness,
+        "contrast": contrast,
+        "saturation": saturation,
+        "entropy": entropy,
+        "edge_density": edge_density,
+        "color_count": color_count,
+        "dominant_colors": dominant_colors,
+        "skin_ratio": skin_ratio,
+        "face_likelihood": face_likelihood,
+        "sky_ratio": float(sky.mean()),
+        "vegetation_ratio": float(vegetation.mean())
+    }
+
+# Upper bound on simultaneous in-flight calls per provider
+PROVIDER_CONCURRENCY = {
+    AIProvider.OPENAI: int(os.getenv('OPENAI_MAX_CONCURRENCY', '8')),
+    AIProvider.GEMINI: int(os.getenv('GEMINI_MAX_CONCURRENCY', '8')),
+    AIProvider.OFFLINE: int(os.getenv('OFFLINE_MAX_CONCURRENCY', str(os.cpu_count() or 4)))
+}
+
+# Bump whenever the analysis prompts change so cached analyses are not reused
+PROMPT_VERSION = "1"
+
+OPENAI_PROMPT = """Analyze this image for stock photography metadata.
+                                Focus on: main subject, people, ibjects, setting, mood, 
+                                Return a JSON with: main_subject, people (array), object (array), setting, mood, colors (array), style, cultural_context.
+                                Keep description concise and stock-photo appropriate."""
+
+GEMINI_PROMPT = """Analyze this image for stock photography metadata for Arab/Middle Eastern markets.
+            Describe: main subject, people, objects, setting, mood, colors, style, cultural context.
+            Format as JSON: {"main_subject": "", "people": [], "objects": [], "setting": "", "mood": "", "colors": [], "style": "", "cultural_context": ""}"""
+
+# Several batch images in one request; {count} is filled in per request
+PACK_PROMPT = """Analyze each of the {count} numbered images for stock photography metadata for Arab/Middle Eastern markets.
+            Describe for each: main subject, people, objects, setting, mood, colors, style, cultural context.
+            Return only a JSON array with exactly {count} objects, one per image in order:
+            [{{"image": 1, "main_subject": "", "people": [], "objects": [], "setting": "", "mood": "", "colors": [], "style": "", "cultural_context": ""}}]"""
+
+ANALYSIS_TEXT_FIELDS = ("main_subject", "setting", "mood", "style", "cultural_context")
+ANALYSIS_LIST_FIELDS = ("people", "objects", "colors")
+
+# Keys (and text labels) providers use for each analysis field, normalised to snake_case
+ANALYSIS_ALIASES = {
+    "main_subject": "main_subject", "subject": "main_subject", "main_focus": "main_subject",
+    "people": "people", "person": "people", "persons": "people",
+    "objects": "objects", "object": "objects", "items": "objects", "key_objects": "objects",
+    "setting": "setting", "location": "setting", "environment": "setting",
+    "mood": "mood", "atmosphere": "mood",
+    "colors": "colors", "colours": "colors", "color": "colors", "colour": "colors",
+    "dominant_colors": "colors", "color_palette": "colors",
+    "style": "style", "photography_style": "style",
+    "cultural_context": "cultural_context", "culture": "cultural_context"
+}
+
+# List entries that mean "nothing here"
+ANALYSIS_EMPTY_VALUES = frozenset(["", "none", "n/a", "na", "no", "nothing", "unknown", "-", "no people", "none visible"])
+
+class AnalysisParseError(ValueError):
+    """A provider reply that holds no usable analysis"""
+
+def _split_list(value: str) -> List[str]:
+    return [part for part in re.split(r'\s*(?:[,;/]|\band\b)\s*', value) if part]
+
+@dataclass(slots=True)
+class ImageAnalysis:
+    """Validated analysis of one image, whatever shape the provider replied in"""
+    main_subject: str = ""
+    people: List[str] = field(default_factory=list)
+    objects: List[str] = field(default_factory=list)
+    setting: str = ""
+    mood: str = ""
+    colors: List[str] = field(default_factory=list)
+    style: str = ""
+    cultural_context: str = ""
+
+    @staticmethod
+    def _text(value) -> str:
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value if item is not None)
+        elif value is None or isinstance(value, dict):
+            return ""
+        return str(value).strip().strip('*"\'').strip()
+
+    @staticmethod
+    def _list(value) -> List[str]:
+        if isinstance(value, str):
+            value = _split_list(value)
+        elif not isinstance(value, list):
+            return []
+        items = []
+        for item in value:
+            if isinstance(item, dict):
+                # e.g. {"name": "laptop", "count": 1}
+                item = item.get("name") or item.get("label") or ""
+            item = ImageAnalysis._text(item).lstrip('-•').strip()
+            if item.lower() not in ANALYSIS_EMPTY_VALUES and item not in items:
+                items.append(item)
+        return items
+
+    @classmethod
+    def from_mapping(cls, data: Dict) -> 'ImageAnalysis':
+        """Coerce a decoded reply to the schema; unknown keys are ignored, canonical keys win over aliases"""
+        if not isinstance(data, dict):
+            raise AnalysisParseError(f"expected a JSON object, got {type(data).__name__}")
+
+        analysis = cls()
+        seen = set()
+        for key, value in data.items():
+            normalized = re.sub(r'[\s\-]+', '_', str(key).strip().lower())
+            name = ANALYSIS_ALIASES.get(normalized)
+            if name is None or (name in seen and normalized != name):
+                continue
+            seen.add(name)
+            setattr(analysis, name, cls._list(value) if name in ANALYSIS_LIST_FIELDS else cls._text(value))
+
+        if not analysis.main_subject:
+            analysis.main_subject = analysis.setting or (analysis.objects[0] if analysis.objects else "")
+        if not analysis.main_subject:
+            raise AnalysisParseError("reply has no recognisable analysis fields")
+        return analysis
+
+    def to_dict(self) -> Dict:
+        """Analysis dict as used by the metadata generators; empty text fields are left to their defaults"""
+        result = {}
+        for name in ImageAnalysis.__slots__:
+            value = getattr(self, name)
+            if value or name in ANALYSIS_LIST_FIELDS:
+                result[name] = value
+        return result
+
+def _json_candidates(text: str, start: int) -> List[str]:
+    """Scan one JSON object or array starting at text[start]
+
+    Returns the balanced value or, for a reply cut off mid-stream, the longest
+    prefixes that can be closed into valid JSON.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    cuts = deque(maxlen=3)  # (index, open brackets) at the last few top-level separators
+
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if not stack or stack.pop() != char:
+                return []
+            if not stack:
+                return [text[start:index + 1]]
+        elif char == ',':
+            cuts.append((index, ''.join(reversed(stack))))
+
+    # Truncated: close the reply as it stands unless it stops mid-string (a cut-off
+    # word), else drop the unfinished member
+    candidates = [] if in_string else [text[start:] + ''.join(reversed(stack))]
+    candidates += [text[start:index] + closing for index, closing in reversed(cuts)]
+    return candidates
+
+# Each bracket tried costs a scan to the end of the reply, so stop after this many
+JSON_MAX_STARTS = 16
+
+def _first_json(text: str, opener: str, accept) -> Optional[object]:
+    start = text.find(opener)
+    for _ in range(JSON_MAX_STARTS):
+        if start == -1:
+            break
+        for candidate in _json_candidates(text, start):
+            try:
+                value = json.loads(candidate)
+            except (ValueError, RecursionError):
+                # RecursionError: absurdly deep nesting, e.g. a reply stuck repeating "["
+                continue
+            if accept(value):
+                return value
+        # Not JSON (e.g. a "{placeholder}" in prose): try the next bracket
+        start = text.find(opener, start + 1)
+    return None
+
+def extract_json_object(text: str) -> Optional[Dict]:
+    """The first JSON object in a reply, skipping prose and markdown fences around it"""
+    return _first_json(text, '{', lambda value: isinstance(value, dict))
+
+def extract_json_array(text: str) -> Optional[List]:
+    """The first JSON array of objects in a reply, also when wrapped as {"images": [...]}"""
+    return _first_json(text, '[', lambda value: isinstance(value, list) and any(isinstance(item, dict) for item in value))
+
+_FIELD_LABELS = sorted(ANALYSIS_ALIASES, key=len, reverse=True)
+# "Main subject: ...", "- **Colors**: ...", "2. Setting - ..." and similar labelled lines
+_LABELLED_LINE = re.compile(
+    r'^[\s>#*\-•\d.)]*(?:\*\*|__)?\s*('
+    + '|'.join(label.replace('_', r'[\s_]') for label in _FIELD_LABELS)
+    + r')\s*(?:\*\*|__)?\s*[:\-–—]\s*(?:\*\*|__)?\s*(.*?)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+_BULLET_LINE = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s+(.+?)\s*$')
+_FENCE_LINE = re.compile(r'^\s*```')
+
+def extract_text_fields(text: str) -> Dict:
+    """Analysis fields from a labelled prose reply; bullets under a label continue its value"""
+    fields = {}
+    current = None
+    for line in text.splitlines():
+        if _FENCE_LINE.match(line):
+            continue
+        match = _LABELLED_LINE.match(line)
+        if match:
+            current = ANALYSIS_ALIASES[re.sub(r'[\s_]+', '_', match.group(1).lower())]
+            value = match.group(2).rstrip('*_ ').strip()
+            fields.setdefault(current, [])
+            if value:
+                fields[current].append(value)
+            continue
+        bullet = _BULLET_LINE.match(line)
+        if bullet and current is not None:
+            fields[current].append(bullet.group(1))
+        elif line.strip():
+            current = None
+    return {
+        name: [item for value in values for item in _split_list(value)] if name in ANALYSIS_LIST_FIELDS
+        else " ".join(values)
+        for name, values in fields.items()
+    }
+
+def parse_analysis(text: str) -> Tuple[Dict, bool]:
+    """Provider reply -> validated analysis dict, and whether it came from JSON
+
+    Raises AnalysisParseError when the reply holds neither a JSON object nor labelled fields.
+    """
+    if not text or not text.strip():
+        raise AnalysisParseError("empty reply")
+    data = extract_json_object(text)
+    if data is not None:
+        if len(data) == 1 and isinstance(next(iter(data.values())), dict):
+            # Unwrap {"analysis": {...}} style envelopes
+            data = next(iter(data.values()))
+        try:
+            return ImageAnalysis.from_mapping(data).to_dict(), True
+        except AnalysisParseError:
+            pass
+    fields = extract_text_fields(text)
+    if not fields:
+        raise AnalysisParseError("reply is neither JSON nor labelled text")
+    return ImageAnalysis.from_mapping(fields).to_dict(), False
+
+def parse_pack(text: str, count: int) -> List[Optional[Dict]]:
+    """Split a multi-image reply into per-image analyses, None for images it does not cover"""
+    results = [None] * count
+    entries = extract_json_array(text or "") or []
+    numbers = [entry.get("image") for entry in entries if isinstance(entry, dict)]
+    # Entries are matched by their "image" number (1-based unless the reply counts from 0), else by position
+    base = 0 if 0 in numbers else 1
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        number = entry.get("image")
+        slot = number - base if isinstance(number, int) and 0 <= number - base < count else position
+        if slot >= count or results[slot] is not None:
+            continue
+        try:
+            results[slot] = ImageAnalysis.from_mapping(entry).to_dict()
+        except AnalysisParseError:
+            pass
+    return results
+
+class AnalysisCache:
+    """Content-addressed LRU cache of image analyses with an optional SQLite tier"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires_at, analysis)
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache "
+                "(key TEXT PRIMARY KEY, analysis TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls, prefix: str = 'ANALYSIS_CACHE', max_entries: int = 1024, ttl: float = 86400) -> 'AnalysisCache':
+        """Build a cache configured from <prefix>_SIZE, _TTL and _DB environment variables"""
+        return cls(
+            max_entries=int(os.getenv(f'{prefix}_SIZE', str(max_entries))),
+            ttl=float(os.getenv(f'{prefix}_TTL', str(ttl))),
+            db_path=os.getenv(f'{prefix}_DB') or None
+        )
+
+    @staticmethod
+    def make_key(digest: str, provider: str, model: str) -> str:
+        """Key an analysis by image content hash plus everything that shapes the result"""
+        return f"{digest}:{provider}:{model or ''}:{PROMPT_VERSION}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a copy of the cached analysis, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT analysis, expires_at FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    analysis = json.loads(row[0])
+                    self._store(key, analysis, row[1])
+                    self.disk_hits += 1
+                    return copy.deepcopy(analysis)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, analysis: Dict):
+        """Store an analysis in memory and, if enabled, on disk"""
+        expires_at = time.time() + self.ttl
+        analysis = copy.deepcopy(analysis)
+        with self._lock:
+            self._store(key, analysis, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, analysis, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(analysis, ensure_ascii=False), expires_at)
+                )
+                self._db.commit()
+
+    def _store(self, key: str, analysis: Dict, expires_at: float):
+        self._entries[key] = (expires_at, analysis)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for the health endpoint"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "disk_enabled": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+@dataclass
+class AnalysisResult:
+    """An analysis plus where it came from"""
+    analysis: Dict
+    source: str = "provider"    # provider, offline, cache, near_duplicate or fallback
+    near_duplicate: Optional[Dict] = None
+    analysis_id: Optional[str] = None   # handle for the /api/analysis/<analysis_id>/... endpoints
+    route: Optional[Dict] = None        # complexity routing decision, when routing is on
+    error: Optional[str] = None         # why the image itself could not be read, for decode failures
+
+    def details(self) -> Dict:
+        """Fields added to API responses alongside the metadata"""
+        details = {"analysis_source": self.source}
+        if self.analysis_id:
+            details["analysis_id"] = self.analysis_id
+        if self.near_duplicate:
+            details["near_duplicate"] = self.near_duplicate
+        if self.route:
+            details["route"] = self.route
+        return details
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash of an image: row-wise brightness gradients of a tiny thumbnail"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes under the Hamming metric"""
+
+    def __init__(self):
+        self._root = None   # [hash, value, {distance: child}]
+        self.size = 0
+
+    def add(self, hash_value: int, value):
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, value, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1] = value
+                self.size -= 1
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, value, {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, object]]:
+        """(distance, value) for every entry within max_distance, nearest first"""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            # Triangle inequality: only subtrees at distance d +/- max_distance can match
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class NearDuplicateIndex:
+    """Perceptual hashes of analyzed images, so burst shots and slight crops reuse an analysis"""
+
+    def __init__(self, max_distance: int = 6, max_entries: int = 4096):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (scope, hash) -> (digest, analysis)
+        self._trees = {}                # scope -> BKTree
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> 'NearDuplicateIndex':
+        """Build an index configured from NEAR_DUPLICATE_* environment variables"""
+        return cls(
+            max_distance=int(os.getenv('NEAR_DUPLICATE_DISTANCE', '6')),
+            max_entries=int(os.getenv('NEAR_DUPLICATE_SIZE', '4096'))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_distance > 0 and self.max_entries > 0
+
+    @staticmethod
+    def scope(provider: str, model: str) -> str:
+        """Only analyses from the same provider, model and prompt are interchangeable"""
+        return f"{provider}:{model or ''}:{PROMPT_VERSION}"
+
+    def find(self, scope: str, hash_value: int) -> Optional[Tuple[int, str, Dict]]:
+        """(distance, digest, analysis copy) of the nearest indexed image, or None"""
+        with self._lock:
+            tree = self._trees.get(scope)
+            matches = tree.search(hash_value, self.max_distance) if tree else []
+            if not matches:
+                self.misses += 1
+                return None
+            self.hits += 1
+            distance, key = matches[0]
+            digest, analysis = self._entries[key]
+            return distance, digest, copy.deepcopy(analysis)
+
+    def add(self, scope: str, hash_value: int, digest: str, analysis: Dict):
+        with self._lock:
+            key = (scope, hash_value)
+            if key not in self._entries:
+                self._trees.setdefault(scope, BKTree()).add(hash_value, key)
+            self._entries[key] = (digest, copy.deepcopy(analysis))
+            self._entries.move_to_end(key)
+
+            if len(self._entries) > self.max_entries:
+                # BK-trees don't support deletion: drop the oldest quarter and rebuild
+                for _ in range(max(1, self.max_entries // 4)):
+                    self._entries.popitem(last=False)
+                self._trees = {}
+                for entry_scope, entry_hash in self._entries:
+                    self._trees.setdefault(entry_scope, BKTree()).add(entry_hash, (entry_scope, entry_hash))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+# Arabic names for the offline palette, used to seed the translation memory
+NAMED_COLORS_AR = {
+    "black": "أسود",
+    "white": "أبيض",
+    "gray": "رمادي",
+    "red": "أحمر",
+    "orange": "برتقالي",
+    "yellow": "أصفر",
+    "gold": "ذهبي",
+    "beige": "بيج",
+    "brown": "بني",
+    "green": "أخضر",
+    "teal": "أزرق مخضر",
+    "blue": "أزرق",
+    "light blue": "أزرق فاتح",
+    "purple": "بنفسجي",
+    "pink": "وردي"
+}
+
+class TranslatorBackend:
+    """Upstream translation service consulted on translation-memory misses"""
+
+    name = "base"
+
+    def translate(self, texts: List[str], src: str, dest: str) -> List[str]:
+        raise NotImplementedError
+
+class GoogleTranslateBackend(TranslatorBackend):
+    """googletrans backend, translating a whole list in one call"""
+
+    name = "google"
+
+    def __init__(self):
+        self._translator = Translator()
+        # googletrans keeps per-client state and is not safe to share across threads
+        self._lock = threading.Lock()
+
+    def translate(self, texts: List[str], src: str, dest: str) -> List[str]:
+        with self._lock:
+            results = self._translator.translate(texts, src=src, dest=dest)
+        return [result.text for result in results]
+
+class DictionaryBackend(TranslatorBackend):
+    """Local stand-in backend for tests and air-gapped setups"""
+
+    name = "dictionary"
+
+    def __init__(self, entries: Dict[Tuple[str, str, str], str] = None):
+        self.entries = entries or {}
+        self.calls = 0
+
+    def translate(self, texts: List[str], src: str, dest: str) -> List[str]:
+        self.calls += 1
+        return [self.entries.get((src, dest, text.lower()), text) for text in texts]
+
+TRANSLATOR_BACKENDS = {
+    "google": GoogleTranslateBackend,
+    "dictionary": DictionaryBackend
+}
+
+class TranslationMemory:
+    """EN<->AR translation memory: pinned seed terms, an LRU and an optional SQLite store"""
+
+    def __init__(self, backend: TranslatorBackend, max_entries: int = 10000, db_path: str = None):
+        self.backend = backend
+        self.max_entries = max_entries
+        self._pinned = {}               # seed terms, never evicted
+        self._entries = OrderedDict()   # (src, dest, text) -> translation
+        self._inflight = {}             # (src, dest, text) -> Future shared by concurrent callers
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+        self.shared_waits = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS translations "
+                "(src TEXT NOT NULL, dest TEXT NOT NULL, text TEXT NOT NULL, translation TEXT NOT NULL, "
+                "PRIMARY KEY (src, dest, text))"
+            )
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'TranslationMemory':
+        """Build a memory configured from TRANSLATOR_BACKEND and TRANSLATION_MEMORY_* variables"""
+        backend = TRANSLATOR_BACKENDS[os.getenv('TRANSLATOR_BACKEND', 'google')]()
+        return cls(
+            backend,
+            max_entries=int(os.getenv('TRANSLATION_MEMORY_SIZE', '10000')),
+            db_path=os.getenv('TRANSLATION_MEMORY_DB') or None
+        )
+
+    @staticmethod
+    def _key(text: str, src: str, dest: str) -> Tuple[str, str, str]:
+        return (src, dest, " ".join(text.split()).lower())
+
+    @staticmethod
+    def source_lang(dest: str) -> str:
+        return 'en' if dest == 'ar' else 'ar'
+
+    def seed(self, pairs):
+        """Pin known (english, arabic) pairs in both directions"""
+        with self._lock:
+            for english, arabic in pairs:
+                self._pinned[self._key(english, 'en', 'ar')] = arabic
+                self._pinned[self._key(arabic, 'ar', 'en')] = english
+
+    def lookup(self, text: str, dest: str) -> Optional[str]:
+        """Translation from memory only, never calling the backend"""
+        key = self._key(text, self.source_lang(dest), dest)
+        with self._lock:
+            return self._lookup(key)
+
+    def _lookup(self, key) -> Optional[str]:
+        translation = self._pinned.get(key)
+        if translation is not None:
+            return translation
+
+        translation = self._entries.get(key)
+        if translation is not None:
+            self._entries.move_to_end(key)
+            return translation
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT translation FROM translations WHERE src = ? AND dest = ? AND text = ?", key
+            ).fetchone()
+            if row:
+                self._store(key, row[0])
+                return row[0]
+        return None
+
+    def _store(self, key, translation: str):
+        self._entries[key] = translation
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def translate(self, text: str, dest: str) -> str:
+        return self.translate_many([text], dest)[0]
+
+    def translate_many(self, texts: List[str], dest: str) -> List[str]:
+        """Translate a list, sending only de-duplicated misses upstream in one call"""
+        src = self.source_lang(dest)
+        keys = [self._key(text, src, dest) for text in texts]
+        results = {}
+        waiting = {}
+        owned = {}
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in results or key in waiting or key in owned:
+                    continue
+                translation = self._lookup(key)
+                if translation is not None:
+                    self.hits += 1
+                    results[key] = translation
+                elif key in self._inflight:
+                    # Another request is already fetching this term
+                    self.shared_waits += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    self.misses += 1
+                    owned[key] = text
+                    self._inflight[key] = Future()
+            if owned:
+                self.upstream_calls += 1
+
+        if owned:
+            try:
+                translations = self.backend.translate(list(owned.values()), src, dest)
+                if len(translations) != len(owned):
+                    raise ValueError(f"{self.backend.name} backend returned {len(translations)} "
+                                     f"translation(s) for {len(owned)} text(s)")
+            except Exception as e:
+                with self._lock:
+                    for key in owned:
+                        self._inflight.pop(key).set_exception(e)
+                raise
+
+            with self._lock:
+                for key, translation in zip(owned, translations):
+                    self._store(key, translation)
+                    self._inflight.pop(key).set_result(translation)
+                    results[key] = translation
+                if self._db is not None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO translations (src, dest, text, translation) VALUES (?, ?, ?, ?)",
+                        [key + (results[key],) for key in owned]
+                    )
+                    self._db.commit()
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+
+        return [results[key] for key in keys]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for the health endpoint"""
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "pinned": len(self._pinned),
+                "entries": len(self._entries),
+                "disk_enabled": self._db is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "upstream_calls": self.upstream_calls,
+                "shared_waits": self.shared_waits
+            }
+
+# Arabs Stock specific categories
+CATEGORIES = {
+    "People": "أشخاص",
+    "Business": "أعمال",
+    "Technology": "تكنولوجيا",
+    "Culture": "ثقافة",
+    "Architecture": "عمارة",
+    "Nature": "طبيعة",
+    "Food": "طعام",
+    "Travel": "سفر",
+    "Education": "تعليم",
+    "Healthcare": "صحة",
+    "Sports": "رياضة",
+    "Art": "فن",
+    "Religion": "دين",
+    "Fashion": "أزياء",
+    "Transportation": "نقل"
+}
+DEFAULT_CATEGORY = "People"
+
+# Analysis fields the rules can look at
+RULE_FIELDS = ("main_subject", "people", "objects", "setting", "mood", "style", "cultural_context")
+
+# Keyword rules: when any term occurs in one of the fields, add the EN/AR keywords.
+# An empty term list matches whenever the field is non-empty.
+KEYWORD_RULES = [
+    {"fields": ("main_subject",), "terms": ["business", "meeting", "professional"],
+     "en": ["business", "professional", "meeting", "office", "corporate", "teamwork"],
+     "ar": ["أعمال", "مهني", "اجتماع", "مكتب", "شركات", "عمل جماعي"]},
+    {"fields": ("main_subject",), "terms": ["technology", "computer", "digital"],
+     "en": ["technology", "digital", "innovation", "computer", "tech"],
+     "ar": ["تكنولوجيا", "رقمي", "ابتكار", "كمبيوتر", "تقني"]},
+    {"fields": ("people",), "terms": [],
+     "en": ["people", "person", "team", "group", "professional"],
+     "ar": ["أشخاص", "شخص", "فريق", "مجموعة", "مهني"]},
+    {"fields": ("cultural_context",), "terms": ["arab", "arabic", "middle", "middle eastern", "gulf"],
+     "en": ["Arab", "Middle Eastern", "Islamic", "Muslim", "Gulf"],
+     "ar": ["عربي", "شرق أوسطي", "إسلامي", "مسلم", "خليجي"]},
+    {"fields": ("mood",), "terms": ["professional"],
+     "en": ["success", "achievement", "excellence"],
+     "ar": ["نجاح", "إنجاز", "تميز"]},
+    {"fields": ("main_subject", "setting", "objects"), "terms": ["nature", "landscape", "desert", "plants", "tree"],
+     "en": ["nature", "landscape", "outdoor", "scenic"],
+     "ar": ["طبيعة", "منظر طبيعي", "في الهواء الطلق", "خلاب"]},
+    {"fields": ("main_subject", "setting", "objects"), "terms": ["architecture", "building", "city", "skyline"],
+     "en": ["architecture", "city", "urban", "building"],
+     "ar": ["عمارة", "مدينة", "حضري", "مبنى"]},
+    {"fields": ("main_subject", "objects"), "terms": ["food", "dish", "meal", "coffee", "dates", "restaurant"],
+     "en": ["food", "cuisine", "meal", "hospitality"],
+     "ar": ["طعام", "مطبخ", "وجبة", "ضيافة"]},
+    {"fields": ("main_subject", "setting", "cultural_context"), "terms": ["mosque", "prayer", "ramadan", "quran", "eid"],
+     "en": ["Islamic", "religion", "faith", "Ramadan"],
+     "ar": ["إسلامي", "دين", "إيمان", "رمضان"]},
+]
+
+# Category rules in priority order; the first rule that matches wins
+CATEGORY_RULES = [
+    {"category": "Business", "fields": ("main_subject",),
+     "terms": ["business", "meeting", "professional", "office"]},
+    {"category": "People", "fields": ("main_subject",),
+     "terms": ["people", "person", "family", "group", "portrait"]},
+    {"category": "Technology", "fields": ("main_subject", "objects"),
+     "terms": ["technology", "computer", "digital", "tech", "laptop", "smartphone"]},
+    {"category": "Culture", "fields": ("cultural_context",),
+     "terms": ["culture", "traditional", "heritage", "islamic"]},
+    {"category": "Architecture", "fields": ("setting", "main_subject"),
+     "terms": ["building", "architecture", "construction", "city", "skyline"]},
+    {"category": "Religion", "fields": ("main_subject", "setting", "objects"),
+     "terms": ["mosque", "prayer", "quran", "ramadan", "eid"]},
+    {"category": "Food", "fields": ("main_subject", "objects"),
+     "terms": ["food", "dish", "meal", "cuisine", "restaurant", "dates"]},
+    {"category": "Education", "fields": ("main_subject", "setting"),
+     "terms": ["school", "student", "classroom", "university", "teacher", "education"]},
+    {"category": "Healthcare", "fields": ("main_subject", "setting"),
+     "terms": ["hospital", "doctor", "nurse", "medical", "clinic", "health"]},
+    {"category": "Sports", "fields": ("main_subject", "setting"),
+     "terms": ["sport", "football", "stadium", "fitness", "athlete", "horse", "camel race"]},
+    {"category": "Fashion", "fields": ("main_subject", "objects"),
+     "terms": ["fashion", "abaya", "thobe", "clothing", "jewelry", "model"]},
+    {"category": "Transportation", "fields": ("main_subject", "objects", "setting"),
+     "terms": ["car", "airport", "airplane", "metro", "train", "road", "highway"]},
+    {"category": "Travel", "fields": ("main_subject", "setting"),
+     "terms": ["travel", "tourism", "tourist", "hotel", "landmark", "beach"]},
+    {"category": "Art", "fields": ("main_subject", "style"),
+     "terms": ["art", "calligraphy", "painting", "sculpture", "pattern"]},
+    {"category": "Nature", "fields": ("main_subject", "setting"),
+     "terms": ["nature", "landscape", "desert", "mountain", "sea", "oasis"]},
+]
+
+# License rules; images that match none are commercial
+LICENSE_RULES = [
+    {"license": "editorial", "fields": ("main_subject", "objects", "setting"),
+     "terms": ["news", "event", "celebrity", "politician", "protest", "demonstration",
+               "breaking news", "journalism", "reporter", "interview", "press conference"]},
+]
+DEFAULT_LICENSE = "commercial"
+
+# Keyword ranking: weight by the analysis field a keyword came from, boost terms in
+# the trending table, then keep the top KEYWORD_LIMIT with a stable tie-breaker
+KEYWORD_LIMIT = 30
+KEYWORD_FIELD_WEIGHTS = {
+    "main_subject": 5.0,
+    "objects": 4.0,
+    "people": 3.0,
+    "setting": 3.0,
+    "cultural_context": 2.5,
+    "mood": 2.0,
+    "style": 2.0,
+    "colors": 2.0,
+    "trending": 1.0
+}
+TRENDING_BOOST = 1.5
+TRENDING_PICKS = 5
+
+def analysis_seed(analysis: Dict) -> str:
+    """Stable seed for an analysis, identical across processes and restarts"""
+    return hashlib.sha1(json.dumps(analysis, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def _tie_breaker(seed: str, keyword: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{seed}:{keyword}".encode('utf-8'), digest_size=8).digest(), 'big')
+
+def rank_keywords(candidates: List[Tuple[str, float]], seed: str, limit: int = KEYWORD_LIMIT,
+                  boosted: set = frozenset()) -> List[str]:
+    """Top `limit` keywords by score, case-insensitively de-duplicated.
+
+    A keyword seen several times keeps its best score and the spelling it was
+    first seen with; ties are broken by a hash seeded per analysis.
+    """
+    best = OrderedDict()
+    for keyword, score in candidates:
+        if not isinstance(keyword, str):
+            continue
+        keyword = keyword.strip()
+        key = keyword.lower()
+        if len(key) <= 1:
+            continue
+        if key in boosted:
+            score += TRENDING_BOOST
+        if key not in best or score > best[key][1]:
+            best[key] = (best[key][0] if key in best else keyword, score)
+
+    top = heapq.nlargest(limit, best.items(), key=lambda item: (item[1][1], _tie_breaker(seed, item[0])))
+    return [keyword for _, (keyword, _) in top]
+
+class MetadataRules:
+    """Keyword, category and license rules compiled into a single regex.
+
+    Terms match at the start of a word, so "business" also fires on
+    "businessman" and "building" on "buildings", but no longer inside a word
+    ("art" in "party"). The rule fields are joined into one lowercased text
+    and scanned in a single pass; hits are mapped back to their field and
+    resolved against every rule, so adding rules does not add passes.
+    """
+
+    def __init__(self, keyword_rules: List[Dict] = None, category_rules: List[Dict] = None,
+                 license_rules: List[Dict] = None, categories: Dict[str, str] = None):
+        self.keyword_rules = keyword_rules if keyword_rules is not None else KEYWORD_RULES
+        self.category_rules = category_rules if category_rules is not None else CATEGORY_RULES
+        self.license_rules = license_rules if license_rules is not None else LICENSE_RULES
+        self.categories = categories or CATEGORIES
+
+        # term -> rule ids it fires ("k3", "c0", "l0", ...)
+        term_rules = {}
+        presence_rules = {}
+        for prefix, rules in (("k", self.keyword_rules), ("c", self.category_rules), ("l", self.license_rules)):
+            for index, rule in enumerate(rules):
+                rule_id = f"{prefix}{index}"
+                if not rule["terms"]:
+                    for name in rule["fields"]:
+                        presence_rules.setdefault(name, set()).add(rule_id)
+                for term in rule["terms"]:
+                    term_rules.setdefault(term.lower(), set()).add(rule_id)
+
+        # The regex reports one (longest) term per position, so a term also carries
+        # the rules of any shorter term found inside it ("breaking news" -> "news")
+        terms = sorted(term_rules, key=len, reverse=True)
+        for term in terms:
+            for other in terms:
+                if other != term and re.search(self._word(other), term):
+                    term_rules[term] |= term_rules[other]
+
+        self.term_rules = {term: frozenset(ids) for term, ids in term_rules.items()}
+        self.presence_rules = presence_rules
+        self.pattern = re.compile(self._word('|'.join(re.escape(term) for term in terms))) if terms else None
+
+    @staticmethod
+    def _word(alternatives: str) -> str:
+        return r'\b(?:' + alternatives + r')'
+
+    def scan(self, analysis: Dict) -> Dict[str, set]:
+        """Rule ids hit in each analysis field"""
+        hits = {}
+        texts = []
+        starts = []     # offset of each field in the joined text
+        offset = 0
+        for name in RULE_FIELDS:
+            value = analysis.get(name)
+            if isinstance(value, list):
+                text = " ; ".join(item for item in value if isinstance(item, str))
+            else:
+                text = value if isinstance(value, str) else ""
+            # Terms never span lines, so a match can't run from one field into the next
+            text = text.lower().replace("\n", " ")
+            hits[name] = set(self.presence_rules.get(name, ())) if text.strip() else set()
+            texts.append(text)
+            starts.append(offset)
+            offset += len(text) + 1
+
+        if self.pattern is not None:
+            for match in self.pattern.finditer("\n".join(texts)):
+                name = RULE_FIELDS[bisect.bisect_right(starts, match.start()) - 1]
+                hits[name] |= self.term_rules[match.group(0)]
+        return hits
+
+    def _matches(self, rule_id: str, rule: Dict, hits: Dict[str, set]) -> bool:
+        return any(rule_id in hits.get(name, ()) for name in rule["fields"])
+
+    def keyword_matches(self, hits: Dict[str, set]) -> List[Tuple[Dict, str]]:
+        """Keyword rules that fired, each with the first of its fields that fired it"""
+        matches = []
+        for index, rule in enumerate(self.keyword_rules):
+            rule_id = f"k{index}"
+            for name in rule["fields"]:
+                if rule_id in hits.get(name, ()):
+                    matches.append((rule, name))
+                    break
+        return matches
+
+    def keywords(self, hits: Dict[str, set]) -> Dict[str, List[str]]:
+        """EN/AR keywords from every keyword rule that fired, in table order"""
+        result = {"en": [], "ar": []}
+        for rule, _ in self.keyword_matches(hits):
+            result["en"].extend(rule["en"])
+            result["ar"].extend(rule["ar"])
+        return result
+
+    def category(self, hits: Dict[str, set]) -> Tuple[str, str]:
+        """Highest-priority matching category as (en, ar)"""
+        for index, rule in enumerate(self.category_rules):
+            if self._matches(f"c{index}", rule, hits):
+                return rule["category"], self.categories[rule["category"]]
+        return DEFAULT_CATEGORY, self.categories[DEFAULT_CATEGORY]
+
+    def matching_categories(self, hits: Dict[str, set]) -> List[Tuple[str, str]]:
+        """Every matching category in priority order, ending with the default"""
+        names = [rule["category"] for index, rule in enumerate(self.category_rules)
+                 if self._matches(f"c{index}", rule, hits)]
+        names.append(DEFAULT_CATEGORY)
+        return [(name, self.categories[name]) for name in dict.fromkeys(names)]
+
+    def license(self, hits: Dict[str, set]) -> str:
+        for index, rule in enumerate(self.license_rules):
+            if self._matches(f"l{index}", rule, hits):
+                return rule["license"]
+        return DEFAULT_LICENSE
+
+class KeywordIndex:
+    """Keyword co-occurrence counts per language, queried by positive PMI.
+
+    Memory is bounded: the vocabulary keeps roughly the `max_terms` most
+    frequent keywords and each keyword its `max_neighbors` strongest
+    co-occurrences. Counts are flushed to an optional SQLite file in batches.
+    """
+
+    def __init__(self, max_terms: int = 5000, max_neighbors: int = 64, db_path: str = None,
+                 flush_every: int = 50, min_count: int = 2):
+        self.max_terms = max_terms
+        self.min_count = min_count
+        self.max_neighbors = max_neighbors
+        self.flush_every = flush_every
+        self._terms = {}       # lang -> {key: [count, display]}
+        self._neighbors = {}   # lang -> {key: {other_key: count}}
+        self._docs = {}        # lang -> keyword sets seen
+        self._pending = []     # (lang, keys, displays) not yet written to disk
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.evictions = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS keyword_terms "
+                "(lang TEXT NOT NULL, term TEXT NOT NULL, display TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (lang, term))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS keyword_pairs "
+                "(lang TEXT NOT NULL, a TEXT NOT NULL, b TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (lang, a, b))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS keyword_docs (lang TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+            )
+            self._db.commit()
+            self._load()
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls) -> 'KeywordIndex':
+        """Build an index configured from KEYWORD_INDEX_* environment variables"""
+        return cls(
+            max_terms=int(os.getenv('KEYWORD_INDEX_TERMS', '5000')),
+            max_neighbors=int(os.getenv('KEYWORD_INDEX_NEIGHBORS', '64')),
+            min_count=int(os.getenv('KEYWORD_INDEX_MIN_COUNT', '2')),
+            db_path=os.getenv('KEYWORD_INDEX_DB') or None
+        )
+
+    @staticmethod
+    def _key(keyword: str) -> str:
+        return " ".join(keyword.split()).lower()
+
+    def _normalize(self, keywords: List[str]) -> Tuple[List[str], Dict[str, str]]:
+        """Ordered unique keys (capped at KEYWORD_LIMIT) and their first spellings"""
+        displays = OrderedDict()
+        for keyword in keywords:
+            if not isinstance(keyword, str):
+                continue
+            key = self._key(keyword)
+            if len(key) > 1 and key not in displays:
+                displays[key] = keyword.strip()
+        keys = list(displays)[:KEYWORD_LIMIT]
+        return keys, {key: displays[key] for key in keys}
+
+    def _load(self):
+        """Rebuild the bounded in-memory index from the most frequent persisted counts"""
+        for lang, count in self._db.execute("SELECT lang, count FROM keyword_docs"):
+            self._docs[lang] = count
+        for lang in self._docs:
+            terms = self._terms.setdefault(lang, {})
+            for term, display, count in self._db.execute(
+                "SELECT term, display, count FROM keyword_terms WHERE lang = ? ORDER BY count DESC LIMIT ?",
+                (lang, self.max_terms)
+            ):
+                terms[term] = [count, display]
+            neighbors = self._neighbors.setdefault(lang, {})
+            for a, b, count in self._db.execute(
+                "SELECT a, b, count FROM keyword_pairs WHERE lang = ? ORDER BY count DESC", (lang,)
+            ):
+                if a in terms and b in terms:
+                    adjacent = neighbors.setdefault(a, {})
+                    if len(adjacent) < self.max_neighbors:
+                        adjacent[b] = count
+
+    @staticmethod
+    def _prune(counts: Dict, limit: int, weight) -> int:
+        """Drop the weakest entries once a table grows 25% past its limit"""
+        if len(counts) <= limit + limit // 4:
+            return 0
+        weakest = heapq.nsmallest(len(counts) - limit, counts, key=lambda key: weight(counts[key]))
+        for key in weakest:
+            del counts[key]
+        return len(weakest)
+
+    def add(self, lang: str, keywords: List[str]):
+        """Count one keyword set (generated or accepted by a user)"""
+        keys, displays = self._normalize(keywords)
+        if not keys:
+            return
+
+        with self._lock:
+            terms = self._terms.setdefault(lang, {})
+            neighbors = self._neighbors.setdefault(lang, {})
+            self._docs[lang] = self._docs.get(lang, 0) + 1
+
+            for key in keys:
+                entry = terms.get(key)
+                if entry is None:
+                    terms[key] = [1, displays[key]]
+                else:
+                    entry[0] += 1
+
+            for a in keys:
+                adjacent = neighbors.setdefault(a, {})
+                for b in keys:
+                    if a != b:
+                        adjacent[b] = adjacent.get(b, 0) + 1
+                self._prune(adjacent, self.max_neighbors, lambda count: count)
+
+            evicted = self._prune(terms, self.max_terms, lambda entry: entry[0])
+            if evicted:
+                self.evictions += evicted
+                for key in [key for key in neighbors if key not in terms]:
+                    del neighbors[key]
+
+            if self._db is not None:
+                self._pending.append((lang, keys, displays))
+                if len(self._pending) >= self.flush_every:
+                    self._flush()
+
+    def flush(self):
+        """Write pending counts to disk"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._db is None or not self._pending:
+            return
+
+        docs, term_counts, pair_counts, displays = {}, {}, {}, {}
+        for lang, keys, names in self._pending:
+            docs[lang] = docs.get(lang, 0) + 1
+            for key in keys:
+                term_counts[(lang, key)] = term_counts.get((lang, key), 0) + 1
+                displays.setdefault((lang, key), names[key])
+                for other in keys:
+                    if other != key:
+                        pair_counts[(lang, key, other)] = pair_counts.get((lang, key, other), 0) + 1
+        self._pending = []
+
+        self._db.executemany(
+            "INSERT INTO keyword_docs (lang, count) VALUES (?, ?) "
+            "ON CONFLICT (lang) DO UPDATE SET count = count + excluded.count",
+            list(docs.items())
+        )
+        self._db.executemany(
+            "INSERT INTO keyword_terms (lang, term, display, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (lang, term) DO UPDATE SET count = count + excluded.count",
+            [key + (displays[key], count) for key, count in term_counts.items()]
+        )
+        self._db.executemany(
+            "INSERT INTO keyword_pairs (lang, a, b, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (lang, a, b) DO UPDATE SET count = count + excluded.count",
+            [key + (count,) for key, count in pair_counts.items()]
+        )
+        self._db.commit()
+
+    def suggest(self, lang: str, keywords: List[str], limit: int = 10) -> List[str]:
+        """Top neighbors of the given keywords by positive PMI, weighted by co-occurrence"""
+        keys, _ = self._normalize(keywords)
+        existing = set(keys)
+        scores = {}
+
+        with self._lock:
+            terms = self._terms.get(lang, {})
+            neighbors = self._neighbors.get(lang, {})
+            docs = self._docs.get(lang, 0)
+
+            for key in keys:
+                if key not in terms:
+                    continue
+                key_count = terms[key][0]
+                for other, count in neighbors.get(key, {}).items():
+                    # A single co-occurrence is not evidence, however rare the pair
+                    if count < self.min_count or other in existing or other not in terms:
+                        continue
+                    pmi = math.log(count * docs / (key_count * terms[other][0]))
+                    if pmi > 0:
+                        scores[other] = scores.get(other, 0.0) + pmi * math.log1p(count)
+
+            top = heapq.nsmallest(limit, scores, key=lambda other: (-scores[other], other))
+            return [terms[other][1] for other in top]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "languages": {lang: {"keyword_sets": self._docs.get(lang, 0), "terms": len(terms)}
+                              for lang, terms in self._terms.items()},
+                "max_terms": self.max_terms,
+                "max_neighbors": self.max_neighbors,
+                "evictions": self.evictions,
+                "disk_enabled": self._db is not None,
+                "pending_writes": len(self._pending)
+            }
+
+# Who is asking, for fair queueing in the rate limiter (set per request)
+current_caller = contextvars.ContextVar('current_caller', default='anonymous')
+
+# Rough token cost of one vision call, used to charge the tokens-per-minute budget
+PROMPT_TOKENS = 150
+MAX_OUTPUT_TOKENS = 300
+
+def estimate_tokens(provider: AIProvider, prepared: PreparedImage) -> int:
+    """Estimated prompt + image + completion tokens for analyzing a prepared image"""
+    return PROMPT_TOKENS + _image_tokens(provider, prepared) + MAX_OUTPUT_TOKENS
+
+def estimate_pack_tokens(provider: AIProvider, images: List[PreparedImage]) -> int:
+    """Estimated tokens for one multi-image request: the prompt once, image and completion tokens per image"""
+    return PROMPT_TOKENS + sum(_image_tokens(provider, image) + MAX_OUTPUT_TOKENS for image in images)
+
+def _image_tokens(provider: AIProvider, prepared: PreparedImage) -> int:
+    if provider == AIProvider.OPENAI:
+        # High-detail images are fit into 2048px, shortest side to 768px, then billed per 512px tile
+        width, height = prepared.image.size
+        scale = min(1.0, 2048 / max(width, height))
+        scale *= min(1.0, 768 / (min(width, height) * scale))
+        tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+        return 85 + 170 * tiles
+    return 258
+
+class RateLimitExceeded(Exception):
+    """Raised when a call waited longer than allowed for rate-limit capacity"""
+
+class TokenBucket:
+    """Refills `per_minute` units per minute, holding at most one minute's worth"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (requests larger than capacity wait for a full bucket)"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.available -= min(amount, self.capacity)
+
+class ProviderRateLimiter:
+    """Requests- and tokens-per-minute budget for one provider key.
+
+    Callers queue instead of hitting the provider's 429s. Waiting calls are
+    granted round-robin across callers, so one large batch cannot starve
+    everyone else.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queues = OrderedDict()   # caller -> deque of waiters, rotated after each grant
+
+        self.granted = 0
+        self.timeouts = 0
+        self.queued_tokens = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _head(self):
+        for waiters in self._queues.values():
+            return waiters[0]
+        return None
+
+    def _enqueue(self, waiter: List):
+        self._queues.setdefault(waiter[0], deque()).append(waiter)
+        self.queued_tokens += waiter[1]
+
+    def _leave(self, waiter: List):
+        waiters = self._queues[waiter[0]]
+        waiters.remove(waiter)
+        if waiters:
+            self._queues.move_to_end(waiter[0])
+        else:
+            del self._queues[waiter[0]]
+        self.queued_tokens -= waiter[1]
+        self._changed.notify_all()
+
+    def _try_grant(self, waiter: List) -> float:
+        """0 when the waiter got its budget, otherwise seconds worth waiting before trying again"""
+        if self._head() is not waiter:
+            return self.POLL_INTERVAL
+        now = time.monotonic()
+        delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(waiter[1], now))
+        if delay > 0:
+            return delay
+
+        self.requests.take(1)
+        self.tokens.take(waiter[1])
+        self._leave(waiter)
+        waited = now - waiter[2]
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return 0.0
+
+    def acquire(self, tokens: int, caller: str = 'anonymous', timeout: float = 30.0) -> bool:
+        """Block until one request and `tokens` tokens are available, or the timeout passes"""
+        waiter = [caller, tokens, time.monotonic()]
+        deadline = waiter[2] + timeout
+        with self._changed:
+            self._enqueue(waiter)
+            while True:
+                delay = self._try_grant(waiter)
+                if delay == 0:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._leave(waiter)
+                    self.timeouts += 1
+                    return False
+                self._changed.wait(min(delay, remaining))
+
+    async def acquire_async(self, tokens: int, caller: str = 'anonymous', timeout: float = 30.0) -> bool:
+        """Async variant of acquire; waits without blocking the event loop"""
+        waiter = [caller, tokens, time.monotonic()]
+        deadline = waiter[2] + timeout
+        with self._lock:
+            self._enqueue(waiter)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._try_grant(waiter)
+                if delay == 0:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self._leave(waiter)
+                        self.timeouts += 1
+                    return False
+                await asyncio.sleep(min(delay, remaining, self.POLL_INTERVAL))
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._queues.get(waiter[0], ()):
+                    self._leave(waiter)
+            raise
+
+    def estimate_wait(self, tokens: int) -> float:
+        """Seconds a new call would wait behind everything already queued"""
+        with self._lock:
+            now = time.monotonic()
+            depth = sum(len(waiters) for waiters in self._queues.values())
+            return max(
+                self.requests.wait_time(depth + 1, now),
+                self.tokens.wait_time(self.queued_tokens + tokens, now)
+            )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            self.requests.wait_time(0, now)
+            self.tokens.wait_time(0, now)
+            return {
+                "rpm": self.requests.per_minute,
+                "tpm": self.tokens.per_minute,
+                "requests_available": None if self.requests.unlimited else round(self.requests.available, 1),
+                "tokens_available": None if self.tokens.unlimited else round(self.tokens.available),
+                "queue_depth": sum(len(waiters) for waiters in self._queues.values()),
+                "waiting_callers": len(self._queues),
+                "granted": self.granted,
+                "timeouts": self.timeouts,
+                "avg_wait": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+                "max_wait": round(self.max_wait, 3)
+            }
+
+class ProviderRateLimits:
+    """Rate limiters per provider and API key, plus the spillover policy"""
+
+    def __init__(self, limits: Dict[AIProvider, Tuple[float, float]], max_wait: float = 30.0,
+                 spillover_wait: float = 2.0):
+        self.limits = limits
+        self.max_wait = max_wait
+        self.spillover_wait = spillover_wait
+        self._limiters = {}   # (provider, key fingerprint) -> ProviderRateLimiter
+        self._lock = threading.Lock()
+        self.spillovers = {provider.value: 0 for provider in limits}
+
+    @classmethod
+    def from_env(cls) -> 'ProviderRateLimits':
+        """Build limits from *_RPM / *_TPM and RATE_LIMIT_* environment variables (0 = unlimited)"""
+        return cls(
+            limits={
+                AIProvider.OPENAI: (float(os.getenv('OPENAI_RPM', '500')), float(os.getenv('OPENAI_TPM', '150000'))),
+                AIProvider.GEMINI: (float(os.getenv('GEMINI_RPM', '60')), float(os.getenv('GEMINI_TPM', '1000000')))
+            },
+            max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', '30')),
+            spillover_wait=float(os.getenv('RATE_LIMIT_SPILLOVER_WAIT', '2'))
+        )
+
+    @staticmethod
+    def _fingerprint(api_key: str) -> str:
+        return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+
+    def limiter(self, config: AIConfig) -> ProviderRateLimiter:
+        """Limiter shared by every caller using this provider and API key"""
+        key = (config.provider, self._fingerprint(config.api_key))
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    rpm, tpm = self.limits.get(config.provider, (0, 0))
+                    limiter = self._limiters[key] = ProviderRateLimiter(rpm, tpm)
+        return limiter
+
+    def record_spillover(self, provider: AIProvider):
+        with self._lock:
+            self.spillovers[provider.value] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            limiters = dict(self._limiters)
+            spillovers = dict(self.spillovers)
+        return {
+            "max_wait": self.max_wait,
+            "spillover_wait": self.spillover_wait,
+            "spillovers": spillovers,
+            "limiters": {f"{provider.value}:{fingerprint}": limiter.stats()
+                         for (provider, fingerprint), limiter in limiters.items()}
+        }
+
+# Request metrics, exported on /metrics (Prometheus text or JSON). Values are per process.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [{**dict(zip(self.labels, key)), "value": value} for key, value in sorted(self._values.items())]
+
+class Histogram:
+    """Bucketed histogram with labels; recent samples are kept for p50/p95/p99"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS, reservoir: int = 1024):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.reservoir = reservoir
+        self._series = {}   # labels -> [bucket counts, sum, count, recent samples]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=self.reservoir)]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            series[3].append(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count, _) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (f'{bound:g}',))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total:g}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+    def percentile(self, share: float, min_samples: int = 1, **labels) -> Optional[float]:
+        """Percentile of one series' recent samples, or None with fewer than min_samples"""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            ordered = sorted(series[3]) if series else []
+        if len(ordered) < max(1, min_samples):
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+    def snapshot(self) -> List[Dict]:
+        result = []
+        with self._lock:
+            for key, (_, total, count, samples) in sorted(self._series.items()):
+                ordered = sorted(samples)
+                entry = {**dict(zip(self.labels, key)), "count": count, "sum": round(total, 6)}
+                for name, share in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+                    entry[name] = round(ordered[min(len(ordered) - 1, int(len(ordered) * share))], 6) if ordered else None
+                result.append(entry)
+        return result
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+REQUEST_LATENCY = Histogram('arabstock_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method', 'status'))
+STAGE_LATENCY = Histogram('arabstock_stage_duration_seconds', 'Time spent per analysis stage', ('stage',))
+PROVIDER_LATENCY = Histogram('arabstock_provider_duration_seconds', 'Provider round trip including retries', ('provider', 'model'))
+UPLOAD_BYTES = Histogram('arabstock_upload_bytes', 'Size of uploaded images', (), SIZE_BUCKETS)
+PROVIDER_PAYLOAD_BYTES = Histogram('arabstock_provider_payload_bytes', 'Size of images sent to providers', ('provider',), SIZE_BUCKETS)
+ANALYSES = Counter('arabstock_analyses_total', 'Analyses by where the result came from', ('source',))
+FALLBACKS = Counter('arabstock_fallbacks_total', 'Generic fallback analyses returned, by reason', ('reason',))
+TEXT_PARSE_FALLBACKS = Counter('arabstock_text_parse_fallbacks_total', 'Provider replies that were not valid JSON', ('provider',))
+PACKED_REQUESTS = Counter('arabstock_packed_requests_total', 'Multi-image provider requests', ('provider',))
+ROUTING_DECISIONS = Counter('arabstock_routing_decisions_total', 'Complexity routing decisions', ('tier', 'reason'))
+ROUTING_SCORE = Histogram('arabstock_routing_complexity_score', 'Image complexity scores seen by the router', (),
+                          (0.05, 0.1, 0.15, 0.2, 0.3, 0.45, 0.6, 0.8, 1.0))
+PACKED_ITEMS = Counter('arabstock_packed_items_total', 'Batch items sent in multi-image requests, by outcome', ('provider', 'outcome'))
+METRICS = [REQUEST_LATENCY, STAGE_LATENCY, PROVIDER_LATENCY, UPLOAD_BYTES, PROVIDER_PAYLOAD_BYTES,
+           ANALYSES, FALLBACKS, TEXT_PARSE_FALLBACKS, PACKED_REQUESTS, PACKED_ITEMS, ROUTING_DECISIONS, ROUTING_SCORE]
+
+# Optional JSON lines log of per-request traces: a file path, or '-' for stdout
+METRICS_LOG = os.getenv('METRICS_LOG')
+_metrics_log_lock = threading.Lock()
+
+class RequestTrace:
+    """Per-stage timing spans collected while one request is handled"""
+
+    def __init__(self, method: str, path: str):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = []
+
+    def finish(self, endpoint: str, status: int):
+        """Record the request latency and, if enabled, log the trace as a JSON line"""
+        duration = time.perf_counter() - self.started
+        REQUEST_LATENCY.observe(duration, endpoint=endpoint, method=self.method, status=status)
+        if not METRICS_LOG:
+            return
+        line = json.dumps({
+            "ts": round(self.timestamp, 3),
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "caller": current_caller.get(),
+            "duration": round(duration, 6),
+            "spans": self.spans
+        }, ensure_ascii=False)
+        with _metrics_log_lock:
+            if METRICS_LOG == '-':
+                print(line, flush=True)
+            else:
+                with open(METRICS_LOG, 'a', encoding='utf-8') as log:
+                    log.write(line + "\n")
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+@contextmanager
+def span(stage: str, **attributes):
+    """Time a stage: observed in the stage histogram and added to the current request trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_LATENCY.observe(duration, stage=stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append({
+                "stage": stage,
+                "start": round(started - trace.started, 6),
+                "duration": round(duration, 6),
+                **attributes
+            })
+
+def timed(stage: str):
+    """Decorator form of span for whole methods"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def render_metrics(extra: List[str] = None) -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra or [])
+    return "\n".join(lines) + "\n"
+
+class ProviderUnavailable(Exception):
+    """Raised without calling a provider whose circuit breaker is open"""
+
+def _error_status(exc: Exception) -> Optional[int]:
+    """HTTP status carried by an OpenAI or Google API error, if any"""
+    for attr in ('status_code', 'code'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+def _is_timeout(exc: Exception) -> bool:
+    return (
+        isinstance(exc, (TimeoutError, asyncio.TimeoutError, openai.APITimeoutError, requests.exceptions.Timeout))
+        or _error_status(exc) in (408, 504)
+    )
+
+def _is_retryable(exc: Exception) -> bool:
+    """Rate limits, server errors and transport failures are worth another attempt"""
+    status = _error_status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return _is_timeout(exc) or isinstance(
+        exc, (ConnectionError, openai.APIConnectionError, requests.exceptions.ConnectionError)
+    )
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Seconds from a Retry-After header on the failed response"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single probe through after a cooldown"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def available(self) -> bool:
+        """Whether allow() would let a call through, without claiming the half-open probe"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return self.state == self.CLOSED or not self._probe_in_flight
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened
+            }
+
+class ProviderResilience:
+    """Deadlines, jittered retries, circuit breakers and hedging for provider calls"""
+
+    def __init__(self, timeout: float = 30.0, deadline: float = 60.0, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, hedge_enabled: bool = False,
+                 hedge_percentile: float = 95.0, hedge_min_samples: int = 20):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        remote = [AIProvider.OPENAI, AIProvider.GEMINI]
+        self.breakers = {provider: CircuitBreaker(failure_threshold, reset_timeout) for provider in remote}
+        self._latencies = {provider: deque(maxlen=200) for provider in remote}
+        self._counters = {
+            provider: {"calls": 0, "failures": 0, "retries": 0, "timeouts": 0,
+                       "short_circuited": 0, "hedges": 0, "hedge_wins": 0}
+            for provider in remote
+        }
+        self._lock = threading.Lock()
+        self._hedge_executor = None
+
+    @classmethod
+    def from_env(cls) -> 'ProviderResilience':
+        """Build the layer from PROVIDER_*, BREAKER_* and HEDGE_* environment variables"""
+        return cls(
+            timeout=float(os.getenv('PROVIDER_TIMEOUT', '30')),
+            deadline=float(os.getenv('PROVIDER_DEADLINE', '60')),
+            max_retries=int(os.getenv('PROVIDER_MAX_RETRIES', '2')),
+            backoff_base=float(os.getenv('PROVIDER_BACKOFF_BASE', '0.5')),
+            backoff_max=float(os.getenv('PROVIDER_BACKOFF_MAX', '8')),
+            failure_threshold=int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv('BREAKER_RESET_TIMEOUT', '30')),
+            hedge_enabled=os.getenv('HEDGE_ENABLED', '').lower() in ('1', 'true', 'yes'),
+            hedge_percentile=float(os.getenv('HEDGE_PERCENTILE', '95')),
+            hedge_min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+        )
+
+    def _count(self, provider: AIProvider, name: str):
+        with self._lock:
+            self._counters[provider][name] += 1
+
+    def _retry_delay(self, attempt: int, exc: Exception) -> float:
+        # Full jitter keeps retrying clients from stampeding the provider in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after(exc)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _before_call(self, provider: AIProvider):
+        if not self.breakers[provider].allow():
+            self._count(provider, "short_circuited")
+            raise ProviderUnavailable(f"{provider.value} circuit is open")
+
+    def _should_retry(self, provider: AIProvider, attempt: int, exc: Exception, deadline: float) -> Optional[float]:
+        """Backoff delay before the next attempt, or None to give up"""
+        if _is_timeout(exc):
+            self._count(provider, "timeouts")
+        if attempt >= self.max_retries or not _is_retryable(exc):
+            return None
+        delay = self._retry_delay(attempt, exc)
+        if time.monotonic() + delay >= deadline:
+            return None
+        self._count(provider, "retries")
+        return delay
+
+    def _on_failure(self, provider: AIProvider):
+        self._count(provider, "failures")
+        self.breakers[provider].record_failure()
+
+    def _on_success(self, provider: AIProvider, latency: float):
+        with self._lock:
+            self._latencies[provider].append(latency)
+        self.breakers[provider].record_success()
+
+    def call(self, provider: AIProvider, fn):
+        """Run fn(timeout) under the provider's deadline, retry policy and breaker"""
+        self._before_call(provider)
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+
+        while True:
+            started = time.monotonic()
+            self._count(provider, "calls")
+            try:
+                result = fn(max(0.1, min(self.timeout, deadline - started)))
+            except Exception as exc:
+                delay = self._should_retry(provider, attempt, exc, deadline)
+                if delay is None:
+                    self._on_failure(provider)
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            self._on_success(provider, time.monotonic() - started)
+            return result
+
+    async def call_async(self, provider: AIProvider, fn):
+        """Async variant of call; fn(timeout) returns an awaitable"""
+        self._before_call(provider)
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+
+        while True:
+            started = time.monotonic()
+            self._count(provider, "calls")
+            timeout = max(0.1, min(self.timeout, deadline - started))
+            try:
+                result = await asyncio.wait_for(fn(timeout), timeout)
+            except Exception as exc:
+                delay = self._should_retry(provider, attempt, exc, deadline)
+                if delay is None:
+                    self._on_failure(provider)
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self._on_success(provider, time.monotonic() - started)
+            return result
+
+    def hedge_delay(self, provider: AIProvider) -> Optional[float]:
+        """Latency percentile after which a hedged request is started"""
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies[provider])
+        if len(samples) < self.hedge_min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return samples[index]
+
+    def hedge(self, provider: AIProvider, primary, secondary):
+        """Run primary; if it outlives the latency percentile, race secondary against it"""
+        delay = self.hedge_delay(provider)
+        if delay is None:
+            return primary()
+
+        if self._hedge_executor is None:
+            with self._lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(thread_name_prefix='hedge')
+
+        # Hedged calls run in the caller's context, e.g. its request trace and fair-queueing caller
+        first = self._hedge_executor.submit(contextvars.copy_context().run, primary)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+
+        self._count(provider, "hedges")
+        second = self._hedge_executor.submit(contextvars.copy_context().run, secondary)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count(provider, "hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def hedge_async(self, provider: AIProvider, primary, secondary):
+        """Async variant of hedge; primary and secondary are coroutine functions"""
+        delay = self.hedge_delay(provider)
+        if delay is None:
+            return await primary()
+
+        first = asyncio.ensure_future(primary())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        self._count(provider, "hedges")
+        second = asyncio.ensure_future(secondary())
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if task is second:
+                        self._count(provider, "hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def stats(self) -> Dict:
+        """Breaker state, retry counts and latency percentiles per provider"""
+        result = {}
+        for provider, breaker in self.breakers.items():
+            with self._lock:
+                counters = dict(self._counters[provider])
+                samples = sorted(self._latencies[provider])
+            if samples:
+                counters["latency_p50"] = round(samples[len(samples) // 2], 3)
+                counters["latency_p95"] = round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3)
+            counters["breaker"] = breaker.snapshot()
+            counters["hedge_after"] = self.hedge_delay(provider)
+            result[provider.value] = counters
+        return result
+
+# Complexity routing (ROUTING=complexity): cheap statistics of the decoded image send
+# flat, simple shots to offline analysis or a fast model and busy ones to the selected model
+ROUTING_WEIGHTS = {"entropy": 0.35, "edges": 0.35, "colors": 0.2, "size": 0.1}
+FAST_MODELS = {
+    AIProvider.OPENAI: os.getenv('OPENAI_FAST_MODEL', 'gpt-4o-mini'),
+    AIProvider.GEMINI: os.getenv('GEMINI_FAST_MODEL', 'gemini-1.5-flash')
+}
+
+def complexity_score(features: Dict, size: Tuple[int, int]) -> float:
+    """0 (flat, few colours, small) .. 1 (busy, colourful, large) from compute_image_features output"""
+    width, height = size
+    parts = {
+        "entropy": features["entropy"] / 6.0,       # a 64-bin histogram tops out at 6 bits
+        "edges": features["edge_density"] / 0.2,
+        "colors": features["color_count"] / 24,
+        "size": width * height / 4_000_000
+    }
+    return round(sum(ROUTING_WEIGHTS[name] * min(1.0, value) for name, value in parts.items()), 4)
+
+@dataclass
+class Route:
+    """Where one image is analyzed, and why"""
+    tier: str               # offline, fast or accurate
+    config: AIConfig
+    score: float
+    reason: str
+
+    def details(self) -> Dict:
+        return {
+            "tier": self.tier,
+            "provider": self.config.provider.value,
+            "model": self.config.model,
+            "score": self.score,
+            "reason": self.reason
+        }
+
+class ComplexityRouter:
+    """Picks offline analysis, a fast model or the accurate model per image.
+
+    Scores below `offline_below` go offline and below `fast_below` to the provider's
+    fast model. Complex images use the selected model unless its recent p95 latency
+    exceeds `latency_budget`. A provider whose breaker rejects calls is bypassed offline.
+    """
+
+    def __init__(self, generator: 'ArabStockMetadataGenerator', enabled: bool = False,
+                 offline_below: float = 0.15, fast_below: float = 0.45, latency_budget: float = 0.0,
+                 min_samples: int = 20, log_path: str = None):
+        self.generator = generator
+        self.enabled = enabled
+        self.offline_below = offline_below
+        self.fast_below = fast_below
+        self.latency_budget = latency_budget
+        self.min_samples = min_samples
+        self.log_path = log_path
+        self.offline_config = AIConfig(provider=AIProvider.OFFLINE, api_key="", model=DEFAULT_MODELS[AIProvider.OFFLINE])
+        self._fast_configs = {}
+        self._decisions = {}    # tier -> reason -> count
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, generator: 'ArabStockMetadataGenerator') -> 'ComplexityRouter':
+        """Build the router from ROUTING and ROUTING_* environment variables"""
+        return cls(
+            generator,
+            enabled=os.getenv('ROUTING', 'off').lower() == 'complexity',
+            offline_below=float(os.getenv('ROUTING_OFFLINE_BELOW', '0.15')),
+            fast_below=float(os.getenv('ROUTING_FAST_BELOW', '0.45')),
+            latency_budget=float(os.getenv('ROUTING_LATENCY_BUDGET', '0')),
+            min_samples=int(os.getenv('ROUTING_MIN_SAMPLES', '20')),
+            log_path=os.getenv('ROUTING_LOG') or None
+        )
+
+    def applies(self, config: AIConfig) -> bool:
+        return self.enabled and config.provider != AIProvider.OFFLINE
+
+    def _fast_config(self, config: AIConfig) -> Optional[AIConfig]:
+        """Config for the provider's fast model, built once per provider and model"""
+        model = FAST_MODELS.get(config.provider)
+        if not model or model == config.model:
+            return None
+        key = (config.provider, model, config.api_key)
+        fast = self._fast_configs.get(key)
+        if fast is None:
+            fast = self._fast_configs.setdefault(key, self.generator._build_config(config.provider, config.api_key, model))
+        return fast
+
+    def _over_budget(self, config: AIConfig) -> bool:
+        if not self.latency_budget:
+            return False
+        p95 = PROVIDER_LATENCY.percentile(0.95, self.min_samples, provider=config.provider.value, model=config.model)
+        return p95 is not None and p95 > self.latency_budget
+
+    def route(self, prepared: PreparedImage, config: AIConfig, digest: str = None) -> Route:
+        """Choose and record the route for one prepared image"""
+        score = complexity_score(prepared.features(), prepared.original_size)
+
+        if score < self.offline_below:
+            route = Route("offline", self.offline_config, score, "simple")
+        elif score < self.fast_below or self._over_budget(config):
+            reason = "moderate" if score < self.fast_below else "latency_budget"
+            fast = self._fast_config(config)
+            route = Route("fast", fast, score, reason) if fast else Route("accurate", config, score, "no_fast_model")
+        else:
+            route = Route("accurate", config, score, "complex")
+
+        # Once the reset timeout passes, the image goes to the provider as the half-open probe
+        if route.tier != "offline" and not self.generator.resilience.breakers[route.config.provider].available():
+            route = Route("offline", self.offline_config, score, "provider_unhealthy")
+
+        self._record(route, prepared, digest)
+        return route
+
+    def _record(self, route: Route, prepared: PreparedImage, digest: Optional[str]):
+        ROUTING_DECISIONS.inc(tier=route.tier, reason=route.reason)
+        ROUTING_SCORE.observe(route.score)
+        with self._lock:
+            by_reason = self._decisions.setdefault(route.tier, {})
+            by_reason[route.reason] = by_reason.get(route.reason, 0) + 1
+        if not self.log_path:
+            return
+
+        # One JSON line per decision, for tuning the thresholds offline
+        features = prepared.features()
+        line = json.dumps({
+            "ts": round(time.time(), 3),
+            "digest": digest,
+            **route.details(),
+            "entropy": round(features["entropy"], 4),
+            "edge_density": round(features["edge_density"], 4),
+            "color_count": features["color_count"],
+            "size": list(prepared.original_size)
+        })
+        with self._lock:
+            if self.log_path == '-':
+                print(line, flush=True)
+            else:
+                with open(self.log_path, 'a', encoding='utf-8') as log:
+                    log.write(line + "\n")
+
+    def stats(self) -> Dict:
+        """Thresholds and decision counts for the health endpoint"""
+        with self._lock:
+            decisions = {tier: dict(reasons) for tier, reasons in self._decisions.items()}
+        return {
+            "enabled": self.enabled,
+            "offline_below": self.offline_below,
+            "fast_below": self.fast_below,
+            "latency_budget": self.latency_budget or None,
+            "fast_models": {provider.value: model for provider, model in FAST_MODELS.items()},
+            "decisions": decisions
+        }
 
 class ArabStockMetadataGenerator:
     def __init__(self):
-        self.translator = Translator()
+        # Guards provider switching; readers take a snapshot of current_ai_config instead
+        self._lock = threading.RLock()
+        self.analysis_cache = AnalysisCache.from_env()
+        self.analysis_handles = AnalysisCache.from_env('ANALYSIS_HANDLE', max_entries=4096)
+        self.router = ComplexityRouter.from_env(self)
+        self.near_duplicates = NearDuplicateIndex.from_env()
+        self.resilience = ProviderResilience.from_env()
+        self.rate_limits = ProviderRateLimits.from_env()
+        self.provider_configs = {}
+        self._gemini_rest = False
+        self._provider_slots = {
+            provider: threading.BoundedSemaphore(limit)
+            for provider, limit in PROVIDER_CONCURRENCY.items()
+        }
+        self._async_provider_slots = {}
         self.current_ai_config = AIConfig(
             provider=AIProvider.OFFLINE,
             api_key="",
-            model=""
+            model=DEFAULT_MODELS[AIProvider.OFFLINE]
         )
 
         # Initialize AI providers
         self.setup_ai_providers()
 
-        #Arabs Stock specific categories
-        self.categories = {
-            "People": "أشخاص",
-            "Business": "أعمال",
-            "Technology": "تكنولوجيا",
-            "Culture": "ثقافة",
-            "Architecture": "عمارة",
-            "Nature": "طبيعة",
-            "Food": "طعام",
-            "Travel": "سفر",
-            "Education": "تعليم",
-            "Healthcare": "صحة",
-            "Sports": "رياضة",
-            "Art": "فن",
-            "Religion": "دين",
-            "Fashion": "أزياء",
-            "Transportation": "نقل"
-        }
+        #Arabs Stock specific categories and the rules that pick them
+        self.categories = CATEGORIES
+        self.rules = MetadataRules(categories=self.categories)
 
         # High-performing keywords for Arab markets
         self.trending_keywords = {
@@ -78,30 +2445,81 @@ class ArabStockMetadataGenerator:
             ]
         }
 
+        self._trending_en = frozenset(kw.lower() for kw in self.trending_keywords["en"])
+        self._trending_ar = frozenset(self.trending_keywords["ar"])
+
+        # EN<->AR translation memory seeded with the terms we already know
+        self.translation_memory = TranslationMemory.from_env()
+        self.translation_memory.seed(self.categories.items())
+        self.translation_memory.seed(zip(self.trending_keywords["en"], self.trending_keywords["ar"]))
+        self.translation_memory.seed(NAMED_COLORS_AR.items())
+
+        # Co-occurrence index behind keyword suggestions
+        self.keyword_index = KeywordIndex.from_env()
+
     def setup_ai_providers(self):
         """Initialize AI providers based on available API keys"""
         self.available_providers = []
+        configs = {}
 
         # check OpenAI
         openai_key = os.getenv('OPENAI_API_KEY')
         if openai_key:
             openai.api_key = openai_key
+            configs[AIProvider.OPENAI] = self._build_config(AIProvider.OPENAI, openai_key)
             self.available_providers.append(AIProvider.OPENAI)
             print('✅ OpenAI provider available')
 
         # check Gemini
         gemini_key = os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY')
         if gemini_key:
-            genai.configure(api_key=gemini_key)
+            self._configure_gemini(gemini_key)
+            configs[AIProvider.GEMINI] = self._build_config(AIProvider.GEMINI, gemini_key)
             self.available_providers.append(AIProvider.GEMINI)
             print('✅ Gemini provider available')
 
         # Offline mode always available
         self.available_providers.append(AIProvider.OFFLINE)
 
-        # set default provider
-        if self.available_providers:
-            self.current_ai_config.provider = self.available_providers[0]
+        # Remote provider configs stay around as hedging targets
+        self.provider_configs = configs
+
+        # set default provider
+        if self.available_providers:
+            provider = self.available_providers[0]
+            self.current_ai_config = configs.get(provider) or self._build_config(provider, "")
+
+    def _configure_gemini(self, api_key: str):
+        """Configure the Gemini SDK, optionally against GEMINI_API_ENDPOINT (e.g. a local fake)"""
+        endpoint = os.getenv('GEMINI_API_ENDPOINT')
+        self._gemini_rest = bool(endpoint)
+        if endpoint:
+            genai.configure(api_key=api_key, transport='rest', client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=api_key)
+
+    def _build_config(self, provider: AIProvider, api_key: str, model: str = None) -> AIConfig:
+        """Build a provider config together with its reusable client"""
+        model = model or DEFAULT_MODELS[provider]
+        client = None
+        async_client = None
+
+        if provider == AIProvider.OPENAI:
+            # The clients own HTTP connection pools that are reused across requests.
+            # Retries are handled by ProviderResilience, not by the SDK.
+            client = openai.OpenAI(api_key=api_key, max_retries=0)
+            async_client = openai.AsyncOpenAI(api_key=api_key, max_retries=0)
+        elif provider == AIProvider.GEMINI:
+            # Gemini models expose both generate_content and generate_content_async
+            client = genai.GenerativeModel(model)
+
+        return AIConfig(
+            provider=provider,
+            api_key=api_key,
+            model=model,
+            client=client,
+            async_client=async_client
+        )
 
     def set_ai_provider(self, provider: str, api_key: str=None, model: str=None) -> bool:
         """Set the current AI provider"""
@@ -111,62 +2529,59 @@ class ArabStockMetadataGenerator:
                     openai.api_key = api_key
                     os.environ['OPEN_AI_KEY'] = api_key
 
-                self.current_ai_config = AIConfig(
-                    provider=AIProvider.OPENAI,
-                    api_key=api_key or os.getenv('OPENAI_API_KEY', ''),
-                    model=model or "gpt-4-vision-preview"
+                config = self._build_config(
+                    AIProvider.OPENAI,
+                    api_key or os.getenv('OPENAI_API_KEY', ''),
+                    model
                 )
 
-                # Test the API key
-                if self._test_openai_connection():
-                    return True
-                else:
+                # Test the API key before switching
+                if not self._test_openai_connection(config.client):
                     raise Exception('Invalid OpenAI API key')
 
             elif provider.lower() == 'gemini':
                 if api_key:
-                    genai.configure(api_key=api_key)
+                    self._configure_gemini(api_key)
                     os.environ['GEMINI_API_KEY'] = api_key
 
-                self.current_ai_config = AIConfig(
-                    provider=AIProvider.GEMINI,
-                    api_key=api_key or os.getenv('GEMINI_API_KEY', ''),
-                    model=model or "gemini-pro-vision"
+                config = self._build_config(
+                    AIProvider.GEMINI,
+                    api_key or os.getenv('GEMINI_API_KEY', ''),
+                    model
                 )
 
-                # Test the API key
-                if self._test_gemini_connection():
-                    return True
-                else:
+                # Test the API key before switching
+                if not self._test_gemini_connection():
                     raise Exception('Invalid Gemini API key')
 
             elif provider.lower() == 'offline':
-                self.current_ai_config = AIConfig(
-                    provider=AIProvider.OFFLINE,
-                    api_key="",
-                    model='offline'
-                )
-                return True
+                config = self._build_config(AIProvider.OFFLINE, "", model)
             else:
                 raise Exception('Unsupported AI Provider')
 
+            # Swap config and client in a single assignment so concurrent requests
+            # see either the old provider or the new one, never a mix
+            with self._lock:
+                self.current_ai_config = config
+                if config.provider != AIProvider.OFFLINE:
+                    self.provider_configs[config.provider] = config
+                if config.provider not in self.available_providers:
+                    self.available_providers.insert(0, config.provider)
+            return True
+
         except Exception as e:
+            # Keep serving with the previous provider
             print(f"Error setting AI provider: {e}")
-            # Fallback to offline mode
-            self.current_ai_config = AIConfig(
-                provider=AIProvider.OFFLINE,
-                api_key="",
-                model='offline'
-            )
             return False
 
-    def _test_openai_connection(self) -> bool:
+    def _test_openai_connection(self, client=None) -> bool:
         """Test OpenAI API connection"""
         try:
-            response = openai.chat.completions.create(
+            client = client or self.current_ai_config.client or openai.OpenAI(api_key=openai.api_key)
+            response = client.chat.completions.create(
                 model="gpt-4-1106-preview",
                 messages=[{"role": "user", "content": "test"}],
-                max_token=5
+                max_tokens=5
             )
             return True
         except Exception as e:
@@ -177,322 +2592,1506 @@ class ArabStockMetadataGenerator:
         """Test Gemini API connection"""
         try:
             model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content("test")
+            response = model.generate_content("test", request_options=self._gemini_request_options(self.resilience.timeout))
             return True
         except Exception as e:
             print(f"Gemini connection test failed: {e}")
             return False
 
-    def analyze_image_with_ai(self, image_data: str) -> Dict:
-        """Analyze image using the selected AI provider"""
+    def analyze_image_with_ai(self, image_data) -> Dict:
+        """Analyze image (base64 text, raw bytes or binary file) using the selected AI provider"""
+        return self.analyze_image(image_data).analysis
+
+    async def analyze_image_with_ai_async(self, image_data) -> Dict:
+        """Async variant of analyze_image_with_ai used by the ASGI server"""
+        return (await self.analyze_image_async(image_data)).analysis
+
+    def analyze_image(self, image_data, packer: 'ImagePacker' = None) -> AnalysisResult:
+        """Analyze an image and report whether the result came from the provider, a cache or a near-duplicate"""
+        result = self._analyze_image(image_data, packer)
+        result.analysis_id = self.store_analysis(result.analysis)
+        ANALYSES.inc(source=result.source)
+        return result
+
+    async def analyze_image_async(self, image_data, packer: 'ImagePacker' = None) -> AnalysisResult:
+        """Async variant of analyze_image"""
+        result = await self._analyze_image_async(image_data, packer)
+        result.analysis_id = self.store_analysis(result.analysis)
+        ANALYSES.inc(source=result.source)
+        return result
+
+    def store_analysis(self, analysis: Dict) -> str:
+        """Keep an analysis server-side and return its handle (a content hash, so the same analysis keeps one id)"""
+        analysis_id = analysis_seed(analysis)
+        self.analysis_handles.put(analysis_id, analysis)
+        return analysis_id
+
+    def stored_analysis(self, analysis_id: str) -> Optional[Dict]:
+        """The analysis behind a handle, or None once it expired or was evicted"""
+        return self.analysis_handles.get(analysis_id)
+
+    def _fallback(self, reason: str) -> Dict:
+        """The generic fallback analysis, counted by reason"""
+        FALLBACKS.inc(reason=reason)
+        return self._get_fallback_analysis()
+
+    def _analyze_image(self, image_data, packer: 'ImagePacker' = None) -> AnalysisResult:
+        # Snapshot the config so a concurrent provider switch can't change it mid-call
+        config = self.current_ai_config
+
         try:
-            if self.current_ai_config.provider == AIProvider.OPENAI:
-                return self._analyze_with_openai(image_data)
-            elif self.current_ai_config.provider == AIProvider.GEMINI:
-                return self._analyze_with_gemini(image_data)
-            else:
-                return self._analyze_offline(image_data)
+            with span("decode"):
+                upload = ImageUpload.from_data(image_data)
+                UPLOAD_BYTES.observe(upload.size)
+        except Exception as e:
+            print(f"Image decode error: {e}")
+            return AnalysisResult(self._fallback("decode_error"), "fallback", error=f"Invalid image data: {e}")
+
+        # Identical images (e.g. regenerate/reanalyze) are answered from the cache
+        cache_key = AnalysisCache.make_key(upload.digest, config.provider.value, config.model)
+        with span("cache_lookup"):
+            cached = self.analysis_cache.get(cache_key)
+        if cached is not None:
+            return AnalysisResult(cached, "cache")
+
+        try:
+            prepared = self._prepare(upload, config)
+        except Exception as e:
+            print(f"Image decode error: {e}")
+            return AnalysisResult(self._fallback("prepare_error"), "fallback", error=f"Image could not be decoded: {e}")
+
+        # Burst shots and slight crops reuse an earlier analysis instead of a provider call
+        with span("near_duplicate"):
+            image_hash = self._near_duplicate_hash(prepared, config)
+            reused = self._reuse_near_duplicate(prepared, config, image_hash)
+        if reused is not None:
+            self._remember(cache_key, reused.analysis)
+            return reused
+
+        # Simple images may go offline or to a faster model
+        route = None
+        if self.router.applies(config):
+            with span("route"):
+                route = self.router.route(prepared, config, upload.digest)
+        target = route.config if route else config
+
+        try:
+            # Batch items may share a multi-image request with their neighbours
+            analysis = packer.analyze(prepared) if packer is not None and packer.accepts(target) else None
+            if analysis is None:
+                # Batch workers share these slots, so a large batch can't flood one provider
+                with self._provider_slots[target.provider]:
+                    if target.provider == AIProvider.OFFLINE:
+                        analysis = self._analyze_offline(prepared)
+                    else:
+                        analysis = self._analyze_remote(prepared, target)
         except Exception as e:
             print(f"AI analysis error: {e}")
-            return  self._analyze_offline(image_data)
+            return AnalysisResult(self._analyze_offline(prepared), "offline")
 
-    def _analyze_with_openai(self, image_data: str) -> Dict:
-        """Analyze image using OpenAI Vision API"""
+        return self._finish(cache_key, config, upload, image_hash, analysis, route)
+
+    async def _analyze_image_async(self, image_data, packer: 'ImagePacker' = None) -> AnalysisResult:
+        config = self.current_ai_config
+        loop = asyncio.get_running_loop()
+
+        try:
+            # Hashing a spooled file reads it from disk, keep that off the event loop
+            with span("decode"):
+                upload = await loop.run_in_executor(None, ImageUpload.from_data, image_data)
+                UPLOAD_BYTES.observe(upload.size)
+        except Exception as e:
+            print(f"Image decode error: {e}")
+            return AnalysisResult(self._fallback("decode_error"), "fallback", error=f"Invalid image data: {e}")
+
+        cache_key = AnalysisCache.make_key(upload.digest, config.provider.value, config.model)
+        with span("cache_lookup"):
+            cached = self.analysis_cache.get(cache_key)
+        if cached is not None:
+            return AnalysisResult(cached, "cache")
+
+        # Decoding is CPU work, keep it off the event loop
+        try:
+            prepared = await loop.run_in_executor(None, self._prepare, upload, config)
+        except Exception as e:
+            print(f"Image decode error: {e}")
+            return AnalysisResult(self._fallback("prepare_error"), "fallback", error=f"Image could not be decoded: {e}")
+
+        with span("near_duplicate"):
+            image_hash = await loop.run_in_executor(None, self._near_duplicate_hash, prepared, config)
+            reused = await loop.run_in_executor(None, self._reuse_near_duplicate, prepared, config, image_hash)
+        if reused is not None:
+            self._remember(cache_key, reused.analysis)
+            return reused
+
+        route = None
+        if self.router.applies(config):
+            with span("route"):
+                route = await loop.run_in_executor(None, self.router.route, prepared, config, upload.digest)
+        target = route.config if route else config
+
+        try:
+            analysis = None
+            if packer is not None and packer.accepts(target):
+                analysis = await packer.analyze_async(prepared)
+            if analysis is None:
+                async with self._get_async_slot(target.provider):
+                    if target.provider == AIProvider.OFFLINE:
+                        analysis = await loop.run_in_executor(None, self._analyze_offline, prepared)
+                    else:
+                        analysis = await self._analyze_remote_async(prepared, target)
+        except Exception as e:
+            print(f"AI analysis error: {e}")
+            return AnalysisResult(await loop.run_in_executor(None, self._analyze_offline, prepared), "offline")
+
+        return self._finish(cache_key, config, upload, image_hash, analysis, route)
+
+    def _finish(self, cache_key: str, config: AIConfig, upload: ImageUpload,
+                image_hash: Optional[int], analysis: Dict, route: Route = None) -> AnalysisResult:
+        """Cache and index a fresh analysis"""
+        route_details = route.details() if route else None
+        if analysis == self._get_fallback_analysis():
+            return AnalysisResult(analysis, "fallback", route=route_details)
+
+        target = route.config if route else config
+        offline = target.provider == AIProvider.OFFLINE
+        if target != config:
+            # A cheaper tier's answer is kept under its own provider and model, never served as the selected one's
+            cache_key = AnalysisCache.make_key(upload.digest, target.provider.value, target.model)
+        self._remember(cache_key, analysis)
+        # Only fresh analyses feed the co-occurrence index; cache, near-duplicate and fallback answers would skew it
+        for lang, generated in self.generate_keywords(analysis).items():
+            self.keyword_index.add(lang, generated)
+        # Offline analyses are cheap to recompute, so only provider answers seed near-duplicate reuse
+        if image_hash is not None and not offline:
+            scope = NearDuplicateIndex.scope(target.provider.value, target.model)
+            self.near_duplicates.add(scope, image_hash, upload.digest, analysis)
+        return AnalysisResult(analysis, "offline" if offline else "provider", route=route_details)
+
+    def _near_duplicate_hash(self, prepared: PreparedImage, config: AIConfig) -> Optional[int]:
+        """dHash of the prepared image, or None when near-duplicate reuse doesn't apply"""
+        # Offline analysis is cheap and computed from the pixels, so it is never reused
+        if config.provider == AIProvider.OFFLINE or not self.near_duplicates.enabled:
+            return None
+        try:
+            return dhash(prepared.image)
+        except Exception as e:
+            print(f"Perceptual hash error: {e}")
+            return None
+
+    def _reuse_near_duplicate(self, prepared: PreparedImage, config: AIConfig,
+                              image_hash: Optional[int]) -> Optional[AnalysisResult]:
+        """Adapt the analysis of a near-identical image, if one was analyzed before"""
+        if image_hash is None:
+            return None
+        scope = NearDuplicateIndex.scope(config.provider.value, config.model)
+        match = self.near_duplicates.find(scope, image_hash)
+        if match is None:
+            return None
+
+        distance, digest, analysis = match
+        # Cheap adaptation: colors come from this image, the rest is reused as-is
         try:
-            response = openai.chat.completions.create(
-                model=self.current_ai_config.model,
-                meesages=[
+            colors = [name for name, share in prepared.features()["dominant_colors"][:3]]
+            if colors:
+                analysis["colors"] = colors
+        except Exception as e:
+            print(f"Near-duplicate color refresh error: {e}")
+
+        return AnalysisResult(analysis, "near_duplicate", {"distance": distance, "matched_digest": digest})
+
+    def _prepare(self, upload: ImageUpload, config: AIConfig) -> PreparedImage:
+        """Decode and downscale an upload with the provider's image profile"""
+        if upload.prepared is not None:
+            return upload.prepared
+        with span("prepare"):
+            return prepare_image(upload, quality=IMAGE_QUALITY, **IMAGE_PROFILES[config.provider])
+
+    def _remember(self, cache_key: Optional[str], analysis: Dict):
+        """Cache a fresh analysis unless it is the generic fallback"""
+        # Never cache the generic fallback, the next call should retry the provider
+        if cache_key and analysis and analysis != self._get_fallback_analysis():
+            self.analysis_cache.put(cache_key, analysis)
+
+    def _get_async_slot(self, provider: AIProvider) -> asyncio.Semaphore:
+        """Per-provider concurrency limit for the async path"""
+        slot = self._async_provider_slots.get(provider)
+        if slot is None:
+            slot = self._async_provider_slots.setdefault(
+                provider, asyncio.Semaphore(PROVIDER_CONCURRENCY[provider])
+            )
+        return slot
+
+    def _openai_messages(self, prepared: PreparedImage) -> List[Dict]:
+        """Chat messages for an OpenAI vision request"""
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": OPENAI_PROMPT},
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Analyze this image for stock photography metadata.
-                                Focus on: main subject, people, ibjects, setting, mood, 
-                                Return a JSON with: main_subject, people (array), object (array), setting, mood, colors (array), style, cultural_context.
-                                Keep description concise and stock-photo appropriate."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64, {image_data}"}
-                            }
-                        ]
+                        "type": "image_url",
+                        "image_url": {"url": prepared.data_url()}
                     }
-                ],
-                max_tokens=300
+                ]
+            }
+        ]
+
+    def _openai_pack_messages(self, images: List[PreparedImage]) -> List[Dict]:
+        """Chat messages for an OpenAI request carrying several numbered images"""
+        content = [{"type": "text", "text": PACK_PROMPT.format(count=len(images))}]
+        for number, prepared in enumerate(images, 1):
+            content.append({"type": "text", "text": f"Image {number}:"})
+            content.append({"type": "image_url", "image_url": {"url": prepared.data_url()}})
+        return [{"role": "user", "content": content}]
+
+    def _gemini_pack_parts(self, images: List[PreparedImage]) -> List:
+        """Gemini content parts carrying several numbered images"""
+        parts = [PACK_PROMPT.format(count=len(images))]
+        for number, prepared in enumerate(images, 1):
+            parts += [f"Image {number}:", self._gemini_image(prepared)]
+        return parts
+
+    @timed("parse")
+    def _parse_pack_content(self, content: str, count: int) -> List[Optional[Dict]]:
+        return parse_pack(content, count)
+
+    @timed("parse")
+    def _parse_content(self, provider: AIProvider, content: str) -> Dict:
+        """Turn a provider reply into a validated analysis dict, raising AnalysisParseError if it has none"""
+        analysis, structured = parse_analysis(content)
+        if not structured:
+            TEXT_PARSE_FALLBACKS.inc(provider=provider.value)
+        return analysis
+
+    def _gemini_model(self, config: AIConfig):
+        """Gemini model for the config, reusing the pre-built one"""
+        return config.client or genai.GenerativeModel(config.model or DEFAULT_MODELS[AIProvider.GEMINI])
+
+    def _hedge_config(self, config: AIConfig) -> Optional[AIConfig]:
+        """Another remote provider to race against a slow call, if hedging applies"""
+        if self.resilience.hedge_delay(config.provider) is None:
+            return None
+        for provider, other in self.provider_configs.items():
+            if provider != config.provider and self.resilience.breakers[provider].state == CircuitBreaker.CLOSED:
+                return other
+        return None
+
+    def _provider_request(self, config: AIConfig, tokens: int, payload_bytes: int, call):
+        """One rate-limited, resilient provider request: budget, deadline, retries and circuit breaker"""
+        with span("rate_limit_wait", provider=config.provider.value):
+            acquired = self.rate_limits.limiter(config).acquire(tokens, current_caller.get(), self.rate_limits.max_wait)
+        if not acquired:
+            raise RateLimitExceeded(f"{config.provider.value} rate limit queue wait exceeded")
+
+        PROVIDER_PAYLOAD_BYTES.observe(payload_bytes, provider=config.provider.value)
+        started = time.perf_counter()
+        try:
+            with span("provider", provider=config.provider.value, model=config.model):
+                return self.resilience.call(config.provider, call)
+        finally:
+            PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=config.provider.value, model=config.model)
+
+    async def _provider_request_async(self, config: AIConfig, tokens: int, payload_bytes: int, call):
+        limiter = self.rate_limits.limiter(config)
+        with span("rate_limit_wait", provider=config.provider.value):
+            acquired = await limiter.acquire_async(tokens, current_caller.get(), self.rate_limits.max_wait)
+        if not acquired:
+            raise RateLimitExceeded(f"{config.provider.value} rate limit queue wait exceeded")
+
+        PROVIDER_PAYLOAD_BYTES.observe(payload_bytes, provider=config.provider.value)
+        started = time.perf_counter()
+        try:
+            with span("provider", provider=config.provider.value, model=config.model):
+                return await self.resilience.call_async(config.provider, call)
+        finally:
+            PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=config.provider.value, model=config.model)
+
+    def _call_provider(self, prepared: PreparedImage, config: AIConfig) -> Dict:
+        analyze = self._analyze_with_openai if config.provider == AIProvider.OPENAI else self._analyze_with_gemini
+        return self._provider_request(
+            config, estimate_tokens(config.provider, prepared), len(prepared.encoded()),
+            lambda timeout: analyze(prepared, config, timeout)
+        )
+
+    async def _call_provider_async(self, prepared: PreparedImage, config: AIConfig) -> Dict:
+        analyze = (self._analyze_with_openai_async if config.provider == AIProvider.OPENAI
+                   else self._analyze_with_gemini_async)
+        return await self._provider_request_async(
+            config, estimate_tokens(config.provider, prepared), len(prepared.encoded()),
+            lambda timeout: analyze(prepared, config, timeout)
+        )
+
+    def analyze_pack(self, images: List[PreparedImage], config: AIConfig) -> List[Optional[Dict]]:
+        """Analyze several prepared images in one provider request; None for images the reply did not cover"""
+        analyze = self._analyze_pack_with_openai if config.provider == AIProvider.OPENAI else self._analyze_pack_with_gemini
+        try:
+            with self._provider_slots[config.provider]:
+                results = self._provider_request(
+                    config, estimate_pack_tokens(config.provider, images), sum(len(image.encoded()) for image in images),
+                    lambda timeout: analyze(images, config, timeout)
+                )
+        except Exception as e:
+            print(f"{config.provider.value} packed analysis error: {e}")
+            results = [None] * len(images)
+        return self._count_pack(config, results)
+
+    async def analyze_pack_async(self, images: List[PreparedImage], config: AIConfig) -> List[Optional[Dict]]:
+        """Async variant of analyze_pack"""
+        analyze = (self._analyze_pack_with_openai_async if config.provider == AIProvider.OPENAI
+                   else self._analyze_pack_with_gemini_async)
+        try:
+            async with self._get_async_slot(config.provider):
+                results = await self._provider_request_async(
+                    config, estimate_pack_tokens(config.provider, images), sum(len(image.encoded()) for image in images),
+                    lambda timeout: analyze(images, config, timeout)
+                )
+        except Exception as e:
+            print(f"{config.provider.value} packed analysis error: {e}")
+            results = [None] * len(images)
+        return self._count_pack(config, results)
+
+    @staticmethod
+    def _count_pack(config: AIConfig, results: List[Optional[Dict]]) -> List[Optional[Dict]]:
+        PACKED_REQUESTS.inc(provider=config.provider.value)
+        for result in results:
+            PACKED_ITEMS.inc(provider=config.provider.value, outcome="analyzed" if result is not None else "single_fallback")
+        return results
+
+    def _spillover_config(self, prepared: PreparedImage, config: AIConfig) -> AIConfig:
+        """The next available provider with spare capacity when this one's rate-limit queue is saturated"""
+        tokens = estimate_tokens(config.provider, prepared)
+        if self.rate_limits.limiter(config).estimate_wait(tokens) <= self.rate_limits.spillover_wait:
+            return config
+
+        for provider in self.available_providers:
+            other = self.provider_configs.get(provider)
+            if other is None or provider == config.provider:
+                continue
+            if self.resilience.breakers[provider].state != CircuitBreaker.CLOSED:
+                continue
+            other_tokens = estimate_tokens(provider, prepared)
+            if self.rate_limits.limiter(other).estimate_wait(other_tokens) <= self.rate_limits.spillover_wait:
+                self.rate_limits.record_spillover(config.provider)
+                return other
+        return config
+
+    def _analyze_remote(self, prepared: PreparedImage, config: AIConfig) -> Dict:
+        """Analyze with a remote provider, falling back to the generic analysis on failure"""
+        try:
+            config = self._spillover_config(prepared, config)
+            hedge_config = self._hedge_config(config)
+            if hedge_config is None:
+                return self._call_provider(prepared, config)
+
+            def secondary():
+                with self._provider_slots[hedge_config.provider]:
+                    return self._call_provider(prepared, hedge_config)
+
+            return self.resilience.hedge(
+                config.provider, lambda: self._call_provider(prepared, config), secondary
+            )
+
+        except AnalysisParseError as e:
+            print(f"{config.provider.value} reply could not be parsed: {e}")
+            return self._fallback("parse_error")
+        except Exception as e:
+            print(f"{config.provider.value} analysis error: {e}")
+            return self._fallback("provider_error")
+
+    async def _analyze_remote_async(self, prepared: PreparedImage, config: AIConfig) -> Dict:
+        """Async variant of _analyze_remote"""
+        try:
+            config = self._spillover_config(prepared, config)
+            hedge_config = self._hedge_config(config)
+            if hedge_config is None:
+                return await self._call_provider_async(prepared, config)
+
+            async def secondary():
+                async with self._get_async_slot(hedge_config.provider):
+                    return await self._call_provider_async(prepared, hedge_config)
+
+            return await self.resilience.hedge_async(
+                config.provider, lambda: self._call_provider_async(prepared, config), secondary
+            )
+
+        except AnalysisParseError as e:
+            print(f"{config.provider.value} reply could not be parsed: {e}")
+            return self._fallback("parse_error")
+        except Exception as e:
+            print(f"{config.provider.value} analysis error: {e}")
+            return self._fallback("provider_error")
+
+    def _analyze_with_openai(self, prepared: PreparedImage, config: AIConfig = None, timeout: float = None) -> Dict:
+        """Analyze image using OpenAI Vision API, raising on provider errors"""
+        config = config or self.current_ai_config
+        client = config.client or openai.OpenAI(api_key=config.api_key, max_retries=0)
+        response = client.chat.completions.create(
+            model=config.model,
+            messages=self._openai_messages(prepared),
+            max_tokens=MAX_OUTPUT_TOKENS,
+            timeout=timeout
+        )
+        return self._parse_content(AIProvider.OPENAI, response.choices[0].message.content)
+
+    async def _analyze_with_openai_async(self, prepared: PreparedImage, config: AIConfig = None,
+                                         timeout: float = None) -> Dict:
+        """Analyze image using the async OpenAI client, raising on provider errors"""
+        config = config or self.current_ai_config
+        client = config.async_client or openai.AsyncOpenAI(api_key=config.api_key, max_retries=0)
+        response = await client.chat.completions.create(
+            model=config.model,
+            messages=self._openai_messages(prepared),
+            max_tokens=MAX_OUTPUT_TOKENS,
+            timeout=timeout
+        )
+        return self._parse_content(AIProvider.OPENAI, response.choices[0].message.content)
+
+    def _analyze_pack_with_openai(self, images: List[PreparedImage], config: AIConfig,
+                                  timeout: float = None) -> List[Optional[Dict]]:
+        client = config.client or openai.OpenAI(api_key=config.api_key, max_retries=0)
+        response = client.chat.completions.create(
+            model=config.model,
+            messages=self._openai_pack_messages(images),
+            max_tokens=MAX_OUTPUT_TOKENS * len(images),
+            timeout=timeout
+        )
+        return self._parse_pack_content(response.choices[0].message.content, len(images))
+
+    async def _analyze_pack_with_openai_async(self, images: List[PreparedImage], config: AIConfig,
+                                              timeout: float = None) -> List[Optional[Dict]]:
+        client = config.async_client or openai.AsyncOpenAI(api_key=config.api_key, max_retries=0)
+        response = await client.chat.completions.create(
+            model=config.model,
+            messages=self._openai_pack_messages(images),
+            max_tokens=MAX_OUTPUT_TOKENS * len(images),
+            timeout=timeout
+        )
+        return self._parse_pack_content(response.choices[0].message.content, len(images))
+
+    def _gemini_image(self, prepared: PreparedImage) -> Dict:
+        """Inline image part for Gemini, sent as the already-encoded bytes"""
+        return {"mime_type": prepared.mime_type, "data": prepared.encoded()}
+
+    @staticmethod
+    def _gemini_request_options(timeout: float = None) -> Dict:
+        """Per-call options; the SDK's own retry is off so ProviderResilience is the only retry layer"""
+        options = {"retry": None}
+        if timeout:
+            options["timeout"] = timeout
+        return options
+
+    def _analyze_with_gemini(self, prepared: PreparedImage, config: AIConfig = None, timeout: float = None) -> Dict:
+        """Analyze image using Gemini Vision API, raising on provider errors"""
+        config = config or self.current_ai_config
+        response = self._gemini_model(config).generate_content(
+            [GEMINI_PROMPT, self._gemini_image(prepared)],
+            request_options=self._gemini_request_options(timeout)
+        )
+        return self._parse_content(AIProvider.GEMINI, response.text)
+
+    async def _analyze_with_gemini_async(self, prepared: PreparedImage, config: AIConfig = None,
+                                         timeout: float = None) -> Dict:
+        """Analyze image using the async Gemini API, raising on provider errors"""
+        config = config or self.current_ai_config
+        if self._gemini_rest:
+            # The SDK's REST transport has no async client: run the blocking call off the loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self._analyze_with_gemini, prepared, config, timeout)
             )
+        response = await self._gemini_model(config).generate_content_async(
+            [GEMINI_PROMPT, self._gemini_image(prepared)],
+            request_options=self._gemini_request_options(timeout)
+        )
+        return self._parse_content(AIProvider.GEMINI, response.text)
+
+    def _analyze_pack_with_gemini(self, images: List[PreparedImage], config: AIConfig,
+                                  timeout: float = None) -> List[Optional[Dict]]:
+        response = self._gemini_model(config).generate_content(
+            self._gemini_pack_parts(images),
+            request_options=self._gemini_request_options(timeout)
+        )
+        return self._parse_pack_content(response.text, len(images))
+
+    async def _analyze_pack_with_gemini_async(self, images: List[PreparedImage], config: AIConfig,
+                                              timeout: float = None) -> List[Optional[Dict]]:
+        if self._gemini_rest:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self._analyze_pack_with_gemini, images, config, timeout)
+            )
+        response = await self._gemini_model(config).generate_content_async(
+            self._gemini_pack_parts(images),
+            request_options=self._gemini_request_options(timeout)
+        )
+        return self._parse_pack_content(response.text, len(images))
+
+    @timed("offline_analysis")
+    def _analyze_offline(self, prepared: PreparedImage) -> Dict:
+        """Offline analysis from colour, tone and composition statistics"""
+        try:
+            features = prepared.features()
+
+            width, height = prepared.original_size
+            aspect_ratio = width / height
+
+            # Composition from aspect ratio
+            if aspect_ratio >1.5:
+                composition = "landscape or panoramic view"
+                main_subject = "wide scene"
+            elif aspect_ratio < 0.7:
+                composition = "portrait or vertical composition"
+                main_subject = "tall subject"
+            else:
+                composition = "standard composition"
+                main_subject = "balanced scene"
+
+            # Skin tones that don't fill the whole frame (sand, wood) suggest people
+            has_people = features["face_likelihood"] >= 0.5 or 0.1 <= features["skin_ratio"] <= 0.5
+            people = []
+            objects = []
+            setting = composition
+
+            if has_people:
+                main_subject = "person portrait" if features["face_likelihood"] >= 0.5 else "people"
+                people = ["person"]
+
+            outdoor = features["sky_ratio"] >= 0.25 or features["vegetation_ratio"] >= 0.25
+            if features["sky_ratio"] >= 0.25:
+                objects.append("sky")
+            if features["vegetation_ratio"] >= 0.25:
+                objects.append("plants")
+
+            if features["edge_density"] >= 0.18 and features["saturation"] < 0.35:
+                # Busy, muted scenes are mostly built environments
+                objects.append("building")
+                setting = f"city buildings, {composition}"
+                if not has_people:
+                    main_subject = "urban architecture"
+            elif outdoor:
+                setting = f"outdoor nature, {composition}"
+                if not has_people:
+                    main_subject = "nature landscape"
+            elif features["edge_density"] < 0.05 and features["color_count"] <= 6:
+                objects.append("plain background")
+                setting = f"studio, {composition}"
+                if not has_people:
+                    main_subject = "isolated product"
+
+            if not objects:
+                objects.append("general object")
+
+            # Mood and style from tone
+            if features["brightness"] < 0.3:
+                mood = "dramatic"
+            elif features["brightness"] > 0.6 and features["saturation"] > 0.45:
+                mood = "cheerful"
+            elif features["saturation"] < 0.2:
+                mood = "calm"
+            else:
+                mood = "professional"
+
+            if features["saturation"] < 0.15:
+                style = "minimalist"
+            elif features["contrast"] > 0.5 and features["saturation"] > 0.45:
+                style = "vivid"
+            else:
+                style = "modern"
+
+            colors = [name for name, share in features["dominant_colors"][:3]]
+
+            return {
+                "main_subject": main_subject,
+                "people": people,
+                "objects": objects,
+                "setting": setting,
+                "mood": mood,
+                "colors": colors or ["gray"],
+                "style": style,
+                "cultural_context": "arab business environment"
+            }
+
+        except Exception as e:
+            print(f"Offline analysis error: {e}")
+            return self._fallback("offline_error")
+
+    def _get_fallback_analysis(self) -> Dict:
+        """Fallback analysis when AI service is unavailable"""
+        return {
+            "main_subject": "professional scene",
+            "people": ["person", "professional"],
+            "objects": ["business items"],
+            "setting": "modern environment",
+            "mood": "professional",
+            "colors": ["blue", "white", "gray"],
+            "style": "contemporary",
+            "cultural_context": "arab business setting"
+        }
+
+    def generate_titles(self, analysis: Dict, template: int = None, exclude=()) -> Dict[str, str]:
+        """Generated optimized titles in English and Arabic
+
+        `template` picks a template by index instead of at random; titles in `exclude` are avoided.
+        """
+
+        # English title generation with AI-based analysis
+        main_subject = analysis.get("main_subject", "business scene")
+        setting = analysis.get("setting", "office")
+        cultural_context = analysis.get("cultural_context", "arab")
+
+        en_templates = [
+            f"Professional {main_subject} in Modern Arab {setting}",
+            f"Middle Eastern {main_subject} - Business Excellence",
+            f"Contemporary Arab {main_subject} in {setting}",
+            f"Gulf Business - {main_subject} Success Story",
+            f"Islamic Culture - Modern {main_subject}",
+            f"Arab Professional {main_subject} Meeting",
+            f"Dubai Style {main_subject} in {setting}",
+            f"Saudi Business {main_subject} Innovation"
+        ]
+
+        # Arabic title generation
+        ar_templates = [
+            f"اجتماع أعمال عربي مهني في مكتب حديث",
+            f"التميز في الأعمال الشرق أوسطية - مشهد مهني",
+            f"ثقافة عربية معاصرة في بيئة العمل",
+            f"أعمال الخليج - قصة نجاح مهنية",
+            f"الثقافة الإسلامية - مشهد أعمال حديث",
+            f"اجتماع مهني عربي ناجح",
+            f"أسلوب دبي في الأعمال المهنية",
+            f"ابتكار الأعمال السعودية الحديث"
+        ]
+
+        en_title = self._choose_title(en_templates, template, exclude)
+        ar_title = self._choose_title(ar_templates, template, exclude)
+
+        return {
+            "en": en_title,
+            "ar": ar_title
+        }
+
+    @staticmethod
+    def _choose_title(templates: List[str], template: Optional[int], exclude) -> str:
+        if template is not None:
+            return templates[template % len(templates)]
+        return random.choice([title for title in templates if title not in exclude] or templates)
+
+    def generate_keywords(self, analysis: Dict, hits: Dict[str, set] = None,
+                          limit: int = KEYWORD_LIMIT) -> Dict[str, List[str]]:
+        """Generate ranked keywords in both languages based on AI analysis"""
+        weights = KEYWORD_FIELD_WEIGHTS
+        seed = analysis_seed(analysis)
+        candidates_en = []
+        candidates_ar = []
+
+        def add(keywords_en: List[str], keywords_ar: List[str], weight: float):
+            # Earlier keywords in a group rank slightly higher than later ones
+            candidates_en.extend((kw, weight - 0.01 * i) for i, kw in enumerate(keywords_en))
+            candidates_ar.extend((kw, weight - 0.01 * i) for i, kw in enumerate(keywords_ar))
+
+        # Rule-based keywords, weighted by the field that fired the rule
+        for rule, field_name in self.rules.keyword_matches(hits if hits is not None else self.rules.scan(analysis)):
+            add(rule["en"], rule["ar"], weights[field_name])
+
+        # Objects and colors, with Arabic from the translation memory (no network)
+        for field_name in ("objects", "colors"):
+            terms = [term for term in analysis.get(field_name, []) or [] if isinstance(term, str)]
+            translations = [self.translation_memory.lookup(term, 'ar') for term in terms]
+            add([term.lower() for term in terms], [t for t in translations if t], weights[field_name])
+
+        style = analysis.get("style", "")
+        if isinstance(style, str) and style:
+            add([style], [], weights["style"])
+
+        # A stable, per-analysis pick of trending keywords instead of random.sample
+        trending = sorted(
+            zip(self.trending_keywords["en"], self.trending_keywords["ar"]),
+            key=lambda pair: _tie_breaker(seed, pair[0])
+        )[:TRENDING_PICKS]
+        add([en for en, _ in trending], [ar for _, ar in trending], weights["trending"])
+
+        return {
+            "en": rank_keywords(candidates_en, seed, limit, boosted=self._trending_en),
+            "ar": rank_keywords(candidates_ar, seed, limit, boosted=self._trending_ar)
+        }
+
+    def suggest_category(self, analysis: Dict, hits: Dict[str, set] = None) -> Tuple[str, str]:
+        """Suggest the most appropriate category based on AI analysis"""
+        return self.rules.category(hits if hits is not None else self.rules.scan(analysis))
+
+    def suggest_categories(self, analysis: Dict, limit: int = 3) -> List[Tuple[str, str]]:
+        """Best category followed by the next matching ones, as (en, ar) pairs"""
+        return self.rules.matching_categories(self.rules.scan(analysis))[:limit]
+
+    def determine_license_type(self, analysis: Dict, hits: Dict[str, set] = None) -> str:
+        """Determine if image should be commercial or editorial based on AI analysis"""
+        return self.rules.license(hits if hits is not None else self.rules.scan(analysis))
+
+    @timed("metadata")
+    def build_metadata(self, analysis: Dict) -> Dict:
+        """Generate the full metadata block returned to the extension"""
+        hits = self.rules.scan(analysis)
+        titles = self.generate_titles(analysis)
+        keywords = self.generate_keywords(analysis, hits)
+        category = self.suggest_category(analysis, hits)
+        license_type = self.determine_license_type(analysis, hits)
+
+        return {
+            "titles": titles,
+            "keywords": keywords,
+            "category": {
+                "en": category[0],
+                "ar": category[1]
+            },
+            "license": license_type,
+            "analysis": analysis
+        }
+
+    async def analyze_batch_item_async(self, image_data, packer: 'ImagePacker' = None) -> Dict:
+        """Async variant of analyze_batch_item"""
+        try:
+            if not image_data:
+                raise ValueError("No image data provided")
+            # Multipart uploads are handed over as their spooled file, no base64 round trip
+            if hasattr(image_data, 'file'):
+                image_data = image_data.file
+            result = await self.analyze_image_async(image_data, packer)
+            if result.error:
+                # The item itself is unusable; report it like any other failed item
+                return {"status": "error", "error": result.error, "metadata": self.build_metadata(result.analysis)}
+            return {"status": "success", "metadata": self.build_metadata(result.analysis), **result.details()}
+        except Exception as e:
+            print(f"Batch item error: {e}")
+            return {
+                "status": "error",
+                "error": str(e),
+                "metadata": self.build_metadata(self._fallback("batch_item_error"))
+            }
+
+    def analyze_batch_item(self, image_data, packer: 'ImagePacker' = None) -> Dict:
+        """Analyze one batch item, falling back to generic metadata if it fails"""
+        try:
+            if not image_data:
+                raise ValueError("No image data provided")
+            # Multipart uploads are read here, on the worker, straight from their spooled file
+            if hasattr(image_data, 'stream'):
+                image_data = image_data.stream
+            result = self.analyze_image(image_data, packer)
+            if result.error:
+                # The item itself is unusable; report it like any other failed item
+                return {"status": "error", "error": result.error, "metadata": self.build_metadata(result.analysis)}
+            return {"status": "success", "metadata": self.build_metadata(result.analysis), **result.details()}
+        except Exception as e:
+            print(f"Batch item error: {e}")
+            return {
+                "status": "error",
+                "error": str(e),
+                "metadata": self.build_metadata(self._fallback("batch_item_error"))
+            }
+
+# Multi-image packing for batches: up to BATCH_PACK_SIZE items that reach the provider
+# together share one request (1 disables it). Items wait at most BATCH_PACK_LINGER
+# seconds for company and are downscaled to BATCH_PACK_MAX_EDGE pixels first.
+BATCH_PACK_SIZE = int(os.getenv('BATCH_PACK_SIZE', '1'))
+BATCH_PACK_LINGER = float(os.getenv('BATCH_PACK_LINGER', '0.2'))
+BATCH_PACK_MAX_EDGE = int(os.getenv('BATCH_PACK_MAX_EDGE', '512'))
+
+class _Pack:
+    """Images collected for one multi-image request, and the per-image results"""
+    __slots__ = ("images", "results", "full", "done")
+
+    def __init__(self, event_type):
+        self.images = []
+        self.results = None
+        self.full = event_type()
+        self.done = event_type()
+
+class ImagePacker:
+    """Coalesces concurrent batch items into multi-image provider requests.
+
+    The first item to arrive leads a pack: it waits until the pack is full or the
+    linger time is up, sends the request and hands every follower its analysis.
+    A None result tells the item to make its own single-image call.
+    """
+
+    def __init__(self, generator: 'ArabStockMetadataGenerator', config: AIConfig,
+                 size: int = BATCH_PACK_SIZE, linger: float = BATCH_PACK_LINGER, max_edge: int = BATCH_PACK_MAX_EDGE):
+        self.generator = generator
+        self.config = config
+        self.size = size
+        self.linger = linger
+        self.max_edge = max_edge
+        self._lock = threading.Lock()
+        self._open = None
+
+    @classmethod
+    def for_batch(cls, generator: 'ArabStockMetadataGenerator') -> Optional['ImagePacker']:
+        """A packer for the current remote provider, or None when packing is off"""
+        config = generator.current_ai_config
+        if BATCH_PACK_SIZE <= 1 or config.provider == AIProvider.OFFLINE:
+            return None
+        return cls(generator, config)
+
+    def accepts(self, config: AIConfig) -> bool:
+        return config.provider == self.config.provider and config.model == self.config.model
+
+    def _shrink(self, prepared: PreparedImage) -> PreparedImage:
+        if max(prepared.image.size) <= self.max_edge:
+            return prepared
+        image = prepared.image.copy()
+        image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+        return PreparedImage(image, prepared.original_size, prepared.image_format, prepared.quality)
+
+    def _join(self, prepared: PreparedImage, event_type) -> Tuple[_Pack, int, bool]:
+        image = self._shrink(prepared)
+        with self._lock:
+            pack = self._open
+            leader = pack is None
+            if leader:
+                pack = self._open = _Pack(event_type)
+            index = len(pack.images)
+            pack.images.append(image)
+            if len(pack.images) >= self.size:
+                self._open = None
+                pack.full.set()
+        return pack, index, leader
+
+    def _seal(self, pack: _Pack):
+        with self._lock:
+            if self._open is pack:
+                self._open = None
+
+    def analyze(self, prepared: PreparedImage) -> Optional[Dict]:
+        """This image's analysis from a shared request, or None"""
+        pack, index, leader = self._join(prepared, threading.Event)
+        if not leader:
+            pack.done.wait()
+            return pack.results[index]
+
+        pack.full.wait(self.linger)
+        self._seal(pack)
+        try:
+            # A lone image is better served by the regular single-image call
+            if len(pack.images) > 1:
+                pack.results = self.generator.analyze_pack(pack.images, self.config)
+        finally:
+            pack.results = pack.results or [None] * len(pack.images)
+            pack.done.set()
+        return pack.results[index]
+
+    async def analyze_async(self, prepared: PreparedImage) -> Optional[Dict]:
+        """Async variant of analyze, for packers used from one event loop"""
+        pack, index, leader = self._join(prepared, asyncio.Event)
+        if not leader:
+            await pack.done.wait()
+            return pack.results[index]
+
+        try:
+            await asyncio.wait_for(pack.full.wait(), self.linger)
+        except asyncio.TimeoutError:
+            pass
+        self._seal(pack)
+        try:
+            if len(pack.images) > 1:
+                pack.results = await self.generator.analyze_pack_async(pack.images, self.config)
+        finally:
+            pack.results = pack.results or [None] * len(pack.images)
+            pack.done.set()
+        return pack.results[index]
+
+# Embedding metadata into JPEGs: XMP (APP1) and IPTC-IIM (APP13) segments are spliced
+# into the header and everything from the scan onwards is copied byte for byte
+XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+PHOTOSHOP_HEADER = b'Photoshop 3.0\x00'
+IPTC_RESOURCE = 0x0404
+IPTC_DIGEST_RESOURCE = 0x0425   # MD5 of the old IPTC block, stale once it is replaced
+MAX_SEGMENT_PAYLOAD = 65533
+
+class MetadataEmbedError(ValueError):
+    """The image can't carry embedded metadata (not a JPEG, or the metadata is too large)"""
+
+def _xml_alt(values: List[Tuple[str, str]]) -> str:
+    items = "".join(f'<rdf:li xml:lang="{lang}">{xml_escape(value)}</rdf:li>' for lang, value in values if value)
+    return f"<rdf:Alt>{items}</rdf:Alt>"
+
+def _xml_bag(values: List[Tuple[Optional[str], str]]) -> str:
+    items = "".join(
+        f'<rdf:li xml:lang="{lang}">{xml_escape(value)}</rdf:li>' if lang else f"<rdf:li>{xml_escape(value)}</rdf:li>"
+        for lang, value in values if value
+    )
+    return f"<rdf:Bag>{items}</rdf:Bag>"
 
-            content = response.choices[0].message.content
-            # Try to extract JSON from response
-            try:
-                analysis = json.loads(content)
-            except:
-                # If not valid JSON, create structure response from text
-                analysis = self._parse_text_analysis(content)
+def build_xmp(metadata: Dict) -> bytes:
+    """XMP packet with titles, keywords, category and license; Arabic values carry xml:lang="ar\""""
+    titles = metadata.get("titles", {})
+    keywords = metadata.get("keywords", {})
+    category = metadata.get("category", {})
+    title_alt = _xml_alt([("x-default", titles.get("en")), ("en", titles.get("en")), ("ar", titles.get("ar"))])
+    subjects = _xml_bag([(None, keyword) for keyword in keywords.get("en", [])]
+                        + [("ar", keyword) for keyword in keywords.get("ar", [])])
+    packet = (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about=""'
+        ' xmlns:dc="http://purl.org/dc/elements/1.1/"'
+        ' xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/"'
+        ' xmlns:xmpRights="http://ns.adobe.com/xap/1.0/rights/">'
+        f'<dc:title>{title_alt}</dc:title>'
+        f'<dc:description>{title_alt}</dc:description>'
+        f'<dc:subject>{subjects}</dc:subject>'
+        f'<photoshop:Headline>{xml_escape(titles.get("en", ""))}</photoshop:Headline>'
+        '<photoshop:SupplementalCategories>'
+        f'{_xml_bag([(None, category.get("en")), ("ar", category.get("ar"))])}'
+        '</photoshop:SupplementalCategories>'
+        f'<xmpRights:UsageTerms>{_xml_alt([("x-default", metadata.get("license"))])}</xmpRights:UsageTerms>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+        # Padding lets other tools edit the packet in place
+        + ' ' * 1024 +
+        '<?xpacket end="w"?>'
+    )
+    return packet.encode('utf-8')
 
-        except Exception as e:
-            print(f"OpenAI analysis error: {e}")
-            return self._get_fallback_analysis()
+def _iptc_field(dataset: int, value, limit: int = None) -> bytes:
+    data = value if isinstance(value, bytes) else value.encode('utf-8')
+    if limit is not None and len(data) > limit:
+        # Cut on a character boundary
+        data = data[:limit].decode('utf-8', 'ignore').encode('utf-8')
+    record, number = divmod(dataset, 1000)
+    return struct.pack('>BBBH', 0x1C, record, number, len(data)) + data
 
-    def _analyze_with_gemini(self, image_data: str) -> Dict:
-        """Analyze image using Gemini Vision API"""
-        try:
-            # Convert base64 to PIL Image for gemini
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+def build_iptc(metadata: Dict) -> bytes:
+    """IPTC-IIM block (UTF-8) with the same fields as the XMP packet"""
+    titles = metadata.get("titles", {})
+    keywords = metadata.get("keywords", {})
+    category = metadata.get("category", {})
+    fields = [
+        _iptc_field(1090, b'\x1b%G'),       # coded character set: UTF-8
+        _iptc_field(2000, b'\x00\x04'),     # record version
+        _iptc_field(2005, titles.get("en", ""), 64),
+        _iptc_field(2105, titles.get("en", ""), 256),
+        _iptc_field(2120, " / ".join(title for title in (titles.get("en"), titles.get("ar")) if title), 2000)
+    ]
+    fields += [_iptc_field(2025, keyword, 64) for keyword in keywords.get("en", []) + keywords.get("ar", []) if keyword]
+    fields += [_iptc_field(2020, name, 32) for name in (category.get("en"), category.get("ar")) if name]
+    if metadata.get("license"):
+        fields.append(_iptc_field(2116, metadata["license"], 128))
+    return b"".join(fields)
 
-            model = genai.GenerativeModel('gemini-pro-vision')
+def _photoshop_resources(payload: bytes) -> List[Tuple[int, bytes, bytes]]:
+    """(id, pascal name, data) of each 8BIM resource in an APP13 payload"""
+    resources = []
+    position = len(PHOTOSHOP_HEADER)
+    while position + 12 <= len(payload) and payload[position:position + 4] == b'8BIM':
+        resource_id = struct.unpack('>H', payload[position + 4:position + 6])[0]
+        name_length = payload[position + 6]
+        name_end = position + 7 + name_length + (1 - name_length % 2)   # padded to even
+        name = payload[position + 6:name_end]
+        size = struct.unpack('>I', payload[name_end:name_end + 4])[0]
+        data = payload[name_end + 4:name_end + 4 + size]
+        resources.append((resource_id, name, data))
+        position = name_end + 4 + size + size % 2
+    return resources
 
-            prompt = """Analyze this image for stock photography metadata for Arab/Middle Eastern markets.
-            Describe: main subject, people, objects, setting, mood, colors, style, cultural context.
-            Format as JSON: {"main_subject": "", "people": [], "objects": [], "setting": "", "mood": "", "colors": [], "style": "", "cultural_context": ""}"""
+def _photoshop_segment(existing: Optional[bytes], iptc: bytes) -> bytes:
+    """APP13 payload with the IPTC resource replaced and other resources kept"""
+    resources = [
+        resource for resource in (_photoshop_resources(existing) if existing else [])
+        if resource[0] not in (IPTC_RESOURCE, IPTC_DIGEST_RESOURCE)
+    ]
+    resources.append((IPTC_RESOURCE, b'\x00\x00', iptc))
+    blocks = [
+        b'8BIM' + struct.pack('>H', resource_id) + name + struct.pack('>I', len(data)) + data + b'\x00' * (len(data) % 2)
+        for resource_id, name, data in resources
+    ]
+    return PHOTOSHOP_HEADER + b"".join(blocks)
 
-            response = model.generate_content([prompt, image])
+def _read_jpeg_header(file) -> List[Tuple[int, bytes]]:
+    """(marker, payload) of every segment before the first scan; the file is left at the SOS marker"""
+    if file.read(2) != b'\xff\xd8':
+        raise MetadataEmbedError("Only JPEG images can carry embedded metadata")
+    segments = []
+    while True:
+        start = file.tell()
+        prefix = file.read(2)
+        while len(prefix) == 2 and prefix[0] == 0xFF and prefix[1] == 0xFF:
+            prefix = prefix[1:] + file.read(1)  # fill bytes
+        if len(prefix) < 2 or prefix[0] != 0xFF:
+            raise MetadataEmbedError("Corrupt JPEG header")
+        marker = prefix[1]
+        if marker == 0xDA or marker == 0xD9:
+            file.seek(start)
+            return segments
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            segments.append((marker, None))
+            continue
+        length = struct.unpack('>H', file.read(2))[0]
+        payload = file.read(length - 2)
+        if len(payload) != length - 2:
+            raise MetadataEmbedError("Truncated JPEG header")
+        segments.append((marker, payload))
 
-            # Try to extract JSON from response
-            try:
-                content = response.text
-                # Look for JSON in the response
-                start = content.find('{')
-                end = content.rfind('}') + 1
-                if start != -1 and end != 0:
-                    json_str = content[start:end]
-                    analysis = json.loads(json_str)
-                else:
-                    analysis = self._parse_text_analysis(content)
-            except:
-                analysis = self._parse_text_analysis(response.text)
+def _embedded_header(segments: List[Tuple[int, bytes]], metadata: Dict) -> bytes:
+    """SOI and header segments with fresh XMP and IPTC segments after JFIF/Exif"""
+    xmp = XMP_HEADER + build_xmp(metadata)
+    existing_photoshop = next(
+        (payload for marker, payload in segments if marker == 0xED and payload.startswith(PHOTOSHOP_HEADER)), None
+    )
+    photoshop = _photoshop_segment(existing_photoshop, build_iptc(metadata))
+    if len(xmp) > MAX_SEGMENT_PAYLOAD or len(photoshop) > MAX_SEGMENT_PAYLOAD:
+        raise MetadataEmbedError("Metadata does not fit in a single JPEG segment")
 
-            return analysis
+    kept = [
+        (marker, payload) for marker, payload in segments
+        if not (marker == 0xE1 and payload.startswith(XMP_HEADER))
+        and not (marker == 0xED and payload.startswith(PHOTOSHOP_HEADER))
+    ]
+    # JFIF (APP0) and Exif (APP1) have to stay first
+    insert_at = 0
+    while insert_at < len(kept) and kept[insert_at][0] in (0xE0, 0xE1):
+        insert_at += 1
+    kept[insert_at:insert_at] = [(0xE1, xmp), (0xED, photoshop)]
 
-        except Exception as e:
-            print(f"Gemini analysis error: {e}")
-            return self._get_fallback_analysis()
+    parts = [b'\xff\xd8']
+    for marker, payload in kept:
+        parts.append(bytes((0xFF, marker)))
+        if payload is not None:
+            parts.append(struct.pack('>H', len(payload) + 2) + payload)
+    return b"".join(parts)
 
-    def _analyze_offline(self, image_data: str) -> Dict:
-        """Offline analysis using basic image processing"""
-        try:
-            # Convert base64 to PIL image
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+def embedded_jpeg_header(file, metadata: Dict) -> bytes:
+    """The file's JPEG header with metadata spliced in; the file is left at the start of the scan"""
+    return _embedded_header(_read_jpeg_header(file), metadata)
 
-            # Basic image analysis
-            width, height = image.size
-            aspect_ratio = width / height
+def embed_metadata(jpeg: bytes, metadata: Dict) -> bytes:
+    """A copy of the JPEG with metadata in its XMP and IPTC segments; pixel data is not touched"""
+    source = io.BytesIO(jpeg)
+    header = embedded_jpeg_header(source, metadata)
+    return header + jpeg[source.tell():]
 
-            # Determine likely content based on aspect ratio and size
-            if aspect_ratio >1.5:
-                setting = "landscape or panoramic view"
-                main_subject = "wide scene"
-            elif aspect_ratio < 0.7:
-                setting = "portrait or vertical composition"
-                main_subject = "person or tall subject"
-            else:
-                setting = "standard composition"
-                main_subject = "balanced scene"
+def embed_metadata_file(source_path: str, metadata: Dict, destination: str = None) -> str:
+    """Embed metadata into a JPEG file, streaming the scan data; in place unless a destination is given"""
+    destination = destination or source_path
+    directory = os.path.dirname(os.path.abspath(destination))
+    with open(source_path, 'rb') as source:
+        header = embedded_jpeg_header(source, metadata)
+        # Write next to the destination and swap it in, so a crash never leaves half a file
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(descriptor, 'wb') as out:
+                out.write(header)
+                shutil.copyfileobj(source, out, UPLOAD_CHUNK_SIZE * 16)
+            os.replace(temporary, destination)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    return destination
 
-            # Get dominant colors (simplified)
-            image_rgb = image.convert('RGB')
-            colors = ['blue', 'red', 'green', 'yellow', 'white', 'black'] # Simplified
+# Process-wide generator shared by all requests
+_generator = None
+_generator_lock = threading.Lock()
 
-            return {
-                "main_subject": main_subject,
-                "people": ["person"],
-                "objects": ["general object"],
-                "setting": setting,
-                "mood": "professional",
-                "colors": random.sample(colors, 3),
-                "style": "modern",
-                "cultural_context": "arab business enviroment"
-            }
+def get_generator() -> ArabStockMetadataGenerator:
+    """Return the long-lived generator, creating it on first use"""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = ArabStockMetadataGenerator()
+    return _generator
 
-        except Exception as e:
-            print(f"Offline analysis error: {e}")
-            return self._get_fallback_analysis()
+# Durable job queue for large backlogs, processed by worker processes (see jobs.py)
+JOB_DB = os.getenv('JOB_DB', 'jobs.db')
+JOB_DIR = os.getenv('JOB_DIR', 'job_images')
+JOB_LEASE = float(os.getenv('JOB_LEASE', '300'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_MAX_ITEMS = int(os.getenv('JOB_MAX_ITEMS', '1000'))
+JOB_WORKER_THREADS = int(os.getenv('JOB_WORKER_THREADS', '4'))
 
-    def _parse_text_analysis(self, text: str) -> Dict:
-        """Parse text analysis into structured format when, JSON parsing fails """
-        return {
-            "main_subject": "professional scene",
-            "people": ["person", "professional"],
-            "objects": ["business items"],
-            "setting": "modern environment",
-            "mood": "professional",
-            "colors": ["blue", "white", "gray"],
-            "style": "contemporary",
-            "cultural_context": "arab business setting"
-        }
+class JobQueue:
+    """SQLite-backed analysis jobs, one per image, shared by the API and worker processes.
 
-    def _get_fallback_analysis(self) -> Dict:
-        """Fallback analysis when AI service is unavailable"""
-        return {
-            "main_subject": "professional scene",
-            "people": ["person", "professional"],
-            "objects": ["business items"],
-            "setting": "modern environment",
-            "mood": "professional",
-            "colors": ["blue", "white", "gray"],
-            "style": "contemporary",
-            "cultural_context": "arab business setting"
-        }
+    Jobs are keyed by image hash, so resubmitting an image returns its existing
+    job. Workers hold a lease while processing; a job whose lease runs out
+    (worker crashed or was killed) is picked up again, up to max_attempts.
+    """
 
-    def generate_titles(self, analysis: Dict) -> Dict[str, str]:
-        """Generated optimized titles in English and Arabic"""
+    def __init__(self, db_path: str = JOB_DB, image_dir: str = JOB_DIR, lease: float = JOB_LEASE,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.image_dir = image_dir
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
 
-        # English title generation with AI-based analysis
-        main_subject = analysis.get("main_subject", "business scene")
-        setting = analysis.get("setting", "office")
-        cultural_context = analysis.get("cultural_context", "arab")
+        os.makedirs(image_dir, exist_ok=True)
+        # Autocommit mode; claims take an explicit write lock across processes
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, digest TEXT NOT NULL UNIQUE, label TEXT, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, result TEXT, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, updated_at, job_id)")
 
-        en_templates = [
-            f"Professional {main_subject} in Modern Arab {setting}",
-            f"Middle Eastern {main_subject} - Business Excellence",
-            f"Contemporary Arab {main_subject} in {setting}",
-            f"Gulf Business - {main_subject} Success Story",
-            f"Islamic Culture - Modern {main_subject}",
-            f"Arab Professional {main_subject} Meeting",
-            f"Dubai Style {main_subject} in {setting}",
-            f"Saudi Business {main_subject} Innovation"
-        ]
+    def image_path(self, digest: str) -> str:
+        return os.path.join(self.image_dir, digest)
 
-        # Arabic title generation
-        ar_templates = [
-            f"اجتماع أعمال عربي مهني في مكتب حديث",
-            f"التميز في الأعمال الشرق أوسطية - مشهد مهني",
-            f"ثقافة عربية معاصرة في بيئة العمل",
-            f"أعمال الخليج - قصة نجاح مهنية",
-            f"الثقافة الإسلامية - مشهد أعمال حديث",
-            f"اجتماع مهني عربي ناجح",
-            f"أسلوب دبي في الأعمال المهنية",
-            f"ابتكار الأعمال السعودية الحديث"
-        ]
+    def _save_image(self, upload: ImageUpload):
+        """Write the upload under its digest, atomically so workers never see a partial file"""
+        path = self.image_path(upload.digest)
+        if os.path.exists(path):
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.image_dir, suffix='.part')
+        with os.fdopen(fd, 'wb') as out:
+            source = upload.open()
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+                out.write(chunk)
+        os.replace(temp_path, path)
 
-        en_title = random.choice(en_templates)
-        ar_title = random.choice(ar_templates)
+    def submit(self, upload: ImageUpload, label: str = None) -> Tuple[Dict, bool]:
+        """Queue an image; returns (job, created). Failed jobs are queued again."""
+        now = time.time()
+        with self._lock:
+            job = self._find("digest = ?", (upload.digest,))
+            if job is not None and job["status"] != "failed":
+                return job, False
 
-        return {
-            "en": en_title,
-            "ar": ar_title
-        }
+            self._save_image(upload)
+            if job is None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO jobs (job_id, digest, label, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?)",
+                    (uuid.uuid4().hex, upload.digest, label, now, now)
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, result = NULL, "
+                    "worker = NULL, lease_until = NULL, label = COALESCE(?, label), updated_at = ? "
+                    "WHERE job_id = ? AND status = 'failed'",
+                    (label, now, job["job_id"])
+                )
+            return self._find("digest = ?", (upload.digest,)), True
 
-    def generate_keywords(self, analysis: Dict) -> Dict[str, List[str]]:
-        """Generate relevant keywords in both languages based on AI analysis"""
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Lease the oldest runnable job to a worker"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'worker lost (lease expired)', updated_at = ? "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts)
+                )
+                row = self._db.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                        "lease_until = ?, updated_at = ? WHERE job_id = ?",
+                        (worker, now + self.lease, now, row["job_id"])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            return self._find("job_id = ?", (row["job_id"],)) if row is not None else None
 
-        base_keywords_en = []
-        base_keywords_ar = []
+    def complete(self, job_id: str, result: Dict):
+        job = self.get(job_id)
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE job_id = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+        self._discard_image(job)
 
-        # Extract keywords from analysis
-        main_subject = analysis.get("main_subject", "").lower()
-        people = analysis.get("people", [])
-        objects = analysis.get("objects", [])
-        setting = analysis.get("setting", "").lower()
-        mood = analysis.get("mood", "").lower()
-        cultural_context = analysis.get("cultural_context", "").lower()
+    def fail(self, job_id: str, error: str):
+        """Record a failed attempt; the job is retried until it runs out of attempts"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+                "error = ?, lease_until = NULL, updated_at = ? WHERE job_id = ?",
+                (self.max_attempts, error, time.time(), job_id)
+            )
+        job = self.get(job_id)
+        if job and job["status"] == "failed":
+            self._discard_image(job)
 
-        # Add subject based keywords
-        if any(word in main_subject for word in ["business", "meeting", "professional"]):
-            base_keywords_en.extend(["business", "professional", "meeting", "office", "corporate", "teamwork"])
-            base_keywords_ar.extend(["تكنولوجيا", "رقمي", "ابتكار", "كمبيوتر", "تقني"])
+    def recover(self, hostname: str) -> int:
+        """Settle jobs held by dead worker processes on this host without waiting for their lease.
 
-        if any(word in main_subject for word in ["technology", "computer", "digital"]):
-            base_keywords_en.extend(["technology", "digital", "innovation", "computer", "tech"])
-            base_keywords_ar.extend(["تكنولوجيا", "رقمي", "ابتكار", "كمبيوتر", "تقني"])
+        The attempt the dead worker spent is kept, so an image that crashes its worker
+        (e.g. out of memory while decoding) fails after max_attempts instead of crash-looping.
+        """
+        prefix = hostname + ':'
+        recovered = 0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id, worker FROM jobs WHERE status = 'running' AND substr(worker, 1, ?) = ?",
+                (len(prefix), prefix)
+            ).fetchall()
+            for row in rows:
+                pid = int(row["worker"][len(prefix):].split('/')[0])
+                if not _pid_alive(pid):
+                    self._db.execute(
+                        "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+                        "error = 'worker process died', lease_until = NULL, updated_at = ? "
+                        "WHERE job_id = ? AND status = 'running'",
+                        (self.max_attempts, time.time(), row["job_id"])
+                    )
+                    recovered += 1
+        for row in rows:
+            job = self.get(row["job_id"])
+            if job and job["status"] == "failed":
+                self._discard_image(job)
+        return recovered
 
-        # add people-based keywords
-        if people:
-            base_keywords_en.extend(["people", "person", "team", "group", "professional"])
-            base_keywords_ar.extend(["أشخاص", "شخص", "فريق", "مجموعة", "مهني"])
+    def _discard_image(self, job: Optional[Dict]):
+        if job is None:
+            return
+        try:
+            os.remove(self.image_path(job["digest"]))
+        except OSError:
+            pass
 
-        # add cultural context keywords
-        if "arab" in cultural_context or "middle" in cultural_context:
-            base_keywords_en.extend(["Arab", "Middle Eastern", "Islamic", "Muslim", "Gulf"])
-            base_keywords_ar.extend(["عربي", "شرق أوسطي", "إسلامي", "مسلم", "خليجي"])
+    def _find(self, where: str, params: Tuple) -> Optional[Dict]:
+        row = self._db.execute(f"SELECT * FROM jobs WHERE {where}", params).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
 
-        # add mood-based keywords
-        if "professional" in mood:
-            base_keywords_en.extend(["success", "achievement", "excellence"])
-            base_keywords_ar.extend(["نجاح", "إنجاز", "تميز"])
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._find("job_id = ?", (job_id,))
 
-        # add objects as keywords
-        base_keywords_en.extend([obj.lower() for obj in objects if isinstance(obj, str)])
+    def iter_done(self, since: float = None, until: float = None, job_ids: List[str] = None,
+                  category: str = None, page_size: int = 500):
+        """Finished jobs in completion order, read a page at a time so exports run in constant memory"""
+        where = ["status = 'done'", "(updated_at, job_id) > (?, ?)"]
+        filters = []
+        if since is not None:
+            where.append("updated_at >= ?")
+            filters.append(since)
+        if until is not None:
+            where.append("updated_at < ?")
+            filters.append(until)
+        if job_ids:
+            where.append(f"job_id IN ({', '.join('?' * len(job_ids))})")
+            filters.extend(job_ids)
+        if category:
+            where.append(
+                "(json_extract(result, '$.metadata.category.en') = ? COLLATE NOCASE "
+                "OR json_extract(result, '$.metadata.category.ar') = ?)"
+            )
+            filters.extend([category, category])
+        query = (f"SELECT job_id, label, updated_at, result FROM jobs WHERE {' AND '.join(where)} "
+                 "ORDER BY updated_at, job_id LIMIT ?")
 
-        # add colors and style
-        colors = analysis.get("colors", [])
-        base_keywords_en.extend(colors)
+        # Keyset pagination: the lock is held per page, never for the whole export
+        cursor = (0.0, '')
+        while True:
+            with self._lock:
+                rows = self._db.execute(query, (*cursor, *filters, page_size)).fetchall()
+            for row in rows:
+                job = dict(row)
+                job["result"] = json.loads(job["result"]) if job["result"] else None
+                yield job
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1]["updated_at"], rows[-1]["job_id"])
 
-        style = analysis.get("style", "")
-        if style:
-            base_keywords_en.append(style)
+    def stats(self) -> Dict:
+        """Job counts by status"""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
 
-        # add trending keywords for better performance
-        base_keywords_en.extend(random.sample(self.trending_keywords["en"], 5))
-        base_keywords_ar.extend(random.sample(self.trending_keywords["ar"], 5))
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
-        # Remove duplicates and limit
-        final_en = list(set([kw for kw in base_keywords_en if kw and len(kw) > 1]))[:30]
-        final_ar = list(set([kw for kw in base_keywords_ar if kw and len(kw) > 1]))[:30]
+_job_queue = None
+_job_queue_lock = threading.Lock()
 
-        return {
-            "en": final_en,
-            "ar": final_ar
-        }
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, creating its database on first use"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
 
-    def suggest_category(self, analysis: Dict) -> Tuple[str, str]:
-        """Suggest the most appropriate category based on AI analysis"""
+def process_job(queue: JobQueue, generator: ArabStockMetadataGenerator, job: Dict, packer: ImagePacker = None):
+    """Run the analysis -> metadata pipeline for one claimed job"""
+    try:
+        with open(queue.image_path(job["digest"]), 'rb') as file:
+            result = generator.analyze_image(ImageUpload(file, job["digest"]), packer)
+        # The generic fallback means the provider never answered; retry the job later
+        if result.source == "fallback":
+            raise RuntimeError("analysis failed, provider returned no result")
+        queue.complete(job["job_id"], {
+            "metadata": generator.build_metadata(result.analysis),
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model,
+            **result.details()
+        })
+    except Exception as e:
+        print(f"Job {job['job_id']} error: {e}")
+        queue.fail(job["job_id"], str(e))
 
-        main_subject = analysis.get("main_subject", "").lower()
-        objects = [obj.lower() for obj in analysis.get("objects", []) if isinstance(obj, str)]
-        setting = analysis.get("setting", "").lower()
-        cultural_context = analysis.get("cultural_context", "").lower()
+def run_job_worker(threads: int = JOB_WORKER_THREADS, poll_interval: float = 1.0):
+    """Worker process main loop: claim and process jobs until SIGTERM/SIGINT"""
+    queue = JobQueue()
+    generator = get_generator()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    # Jobs claimed together by this process's threads can share provider requests
+    packer = ImagePacker.for_batch(generator)
+    stop = threading.Event()
 
-        # Business category detection
-        if any(word in main_subject for word in ["business", "meeting", "professional", "office"]):
-            return "Business", "أعمال"
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
 
-        # People category detection
-        elif any(word in main_subject for word in ["people", "person", "family", "group"]):
-            return "People", "أشخاص"
+    def loop(slot: int):
+        # Several threads per process overlap provider latency; processes add cores.
+        # Background jobs share one fair-queueing slot with interactive callers.
+        current_caller.set('jobs')
+        while not stop.is_set():
+            job = queue.claim(f"{worker_id}/{slot}")
+            if job is None:
+                stop.wait(poll_interval)
+                continue
+            process_job(queue, generator, job, packer)
 
-        # Technology category detection
-        elif any(word in main_subject + " ".join(objects) for word in ["technology", "computer", "digital", "tech", "laptop"]):
-            return "Technology", "تكنولوجيا"
+    workers = [threading.Thread(target=loop, args=(slot,), daemon=True) for slot in range(threads)]
+    for worker in workers:
+        worker.start()
+    while not stop.is_set():
+        stop.wait(1.0)
+    for worker in workers:
+        worker.join()
 
-        # Culture category detection
-        elif any(word in cultural_context for word in ["culture", "traditional", "heritage", "islamic"]):
-            return "Culture", "ثقافة"
+# Bulk export of finished jobs, in the contributor portal's CSV upload layout or as JSON lines
+EXPORT_CSV_COLUMNS = ("filename", "title_en", "title_ar", "keywords_en", "keywords_ar",
+                      "category_en", "category_ar", "license")
+EXPORT_KEYWORD_SEPARATOR = ", "
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
 
-        # Architecture category detection
-        elif any(word in setting for word in ["building", "architecture", "contruction", "city"]):
-            return "Architecture", "عمارة"
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Epoch seconds from epoch seconds or an ISO 8601 date/time (UTC unless it has an offset)"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
 
-        # Default to people category
-        else:
-            return "People", "أشخاص"
+def export_record(generator: ArabStockMetadataGenerator, job: Dict) -> Dict:
+    """Portal fields of one finished job"""
+    metadata = job["result"]["metadata"]
+    license_type = metadata.get("license") or generator.determine_license_type(metadata["analysis"])
+    return {
+        "job_id": job["job_id"],
+        "filename": job["label"] or job["job_id"],
+        "completed_at": datetime.fromtimestamp(job["updated_at"], timezone.utc).isoformat(timespec='seconds'),
+        "title": metadata["titles"],
+        "keywords": metadata["keywords"],
+        "category": metadata["category"],
+        "license": license_type
+    }
 
-    def determine_license_type(self, analysis: Dict) -> str:
-        """Determine if image should be commercial or editorial based on AI analysis"""
+def _buffered(lines, flush_size: int = UPLOAD_CHUNK_SIZE):
+    """Join small lines into chunks of about flush_size characters"""
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= flush_size:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield "".join(chunk)
 
-        main_subject = analysis.get("main_subject", "").lower()
-        objects = [obj.lower() for obj in analysis.get ("objects", []) if isinstance(obj, str)]
-        setting = analysis.get("setting", "").lower()
+def iter_export_csv(records):
+    """Portal CSV, one row per record; the header goes out before the first record is read"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
 
-        # Editorial licence indicators
-        editorial_indicators = [
-            "news", "event", "celebrity", "politician", "protest", "demonstration",
-            "breaking news", "journalism", "reporter", "interview", "press conference"
-        ]
+    def row(values) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
 
-        if any(indicator in main_subject + " ".join(objects) + setting for indicator in editorial_indicators):
-            return "editorial"
-        else:
-            return "commercial"
+    # The BOM makes spreadsheet apps read the Arabic columns as UTF-8
+    yield "\ufeff" + row(EXPORT_CSV_COLUMNS)
+    yield from _buffered(row((
+        record["filename"],
+        record["title"].get("en", ""),
+        record["title"].get("ar", ""),
+        EXPORT_KEYWORD_SEPARATOR.join(record["keywords"].get("en", [])),
+        EXPORT_KEYWORD_SEPARATOR.join(record["keywords"].get("ar", [])),
+        record["category"].get("en", ""),
+        record["category"].get("ar", ""),
+        record["license"]
+    )) for record in records)
+
+def iter_export_jsonl(records):
+    """One JSON object per line and record"""
+    yield from _buffered(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
 
 # Enhanced API Endpoints with AI Provider Selection
 
+def caller_id(headers, remote_addr: str = None) -> str:
+    """Identify the caller for fair queueing: an explicit contributor header, else the client address"""
+    return headers.get('X-Contributor-Id') or remote_addr or 'anonymous'
+
+@app.before_request
+def _start_request():
+    current_caller.set(caller_id(request.headers, request.remote_addr))
+    current_trace.set(RequestTrace(request.method, request.path))
+
+@app.after_request
+def _finish_request(response):
+    trace = current_trace.get()
+    if trace is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        if response.is_streamed:
+            # Streams are timed until the server closes them, after the last chunk or a disconnect
+            response.call_on_close(functools.partial(trace.finish, endpoint, response.status_code))
+        else:
+            trace.finish(endpoint, response.status_code)
+        response.headers['X-Request-Id'] = trace.request_id
+        current_trace.set(None)
+    return response
+
 @app.route('/api/providers', methods=['GET'])
 def get_available_providers():
     """Get list of available AI roviders"""
-    generator = ArabStockMetadataGenerator
+    generator = get_generator()
 
     providers_info = []
 
@@ -533,7 +4132,7 @@ def set_ai_provider():
         if not provider:
             return jsonify({"error": "Provider name is required"}), 400
 
-        generator = ArabStockMetadataGenerator()
+        generator = get_generator()
         success = generator.set_ai_provider(provider, api_key, model)
 
         if success:
@@ -542,47 +4141,53 @@ def set_ai_provider():
                 "message": f"Successfully switched to {provider}",
                 "current_provider": generator.current_ai_config.provider.value,
                 "model": generator.current_ai_config.model
-            }), 400
+            })
+
+        return jsonify({
+            "status": "error",
+            "message": f"Failed to switch to {provider}",
+            "current_provider": generator.current_ai_config.provider.value,
+            "model": generator.current_ai_config.model
+        }), 400
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _read_image_upload():
+    """Image from a raw binary body, a multipart 'image' file or base64 JSON"""
+    if request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/'):
+        # Streamed straight into a spooled file, never held as one big JSON string
+        upload = ImageUpload.from_stream(request.stream)
+        return upload if upload.digest != EMPTY_DIGEST else None
+
+    if request.files:
+        upload = request.files.get('image')
+        return ImageUpload.from_file(upload.stream) if upload else None
+
+    data = request.get_json(silent=True) or {}
+    return data.get('image') # Base64 encoded image
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
     """Main endpoint to analyze image and generate metadata with selected AI provider"""
 
     try:
-        data = request.json
-        image_data = data.get('image') # Base64 encoded image
+        image_data = _read_image_upload()
 
         if not image_data:
             return jsonify({"error": "No image data provided"}), 400
 
-        generator = ArabStockMetadataGenerator()
+        generator = get_generator()
 
         # Analyze image with selected AI provider
-        analysis = generator.analyze_image_with_ai(image_data)
-
-        # Generate metadata based on analysis
-        titles = generator.generate_titles(analysis)
-        keywords = generator.generate_keywords(analysis)
-        category = generator.suggest_category(analysis)
-        license_type = generator.determine_license_type(analysis)
+        result = generator.analyze_image(image_data)
 
         response = {
             "status": "success",
-            "metadata": {
-                "titles": titles,
-                "keywords": keywords,
-                "category": {
-                    "en": category[0],
-                    "ar": category[1]
-                },
-                "license": license_type,
-                "analysis": analysis
-            },
+            "metadata": generator.build_metadata(result.analysis),
             "ai_provider": generator.current_ai_config.provider.value,
-            "model_used": generator.current_ai_config.model
+            "model_used": generator.current_ai_config.model,
+            **result.details()
         }
 
         return jsonify(response)
@@ -590,6 +4195,406 @@ def analyze_image():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Worker pool shared by batch requests; per-provider limits are enforced by the generator
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '16'))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def get_batch_executor() -> ThreadPoolExecutor:
+    """Return the process-wide batch worker pool"""
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(
+                    max_workers=BATCH_MAX_WORKERS,
+                    thread_name_prefix='batch'
+                )
+    return _batch_executor
+
+def _iter_batch_items():
+    """Yield batch items from a JSON body or a multipart upload"""
+    if request.files:
+        for index, upload in enumerate(request.files.getlist('images')):
+            # The upload itself is passed on so it is only read by the worker
+            yield {"id": upload.filename or str(index), "image": upload}
+        return
+
+    data = request.get_json(silent=True) or {}
+    for index, entry in enumerate(data.get('images', [])):
+        # Accept bare base64 strings or {"id": ..., "image": ...} objects
+        if isinstance(entry, dict):
+            yield {"id": entry.get('id', str(index)), "image": entry.get('image')}
+        else:
+            yield {"id": str(index), "image": entry}
+
+def iter_batch_results(generator: ArabStockMetadataGenerator, items, window: int = None):
+    """Yield per-item results as they finish, keeping at most `window` items in flight"""
+    executor = get_batch_executor()
+    window = window or BATCH_MAX_WORKERS * 2
+    packer = ImagePacker.for_batch(generator)
+    items = enumerate(items)
+    pending = {}
+
+    def submit_next() -> bool:
+        for index, item in items:
+            # Workers inherit the request's context, e.g. the caller used for fair queueing
+            future = executor.submit(
+                contextvars.copy_context().run, generator.analyze_batch_item, item["image"], packer
+            )
+            pending[future] = (index, item["id"])
+            return True
+        return False
+
+    while len(pending) < window and submit_next():
+        pass
+
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item_id = pending.pop(future)
+                result = future.result()
+                result.update({"index": index, "id": item_id})
+                yield result
+                submit_next()
+    finally:
+        # A disconnected client closes the generator: drop the items still waiting for a worker
+        for future in pending:
+            future.cancel()
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze several images concurrently and return per-item metadata"""
+
+    try:
+        items = list(_iter_batch_items())
+
+        if not items:
+            return jsonify({"error": "No images provided"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"error": f"Batch is limited to {BATCH_MAX_ITEMS} images"}), 400
+
+        generator = get_generator()
+        results = sorted(iter_batch_results(generator, items), key=lambda result: result["index"])
+
+        return jsonify({
+            "status": "success",
+            "count": len(results),
+            "failed": sum(1 for result in results if result["status"] != "success"),
+            "results": results,
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Stream one metadata result per image as soon as it is ready (NDJSON or SSE)"""
+
+    use_sse = (
+        request.args.get('format') == 'sse'
+        or 'text/event-stream' in request.headers.get('Accept', '')
+    )
+    # Same cap as /api/analyze/batch; items are only references to the uploads, nothing is decoded yet
+    items = list(_iter_batch_items())
+    if not items:
+        return jsonify({"error": "No images provided"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch is limited to {BATCH_MAX_ITEMS} images"}), 400
+    generator = get_generator()
+
+    def encode(event: str, payload: Dict) -> str:
+        body = json.dumps(payload, ensure_ascii=False)
+        if use_sse:
+            return f"event: {event}\ndata: {body}\n\n"
+        return body + "\n"
+
+    def generate():
+        count = 0
+        failed = 0
+        results = iter_batch_results(generator, items)
+        try:
+            for result in results:
+                count += 1
+                if result["status"] != "success":
+                    failed += 1
+                yield encode("result", result)
+        except Exception as e:
+            yield encode("error", {"error": str(e)})
+        finally:
+            results.close()
+
+        yield encode("done", {
+            "done": True,
+            "count": count,
+            "failed": failed,
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model
+        })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _stored_analysis_or_404(analysis_id: str):
+    """(analysis, options, error response) for the regenerate endpoints"""
+    analysis = get_generator().stored_analysis(analysis_id)
+    if analysis is None:
+        return None, None, (jsonify({"error": "Unknown or expired analysis_id, analyze the image again"}), 404)
+    return analysis, request.get_json(silent=True) or {}, None
+
+def _int_option(options: Dict, name: str, default: Optional[int], low: int, high: int) -> Optional[int]:
+    value = options.get(name, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise ValueError(f"'{name}' must be an integer between {low} and {high}")
+    return value
+
+@app.route('/api/analysis/<analysis_id>', methods=['GET'])
+def get_analysis(analysis_id):
+    """The stored analysis behind a handle"""
+
+    analysis = get_generator().stored_analysis(analysis_id)
+    if analysis is None:
+        return jsonify({"error": "Unknown or expired analysis_id, analyze the image again"}), 404
+    return jsonify({"analysis_id": analysis_id, "analysis": analysis})
+
+@app.route('/api/analysis/<analysis_id>/titles', methods=['POST'])
+def regenerate_titles(analysis_id):
+    """New titles from a stored analysis, without re-analyzing the image"""
+
+    analysis, options, error = _stored_analysis_or_404(analysis_id)
+    if error:
+        return error
+    try:
+        template = _int_option(options, 'template', None, 0, 1000)
+        exclude = [title for title in options.get('exclude', []) if isinstance(title, str)]
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "status": "success",
+        "analysis_id": analysis_id,
+        "titles": get_generator().generate_titles(analysis, template, exclude)
+    })
+
+@app.route('/api/analysis/<analysis_id>/keywords', methods=['POST'])
+def regenerate_keywords(analysis_id):
+    """Keywords from a stored analysis, optionally with a different count"""
+
+    analysis, options, error = _stored_analysis_or_404(analysis_id)
+    if error:
+        return error
+    try:
+        limit = _int_option(options, 'limit', KEYWORD_LIMIT, 1, 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "status": "success",
+        "analysis_id": analysis_id,
+        "keywords": get_generator().generate_keywords(analysis, limit=limit)
+    })
+
+@app.route('/api/analysis/<analysis_id>/category', methods=['POST'])
+def regenerate_category(analysis_id):
+    """Category from a stored analysis plus the next best alternatives"""
+
+    analysis, options, error = _stored_analysis_or_404(analysis_id)
+    if error:
+        return error
+    try:
+        alternatives = _int_option(options, 'alternatives', 2, 0, len(CATEGORIES))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    categories = get_generator().suggest_categories(analysis, alternatives + 1)
+    return jsonify({
+        "status": "success",
+        "analysis_id": analysis_id,
+        "category": {"en": categories[0][0], "ar": categories[0][1]},
+        "alternatives": [{"en": en, "ar": ar} for en, ar in categories[1:]]
+    })
+
+@app.route('/api/metadata/embed', methods=['POST'])
+def embed_image_metadata():
+    """Return the uploaded JPEG with titles, keywords and category embedded as XMP and IPTC"""
+
+    try:
+        image_data = _read_image_upload()
+        if not image_data:
+            return jsonify({"error": "No image data provided"}), 400
+
+        # Options come with the JSON body, as multipart fields or, for raw uploads, in the query string
+        if request.files or request.form:
+            options = request.form.to_dict()
+        elif request.is_json:
+            options = request.get_json(silent=True) or {}
+        else:
+            options = request.args.to_dict()
+
+        generator = get_generator()
+        upload = ImageUpload.from_data(image_data)
+        # Read the JPEG header first, so an image that can't carry metadata is never sent for analysis
+        try:
+            source = upload.open()
+            segments = _read_jpeg_header(source)
+            scan_start = source.tell()
+        except MetadataEmbedError as e:
+            return jsonify({"error": str(e)}), 400
+
+        metadata = options.get('metadata')
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except ValueError:
+                return jsonify({"error": "'metadata' must be a JSON object"}), 400
+        if metadata is None:
+            # No edited metadata: build it from a stored analysis, or analyze the image now
+            analysis_id = options.get('analysis_id')
+            if analysis_id:
+                analysis = generator.stored_analysis(analysis_id)
+                if analysis is None:
+                    return jsonify({"error": "Unknown or expired analysis_id, analyze the image again"}), 404
+            else:
+                analysis = generator.analyze_image(upload).analysis
+            metadata = generator.build_metadata(analysis)
+        if not isinstance(metadata, dict):
+            return jsonify({"error": "'metadata' must be an object"}), 400
+
+        try:
+            header = _embedded_header(segments, metadata)
+        except MetadataEmbedError as e:
+            return jsonify({"error": str(e)}), 400
+        # The analysis may have read the upload; the body continues from the scan
+        source = upload.open()
+        source.seek(scan_start)
+
+        def body():
+            yield header
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+                yield chunk
+
+        upload_name = request.files['image'].filename if 'image' in request.files else None
+        filename = os.path.basename(upload_name or "image.jpg").replace('"', '')
+        return Response(stream_with_context(body()), mimetype='image/jpeg', headers={
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        })
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_jobs():
+    """Queue images for background analysis and return one job ID per image"""
+
+    try:
+        items = list(_iter_batch_items())
+
+        if not items:
+            return jsonify({"error": "No images provided"}), 400
+        if len(items) > JOB_MAX_ITEMS:
+            return jsonify({"error": f"Job submissions are limited to {JOB_MAX_ITEMS} images"}), 400
+
+        queue = get_job_queue()
+        jobs = []
+        for item in items:
+            image_data = item["image"]
+            if hasattr(image_data, 'stream'):
+                image_data = image_data.stream
+            try:
+                if not image_data:
+                    raise ValueError("No image data provided")
+                job, created = queue.submit(ImageUpload.from_data(image_data), item["id"])
+                jobs.append({"id": item["id"], "job_id": job["job_id"], "status": job["status"], "created": created})
+            except Exception as e:
+                jobs.append({"id": item["id"], "status": "error", "error": str(e)})
+
+        return jsonify({
+            "status": "accepted",
+            "count": len(jobs),
+            "jobs": jobs,
+            "queue": queue.stats()
+        }), 202
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of one job, with its metadata once done"""
+
+    try:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job["result"] and job["result"].get("analysis_id"):
+            # Jobs run in worker processes: make the handle resolvable here too
+            get_generator().store_analysis(job["result"]["metadata"]["analysis"])
+
+        return jsonify({
+            "job_id": job["job_id"],
+            "id": job["label"],
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "result": job["result"],
+            "error": job["error"]
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def job_stats():
+    """Job counts by status"""
+    try:
+        return jsonify({"status": "success", "queue": get_job_queue().stats()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_metadata():
+    """Stream finished job metadata as portal CSV or JSON lines, filtered by date, job or category"""
+
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"'format' must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        since = parse_timestamp(request.args.get('since'))
+        until = parse_timestamp(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({"error": f"'since' and 'until' take epoch seconds or ISO 8601 dates: {e}"}), 400
+    job_ids = [job_id for value in request.args.getlist('job_id') for job_id in value.split(',') if job_id]
+    if len(job_ids) > JOB_MAX_ITEMS:
+        return jsonify({"error": f"Export is limited to {JOB_MAX_ITEMS} job IDs, filter by date instead"}), 400
+
+    generator = get_generator()
+    jobs = get_job_queue().iter_done(since, until, job_ids, request.args.get('category'))
+    records = (export_record(generator, job) for job in jobs)
+    body = iter_export_csv(records) if export_format == 'csv' else iter_export_jsonl(records)
+
+    filename = f"arabsstock-metadata-{time.strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @app.route('/api/test-provider', methods=['POST'])
 def test_provider():
     """Test AI provider connection"""
@@ -601,13 +4606,13 @@ def test_provider():
         if not provider:
             return jsonify({"error": "Provider name is required"}), 400
 
-        generator = ArabStockMetadataGenerator()
+        generator = get_generator()
 
         # Test connection based on provider
         if provider.lower() == "openai":
-            if api_key:
-                openai.api_key = api_key
-            success = generator._test_openai_connection()
+            # Use a throwaway client so the shared one keeps its key
+            client = openai.OpenAI(api_key=api_key) if api_key else None
+            success = generator._test_openai_connection(client)
         elif provider.lower() == "gemini":
             if api_key:
                 genai.configure(api_key=api_key)
@@ -615,12 +4620,14 @@ def test_provider():
         else:
             success = True # Offline mode always works
 
-    except Exception as e:
         return jsonify({
             "status": "success" if success else "error",
             "message": f"{provider} connection {'successfully' if success else 'failed'}",
             "provider": provider
-        }), 500
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/translate', methods=['POST'])
 def translate_text():
@@ -634,12 +4641,8 @@ def translate_text():
         if not text:
             return jsonify({"error": "No text provided"}), 400
 
-        translator = Translator()
-
-        if target_lang == 'ar':
-            translated = translator.translate(text, dest='ar').text
-        else:
-            translated = translator.translate(text, dest='en').text
+        memory = get_generator().translation_memory
+        translated = memory.translate(text, 'ar' if target_lang == 'ar' else 'en')
 
         return jsonify({
             "original": text,
@@ -650,6 +4653,32 @@ def translate_text():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/translate/bulk', methods=['POST'])
+def translate_bulk():
+    """Translate a list of keywords in one call, only sending unknown ones upstream"""
+
+    try:
+        data = request.get_json(silent=True) or {}
+        texts = [text for text in data.get('texts', []) if isinstance(text, str) and text.strip()]
+        target_lang = 'ar' if data.get('target_lang', 'ar') == 'ar' else 'en'
+
+        if not texts:
+            return jsonify({"error": "No texts provided"}), 400
+
+        memory = get_generator().translation_memory
+        translated = memory.translate_many(texts, target_lang)
+
+        return jsonify({
+            "translations": [
+                {"original": text, "translated": translation}
+                for text, translation in zip(texts, translated)
+            ],
+            "target_lang": target_lang
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/keywords/suggest', methods=['POST'])
 def suggest_more_keywords():
     """Suggest additional keywords based on existing ones"""
@@ -659,16 +4688,17 @@ def suggest_more_keywords():
         existing_keywords = data.get('keywords', [])
         language = data.get('language', 'en')
 
-        generator = ArabStockMetadataGenerator
-
-        # Get trending keywords in specified language
-        suggestions = random.sample(
-            generator.trending_keywords[language],
-            min(10, len(generator.trending_keywords[language]))
-        )
+        generator = get_generator()
 
-        # Filter out existing keywords
-        new_suggestions = [kw for kw in suggestions if kw not in existing_keywords]
+        # Neighbors of the submitted keywords in the co-occurrence index,
+        # topped up with trending keywords while the index is still sparse
+        new_suggestions = generator.keyword_index.suggest(language, existing_keywords, 10)
+        seen = {kw.lower() for kw in existing_keywords + new_suggestions if isinstance(kw, str)}
+        for kw in generator.trending_keywords.get(language, []):
+            if len(new_suggestions) >= 10:
+                break
+            if kw.lower() not in seen:
+                new_suggestions.append(kw)
 
         return jsonify({
             "suggestions": new_suggestions,
@@ -682,12 +4712,22 @@ def optimize_metadata():
     """Optimize existing metadata for better performance"""
 
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         title = data.get('title', '')
         keywords = data.get('keywords', [])
         language = data.get('language', 'en')
 
-        generator = ArabStockMetadataGenerator()
+        if language not in ('en', 'ar'):
+            return jsonify({"error": "language must be 'en' or 'ar'"}), 400
+        if not isinstance(title, str):
+            return jsonify({"error": "title must be a string"}), 400
+        if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
+            return jsonify({"error": "keywords must be a list of strings"}), 400
+
+        generator = get_generator()
+
+        # Keyword sets users bring back are learned by the suggestion index, once they are known to be valid
+        generator.keyword_index.add(language, keywords)
 
         # Optimize title
         optimized_title = title
@@ -716,20 +4756,79 @@ def optimize_metadata():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    generator = ArabStockMetadataGenerator()
+    generator = get_generator()
 
     return jsonify({
         "status": "healthy",
         "service": "Arab Stock Metadata Generator",
         "current_provider": generator.current_ai_config.provider.value,
         "available_providers": [p.value for p in generator.available_providers],
-        "model": generator.current_ai_config.model
+        "model": generator.current_ai_config.model,
+        "analysis_cache": generator.analysis_cache.stats(),
+        "analysis_handles": generator.analysis_handles.stats(),
+        "routing": generator.router.stats(),
+        "near_duplicates": generator.near_duplicates.stats(),
+        "translation_memory": generator.translation_memory.stats(),
+        "resilience": generator.resilience.stats(),
+        "rate_limits": generator.rate_limits.stats(),
+        "keyword_index": generator.keyword_index.stats(),
+        "jobs": _job_queue.stats() if _job_queue is not None else None
     })
 
+def _stats_samples(generator: ArabStockMetadataGenerator) -> List[str]:
+    """Component stats from /health in Prometheus text: cumulative counts as counters, levels as gauges"""
+    samples = []
+    cache = generator.analysis_cache.stats()
+    near = generator.near_duplicates.stats()
+    memory = generator.translation_memory.stats()
+    for name, value in (
+        ("arabstock_analysis_cache_entries", cache["entries"]),
+        ("arabstock_analysis_cache_hits_total", cache["hits"] + cache["disk_hits"]),
+        ("arabstock_analysis_cache_misses_total", cache["misses"]),
+        ("arabstock_near_duplicate_hits_total", near["hits"]),
+        ("arabstock_near_duplicate_misses_total", near["misses"]),
+        ("arabstock_translation_memory_hits_total", memory["hits"]),
+        ("arabstock_translation_memory_misses_total", memory["misses"]),
+    ):
+        samples.append((name, "", value))
+
+    for provider, stats in generator.resilience.stats().items():
+        samples.append(("arabstock_breaker_open", f'{{provider="{provider}"}}', int(stats["breaker"]["state"] != "closed")))
+        samples.append(("arabstock_provider_retries_total", f'{{provider="{provider}"}}', stats["retries"]))
+
+    for key, stats in generator.rate_limits.stats()["limiters"].items():
+        labels = f'{{limiter="{key}"}}'
+        samples.append(("arabstock_rate_limit_queue_depth", labels, stats["queue_depth"]))
+        samples.append(("arabstock_rate_limit_avg_wait_seconds", labels, stats["avg_wait"]))
+        samples.append(("arabstock_rate_limit_max_wait_seconds", labels, stats["max_wait"]))
+
+    if _job_queue is not None:
+        for status, count in _job_queue.stats().items():
+            samples.append(("arabstock_jobs", f'{{status="{status}"}}', count))
+
+    lines = []
+    declared = set()
+    for name, labels, value in samples:
+        if name not in declared:
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            declared.add(name)
+        lines.append(f"{name}{labels} {value:g}")
+    return lines
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of request, stage and provider metrics (?format=json for percentiles)"""
+    generator = get_generator()
+    if request.args.get('format') == 'json':
+        return jsonify({
+            metric.name: metric.snapshot() for metric in METRICS
+        })
+    return Response(render_metrics(_stats_samples(generator)), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get current configuration"""
-    generator = ArabStockMetadataGenerator()
+    generator = get_generator()
 
     return jsonify({
         "current_provider": generator.current_ai_config.provider.value,
@@ -751,15 +4850,26 @@ if __name__ == '__main__':
     print('     POST /api/providers/set - Set current AI provider')
     print('     POST /api/test-provider - Test provider connection')
     print('     POST /api/analyze - Analyze image and generate metadata')
+    print('     POST /api/analyze/batch - Analyze several images at once')
+    print('     POST /api/analyze/stream - Stream batch results as NDJSON/SSE')
     print('     POST /api/translate - Translate text')
+    print('     POST /api/translate/bulk - Translate a list of keywords')
+    print('     GET /api/analysis/<analysis_id> - Stored analysis behind an analysis_id')
+    print('     POST /api/analysis/<analysis_id>/titles|keywords|category - Regenerate metadata without re-analysis')
+    print('     POST /api/metadata/embed - Embed metadata into a JPEG as XMP and IPTC')
+    print('     POST /api/jobs - Queue images for background analysis (run jobs.py for workers)')
+    print('     GET /api/jobs - Job queue counts')
+    print('     GET /api/jobs/<job_id> - Job status and result')
+    print('     GET /api/export - Stream finished jobs as portal CSV or JSON lines')
     print('     POST /api/keywords/suggest - Get keyword suggestions')
     print('     POST /api/optimize - Optimize existing metadata')
     print('     GET /health - Health check')
+    print('     GET /metrics - Prometheus metrics (?format=json for p50/p95/p99)')
     print('     GET /api/config - Get current configuration')
 
-    # Initialize generator to check available providers
-    generator = ArabStockMetadataGenerator()
+    # Warm up the shared generator so the first request doesn't pay setup cost
+    generator = get_generator()
     print(f"\n✅ Available AI Providers: {[p.value for p in generator.available_providers]}")
     print(f"⚡ Current Provider: {generator.current_ai_config.provider.value}")
 
-    app.run(debug=True, port=5000)
+    app.run(debug=True, port=5000, threaded=True)
@@ -0,0 +1,294 @@
+# Arabs Stock AI Metadata Generator
+# Async (ASGI) server for the metadata API
+#
+# The analysis routes run natively on asyncio with async provider clients, so one
+# process can hold many in-flight vision calls. Every other route is served by the
+# Flask app mounted underneath, which keeps the JSON contracts identical.
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app, get_generator, ImageUpload, ImagePacker, caller_id, current_caller, current_trace, RequestTrace,
+    BATCH_MAX_ITEMS, BATCH_MAX_WORKERS, EMPTY_DIGEST, UPLOAD_SPOOL_SIZE
+)
+
+def _identify_caller(request: Request):
+    """Caller used for fair queueing in the provider rate limiter"""
+    current_caller.set(caller_id(request.headers, request.client.host if request.client else None))
+
+def traced(endpoint: str):
+    """Record request latency and per-stage spans like the Flask routes do"""
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(request: Request):
+            trace = RequestTrace(request.method, request.url.path)
+            current_trace.set(trace)
+            status = 500
+            streaming = False
+            try:
+                response = await handler(request)
+                status = response.status_code
+                response.headers['X-Request-Id'] = trace.request_id
+                if isinstance(response, StreamingResponse):
+                    # Streams are timed until their last chunk. On a disconnect Starlette leaves the
+                    # body suspended, so the background task (run either way) closes it
+                    body = response.body_iterator = _traced_body(response.body_iterator, trace, endpoint, status)
+                    background = BackgroundTasks([BackgroundTask(body.aclose)])
+                    if response.background is not None:
+                        background.tasks.append(response.background)
+                    response.background = background
+                    streaming = True
+                return response
+            finally:
+                if not streaming:
+                    trace.finish(endpoint, status)
+        return wrapper
+    return decorate
+
+async def _traced_body(body, trace: RequestTrace, endpoint: str, status: int):
+    """Pass a streamed body through, recording the request once it is done or abandoned"""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        if hasattr(body, 'aclose'):
+            await body.aclose()
+        trace.finish(endpoint, status)
+
+async def _read_json(request: Request) -> Dict:
+    """JSON object body, or {} when the body is empty or not a JSON object (like Flask's silent get_json)"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+async def _read_image_upload(request: Request):
+    """Image from a raw binary body, a multipart 'image' file or base64 JSON"""
+    content_type = request.headers.get('content-type', '')
+
+    if content_type.startswith('application/octet-stream') or content_type.startswith('image/'):
+        # Spool the body as it arrives, hashing on the way
+        spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+        digest = hashlib.sha256()
+        async for chunk in request.stream():
+            digest.update(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+        digest = digest.hexdigest()
+        return ImageUpload(spool, digest) if digest != EMPTY_DIGEST else None
+
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('image')
+        return upload.file if upload else None
+
+    data = await _read_json(request)
+    return data.get('image') # Base64 encoded image
+
+async def _read_batch_items(request: Request) -> List[Dict]:
+    """Collect batch items from a JSON body or a multipart upload"""
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        form = await request.form()
+        return [
+            {"id": upload.filename or str(index), "image": upload}
+            for index, upload in enumerate(form.getlist('images'))
+        ]
+
+    data = await _read_json(request)
+    items = []
+    for index, entry in enumerate(data.get('images', [])):
+        # Accept bare base64 strings or {"id": ..., "image": ...} objects
+        if isinstance(entry, dict):
+            items.append({"id": entry.get('id', str(index)), "image": entry.get('image')})
+        else:
+            items.append({"id": str(index), "image": entry})
+    return items
+
+async def _iter_batch_results(generator, items: List[Dict], window: int = None):
+    """Yield per-item results as they finish, keeping at most `window` items in flight"""
+    window = window or BATCH_MAX_WORKERS * 2
+    packer = ImagePacker.for_batch(generator)
+    items = enumerate(items)
+    pending = {}
+
+    def submit_next() -> bool:
+        for index, item in items:
+            task = asyncio.ensure_future(generator.analyze_batch_item_async(item["image"], packer))
+            pending[task] = (index, item["id"])
+            return True
+        return False
+
+    while len(pending) < window and submit_next():
+        pass
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, item_id = pending.pop(task)
+                result = task.result()
+                result.update({"index": index, "id": item_id})
+                yield result
+                submit_next()
+    finally:
+        # A disconnected client closes the generator: stop the analyses nobody will read
+        for task in pending:
+            task.cancel()
+
+@traced('/api/analyze')
+async def analyze_image(request: Request):
+    """Main endpoint to analyze image and generate metadata with selected AI provider"""
+    _identify_caller(request)
+    try:
+        image_data = await _read_image_upload(request)
+
+        if not image_data:
+            return JSONResponse({"error": "No image data provided"}, status_code=400)
+
+        generator = get_generator()
+        result = await generator.analyze_image_async(image_data)
+
+        return JSONResponse({
+            "status": "success",
+            "metadata": generator.build_metadata(result.analysis),
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model,
+            **result.details()
+        })
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@traced('/api/analyze/batch')
+async def analyze_batch(request: Request):
+    """Analyze several images concurrently and return per-item metadata"""
+    _identify_caller(request)
+    try:
+        items = await _read_batch_items(request)
+
+        if not items:
+            return JSONResponse({"error": "No images provided"}, status_code=400)
+        if len(items) > BATCH_MAX_ITEMS:
+            return JSONResponse({"error": f"Batch is limited to {BATCH_MAX_ITEMS} images"}, status_code=400)
+
+        generator = get_generator()
+        results = [result async for result in _iter_batch_results(generator, items)]
+        results.sort(key=lambda result: result["index"])
+
+        return JSONResponse({
+            "status": "success",
+            "count": len(results),
+            "failed": sum(1 for result in results if result["status"] != "success"),
+            "results": results,
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model
+        })
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@traced('/api/analyze/stream')
+async def analyze_stream(request: Request):
+    """Stream one metadata result per image as soon as it is ready (NDJSON or SSE)"""
+    use_sse = (
+        request.query_params.get('format') == 'sse'
+        or 'text/event-stream' in request.headers.get('accept', '')
+    )
+    _identify_caller(request)
+    generator = get_generator()
+    items = await _read_batch_items(request)
+    if not items:
+        return JSONResponse({"error": "No images provided"}, status_code=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"Batch is limited to {BATCH_MAX_ITEMS} images"}, status_code=400)
+
+    def encode(event: str, payload: Dict) -> str:
+        body = json.dumps(payload, ensure_ascii=False)
+        if use_sse:
+            return f"event: {event}\ndata: {body}\n\n"
+        return body + "\n"
+
+    async def generate():
+        count = 0
+        failed = 0
+        results = _iter_batch_results(generator, items)
+        try:
+            async for result in results:
+                count += 1
+                if result["status"] != "success":
+                    failed += 1
+                yield encode("result", result)
+        except Exception as e:
+            yield encode("error", {"error": str(e)})
+        finally:
+            await results.aclose()
+
+        yield encode("done", {
+            "done": True,
+            "count": count,
+            "failed": failed,
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model
+        })
+
+    # traced closes the generator on disconnect, which cancels the pending analyses
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+routes = [
+    Route('/api/analyze', analyze_image, methods=['POST']),
+    Route('/api/analyze/batch', analyze_batch, methods=['POST']),
+    Route('/api/analyze/stream', analyze_stream, methods=['POST']),
+    # Everything else is served by the Flask app with identical responses
+    Mount('/', app=WSGIMiddleware(flask_app))
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+)
+
+def main():
+    """Production launcher for the ASGI server"""
+    parser = argparse.ArgumentParser(description='Arabs Stock AI Metadata Generator (ASGI)')
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', '1')),
+                        help='number of worker processes')
+    parser.add_argument('--log-level', default=os.getenv('LOG_LEVEL', 'info'))
+    args = parser.parse_args()
+
+    print('🚀 Arab Stock AI Metadata Generator Starting (ASGI)...')
+    print(f'💻 Server will run on http://{args.host}:{args.port} with {args.workers} worker(s)')
+
+    uvicorn.run(
+        'asgi:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+# Arabs Stock AI Metadata Generator
+# Benchmarks: run from the repository root, e.g. `python -m benchmarks.micro`
@@ -0,0 +1,134 @@
+# Arabs Stock AI Metadata Generator
+# Shared helpers for the benchmark scripts: percentiles, RSS and baselines
+
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+def percentile(samples: List[float], share: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def summarize(samples: List[float], elapsed: float = None) -> Dict:
+    """Latency percentiles (ms) and throughput for a list of per-call durations in seconds"""
+    total = elapsed if elapsed is not None else sum(samples)
+    return {
+        "count": len(samples),
+        "throughput": round(len(samples) / total, 2) if total else 0.0,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3)
+    }
+
+def self_peak_rss_mb() -> float:
+    """Peak RSS of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def process_tree_peak_rss_mb(pid: int) -> float:
+    """Sum of peak RSS (VmHWM) over a process and its children, from /proc (Linux only)"""
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    total_kb = 0
+    for each in pids:
+        try:
+            with open(f'/proc/{each}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+def environment() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "recorded_at": time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+def save_baseline(name: str, results: Dict):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f'{name}.json')
+    with open(path, 'w', encoding='utf-8') as out:
+        json.dump({"environment": environment(), "results": results}, out, indent=2, sort_keys=True)
+        out.write("\n")
+    print(f'💾 Baseline saved to {path}')
+
+# p99 and microsecond-scale differences are too noisy to fail a run on
+GATED_METRICS = ("p50_ms", "p95_ms", "peak_rss_mb")
+GATE_FLOOR = {"ms": 0.05, "mb": 16.0}
+COMPARABLE_ENVIRONMENT = ("machine", "cpus")
+
+def compare_to_baseline(name: str, results: Dict, tolerance: float) -> Optional[List[str]]:
+    """Regressions against the saved baseline (None if there is none): lower throughput, higher latency or RSS"""
+    path = os.path.join(BASELINE_DIR, f'{name}.json')
+    if not os.path.exists(path):
+        print(f'\nℹ️  No baseline at {path}; run with --save-baseline to record one')
+        return None
+    with open(path, encoding='utf-8') as baseline_file:
+        saved = json.load(baseline_file)
+    # Throughput and latency only compare on the same kind of host
+    recorded = saved.get("environment", {})
+    current = environment()
+    if any(recorded.get(key) != current[key] for key in COMPARABLE_ENVIRONMENT):
+        print(f'\nℹ️  Baseline at {path} was recorded on {recorded.get("cpus")} CPU(s) ({recorded.get("machine")}), '
+              f'this host has {current["cpus"]} ({current["machine"]}); run with --save-baseline to record one')
+        return None
+    baseline = saved["results"]
+
+    regressions = []
+    for case, metrics in results.items():
+        reference = baseline.get(case)
+        if not isinstance(reference, dict) or not isinstance(metrics, dict):
+            continue
+        for metric, value in metrics.items():
+            expected = reference.get(metric)
+            if not isinstance(expected, (int, float)) or not expected:
+                continue
+            if metric == 'throughput' and value < expected * (1 - tolerance):
+                regressions.append(f'{case}.{metric}: {value} < {expected} (-{(1 - value / expected):.0%})')
+            elif metric in GATED_METRICS and value > expected * (1 + tolerance) and value - expected > GATE_FLOOR[metric[-2:]]:
+                regressions.append(f'{case}.{metric}: {value} > {expected} (+{(value / expected - 1):.0%})')
+            elif metric == 'error_rate' and value > expected + tolerance / 10:
+                regressions.append(f'{case}.{metric}: {value} > {expected}')
+    return regressions
+
+def print_table(results: Dict):
+    columns = ["count", "throughput", "p50_ms", "p95_ms", "p99_ms"]
+    extra = sorted({key for metrics in results.values() if isinstance(metrics, dict) for key in metrics} - set(columns))
+    columns += extra
+    print(f"{'case':<28}" + "".join(f"{column:>14}" for column in columns))
+    for case, metrics in results.items():
+        if isinstance(metrics, dict):
+            print(f"{case:<28}" + "".join(f"{str(metrics.get(column, '')):>14}" for column in columns))
+
+def finish(name: str, results: Dict, save: bool, tolerance: float):
+    """Save or check the baseline; exit non-zero on regressions"""
+    print_table(results)
+    if save:
+        save_baseline(name, results)
+        return
+    regressions = compare_to_baseline(name, results, tolerance)
+    if regressions is None:
+        return
+    if regressions:
+        print(f'\n❌ {len(regressions)} regression(s) beyond {tolerance:.0%} of the {name} baseline:')
+        for regression in regressions:
+            print(f'   {regression}')
+        sys.exit(1)
+    print(f'\n✅ Within {tolerance:.0%} of the {name} baseline')
@@ -0,0 +1,89 @@
+# Arabs Stock AI Metadata Generator
+# Deterministic synthetic corpus of images and analyses for the benchmarks
+
+import io
+import json
+import random
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+SIZES = [(640, 480), (1280, 960), (1920, 1080), (3000, 2000), (1080, 1350)]
+
+SUBJECTS = ["business meeting", "family dinner", "urban architecture", "nature landscape", "person portrait",
+            "technology startup team", "mosque at sunset", "traditional market", "isolated product",
+            "breaking news press conference", "football match", "student in classroom"]
+OBJECTS = ["laptop", "documents", "coffee cup", "dates", "lantern", "smartphone", "car", "building", "sky",
+           "plants", "camel", "abaya", "microphone", "desk", "books", "sand dunes"]
+SETTINGS = ["modern office", "city buildings, centered", "outdoor nature, wide", "studio, close-up", "old souk",
+            "desert", "hospital corridor", "stadium", "home kitchen"]
+MOODS = ["professional", "calm", "cheerful", "dramatic"]
+STYLES = ["corporate", "minimalist", "vivid", "modern", "documentary"]
+COLORS = ["blue", "white", "gray", "gold", "green", "brown", "red", "black", "beige"]
+CONTEXTS = ["arab business environment", "gulf heritage", "islamic culture", "middle eastern city", "modern lifestyle"]
+
+def synthetic_image(seed: int, size: Tuple[int, int] = None) -> bytes:
+    """JPEG with a gradient background, shapes and noise; same seed, same bytes"""
+    rng = np.random.default_rng(seed)
+    width, height = size or SIZES[seed % len(SIZES)]
+    top = rng.integers(0, 256, 3)
+    bottom = rng.integers(0, 256, 3)
+    ramp = np.linspace(0, 1, height)[:, None, None]
+    pixels = (top * (1 - ramp) + bottom * ramp).repeat(width, axis=1)
+    pixels += rng.normal(0, 12, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+    draw = ImageDraw.Draw(image)
+    for _ in range(int(rng.integers(2, 8))):
+        x0, y0 = int(rng.integers(0, width - 10)), int(rng.integers(0, height - 10))
+        x1, y1 = x0 + int(rng.integers(10, width // 2)), y0 + int(rng.integers(10, height // 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=88)
+    return buffer.getvalue()
+
+def synthetic_images(count: int, seed: int = 0) -> List[bytes]:
+    return [synthetic_image(seed + index) for index in range(count)]
+
+def synthetic_analysis(seed: int) -> Dict:
+    rng = random.Random(seed)
+    return {
+        "main_subject": rng.choice(SUBJECTS),
+        "people": rng.sample(["businessman", "woman", "child", "family", "student"], rng.randint(0, 2)),
+        "objects": rng.sample(OBJECTS, rng.randint(1, 4)),
+        "setting": rng.choice(SETTINGS),
+        "mood": rng.choice(MOODS),
+        "colors": rng.sample(COLORS, 3),
+        "style": rng.choice(STYLES),
+        "cultural_context": rng.choice(CONTEXTS)
+    }
+
+def synthetic_analyses(count: int, seed: int = 0) -> List[Dict]:
+    return [synthetic_analysis(seed + index) for index in range(count)]
+
+def provider_replies(analyses: List[Dict]) -> List[str]:
+    """Provider-style replies for the analyses: bare JSON, fenced JSON with prose, and labelled text"""
+    replies = []
+    for index, analysis in enumerate(analyses):
+        body = json.dumps(analysis)
+        if index % 3 == 0:
+            replies.append(body)
+        elif index % 3 == 1:
+            replies.append(f"Here is the analysis:\n```json\n{json.dumps(analysis, indent=2)}\n```\nLet me know if you need more.")
+        else:
+            replies.append("\n".join(
+                f"**{name.replace('_', ' ').title()}:** {', '.join(value) if isinstance(value, list) else value}"
+                for name, value in analysis.items()
+            ))
+    return replies
+
+def translation_texts(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    vocabulary = SUBJECTS + OBJECTS + SETTINGS + MOODS + STYLES + COLORS
+    return [rng.choice(vocabulary) for _ in range(count)]
@@ -0,0 +1,165 @@
+# Arabs Stock AI Metadata Generator
+# Load generator for the HTTP API against a local fake OpenAI/Gemini server
+#
+#   python -m benchmarks.load                          # spawn fake provider + ASGI server, compare with baseline
+#   python -m benchmarks.load --provider gemini --latency 0.8 --error-rate 0.05 --concurrency 32
+#   python -m benchmarks.load --url http://127.0.0.1:5000 --scenarios analyze
+#   python -m benchmarks.load --scenarios batch --pack-size 4     # multi-image provider requests
+#
+# Results are compared with benchmarks/baselines/load-<provider>[-pack<size>].json.
+
+import argparse
+import base64
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import requests
+
+from fake_provider import FakeProviderServer
+from benchmarks.common import finish, process_tree_peak_rss_mb, summarize
+from benchmarks.corpus import synthetic_images, translation_texts
+
+SCENARIOS = ('analyze', 'batch', 'translate')
+
+def _wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with {process.returncode}')
+        try:
+            if requests.get(f'{url}/health', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f'server at {url} not ready after {timeout:.0f}s')
+
+def start_server(args, provider_url: str) -> subprocess.Popen:
+    """Run asgi.py in a subprocess wired to the fake provider"""
+    env = dict(os.environ)
+    for name in ('OPENAI_API_KEY', 'GEMINI_API_KEY', 'OPENAI_BASE_URL', 'GEMINI_API_ENDPOINT'):
+        env.pop(name, None)
+    if args.provider == 'openai':
+        env.update(OPENAI_API_KEY='fake', OPENAI_BASE_URL=f'{provider_url}/v1')
+    elif args.provider == 'gemini':
+        env.update(GEMINI_API_KEY='fake', GEMINI_API_ENDPOINT=provider_url)
+    env.update(
+        TRANSLATOR_BACKEND='dictionary',
+        # Every request should reach the provider: no exact or near-duplicate reuse
+        ANALYSIS_CACHE_SIZE='0',
+        NEAR_DUPLICATE_DISTANCE='0',
+        OPENAI_RPM='0', OPENAI_TPM='0', GEMINI_RPM='0', GEMINI_TPM='0',
+        BATCH_PACK_SIZE=str(args.pack_size)
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(
+        [sys.executable, 'asgi.py', '--port', str(args.port), '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def run_scenario(name: str, call: Callable[[int], bool], total: int, concurrency: int) -> Dict:
+    """Issue `total` calls from `concurrency` client threads; latency is per call"""
+    samples = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(index: int):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = call(index)
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    result = summarize(samples, time.perf_counter() - started)
+    result["error_rate"] = round(errors / total, 4) if total else 0.0
+    print(f'   {name}: {result["throughput"]} req/s, p95 {result["p95_ms"]} ms, errors {errors}')
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the metadata API')
+    parser.add_argument('--url', help='target an already running server instead of spawning one')
+    parser.add_argument('--provider', choices=['openai', 'gemini', 'offline'], default='gemini')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=60, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--images', type=int, default=64, help='distinct synthetic images')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--workers', type=int, default=1, help='ASGI worker processes when spawning')
+    parser.add_argument('--pack-size', type=int, default=1, help='BATCH_PACK_SIZE for the spawned server')
+    parser.add_argument('--latency', type=float, default=0.2, help='fake provider mean latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.30)
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    images = synthetic_images(args.images)
+    encoded = [base64.b64encode(image).decode('ascii') for image in images]
+    texts = translation_texts(args.requests * 10)
+
+    fake = FakeProviderServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=1).start()
+    server = None
+    url = args.url
+    if url is None:
+        url = f'http://127.0.0.1:{args.port}'
+        server = start_server(args, fake.url)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount('http://', adapter)
+
+    def analyze(index: int) -> bool:
+        response = session.post(f'{url}/api/analyze', data=images[index % len(images)],
+                                headers={'Content-Type': 'application/octet-stream'}, timeout=120)
+        return response.ok and response.json().get('analysis_source') != 'fallback'
+
+    def batch(index: int) -> bool:
+        start = index * args.batch_size
+        items = [encoded[(start + offset) % len(encoded)] for offset in range(args.batch_size)]
+        response = session.post(f'{url}/api/analyze/batch', json={"images": items}, timeout=300)
+        return response.ok and response.json().get('failed') == 0
+
+    def translate(index: int) -> bool:
+        response = session.post(f'{url}/api/translate/bulk',
+                                json={"texts": texts[index * 10:(index + 1) * 10], "target_lang": "ar"}, timeout=60)
+        return response.ok
+
+    calls = {"analyze": analyze, "batch": batch, "translate": translate}
+    results = {}
+    try:
+        if server is not None:
+            _wait_until_ready(url, server)
+        print(f'🔥 {args.requests} requests per scenario at concurrency {args.concurrency} against {url} '
+              f'({args.provider}, fake latency {args.latency}s, error rate {args.error_rate})')
+        for name in scenarios:
+            results[name] = run_scenario(name, calls[name], args.requests, args.concurrency)
+        if server is not None:
+            results["server"] = {"peak_rss_mb": process_tree_peak_rss_mb(server.pid)}
+        results["fake_provider"] = {"calls": fake.config.stats["requests"], "images": fake.config.stats["images"]}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        fake.stop()
+
+    name = f'load-{args.provider}' + (f'-pack{args.pack_size}' if args.pack_size > 1 else '')
+    finish(name, results, args.save_baseline, args.tolerance)
+
+if __name__ == '__main__':
+    main()
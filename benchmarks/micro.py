@@ -0,0 +1,71 @@
+# Arabs Stock AI Metadata Generator
+# Micro-benchmarks for the metadata pipeline over a synthetic corpus
+#
+#   python -m benchmarks.micro                  # compare with benchmarks/baselines/micro.json
+#   python -m benchmarks.micro --save-baseline  # record a new baseline
+
+import argparse
+import os
+import time
+from typing import Callable, Dict, List
+
+# Keep the run local and reproducible: no provider keys, no network translation
+for _name in ('OPENAI_API_KEY', 'GEMINI_API_KEY'):
+    os.environ.pop(_name, None)
+os.environ.setdefault('TRANSLATOR_BACKEND', 'dictionary')
+
+from app import (
+    ArabStockMetadataGenerator, IMAGE_PROFILES, AIProvider, prepare_image, compute_image_features, dhash, parse_analysis,
+    embed_metadata
+)
+from benchmarks.common import finish, self_peak_rss_mb, summarize
+from benchmarks.corpus import provider_replies, synthetic_analyses, synthetic_images
+
+def bench(function: Callable, inputs: List, repeat: int) -> Dict:
+    """Time each call over the inputs, `repeat` passes, after one warm-up pass"""
+    for item in inputs:
+        function(item)
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            started = time.perf_counter()
+            function(item)
+            samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description='Metadata pipeline micro-benchmarks')
+    parser.add_argument('--analyses', type=int, default=500, help='synthetic analyses in the corpus')
+    parser.add_argument('--images', type=int, default=20, help='synthetic images in the corpus')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.30, help='allowed regression before failing')
+    args = parser.parse_args()
+
+    generator = ArabStockMetadataGenerator()
+    analyses = synthetic_analyses(args.analyses)
+    images = synthetic_images(args.images)
+    offline_profile = IMAGE_PROFILES[AIProvider.OFFLINE]
+    prepared = [prepare_image(image, **offline_profile) for image in images]
+    replies = provider_replies(analyses)
+    metadata = generator.build_metadata(analyses[0])
+
+    print(f'⏱️  {len(analyses)} analyses, {len(images)} images, {args.repeat} repeats')
+    results = {
+        "generate_titles": bench(generator.generate_titles, analyses, args.repeat),
+        "generate_keywords": bench(generator.generate_keywords, analyses, args.repeat),
+        "suggest_category": bench(generator.suggest_category, analyses, args.repeat),
+        "determine_license_type": bench(generator.determine_license_type, analyses, args.repeat),
+        "build_metadata": bench(generator.build_metadata, analyses, args.repeat),
+        "parse_analysis": bench(parse_analysis, replies, args.repeat),
+        "prepare_image": bench(lambda image: prepare_image(image, **offline_profile), images, args.repeat),
+        "compute_image_features": bench(lambda item: compute_image_features(item.image), prepared, args.repeat),
+        "dhash": bench(lambda item: dhash(item.image), prepared, args.repeat),
+        "_analyze_offline": bench(generator._analyze_offline, prepared, args.repeat),
+        "embed_metadata": bench(lambda image: embed_metadata(image, metadata), images, args.repeat),
+        "process": {"peak_rss_mb": self_peak_rss_mb()}
+    }
+    finish('micro', results, args.save_baseline, args.tolerance)
+
+if __name__ == '__main__':
+    main()
@@ -271,19 +271,17 @@ class ArabsStockHelper {
             };
             reader.readAsDataURL(file);
 
-            // Convert to base64 for API
+            // Keep a data URL for regenerate/reanalyze
             const base64 = await this.fileToBase64(file);
             this.currentImageData = base64;
 
-            // Call Python API
+            // Call Python API with the raw file, no base64/JSON overhead
             const response = await fetch(`${this.apiUrl}/analyze`, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'applications/json',
+                    'Content-Type': 'application/octet-stream',
                 },
-                body: JSON.stringify({
-                    image: base64.split(',')[1] // Remove data URL prefix
-                })
+                body: file
             });
 
             if (!response.ok) {
@@ -291,6 +289,8 @@ class ArabsStockHelper {
             }
 
             const data = await response.json();
+            // Handle for regenerating titles/keywords without uploading the image again
+            this.analysisId = data.analysis_id || null;
             this.displayMetadata(data.metadata);
 
         } catch (error) {
@@ -307,6 +307,7 @@ class ArabsStockHelper {
             const reader = new FileReader();
             reader.onload = () => resolve(reader.result);
             reader.onerror = error => reject(error);
+            reader.readAsDataURL(fiile);
         });
     }
 
@@ -377,15 +378,37 @@ class ArabsStockHelper {
 
         try {
             this.showLoading(true);
-            const response = await fetch(`${this.apiUrl}/analyze`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({image: this.currentImageData.split(',')[1] })
-            });
+            const titleEn = document.getElementById('aiTitleEn');
+            const titleAr = document.getElementById('aiTitleAr');
+            let titles = null;
+
+            // Only the titles are regenerated, from the stored analysis
+            if (this.analysisId) {
+                const response = await fetch(`${this.apiUrl}/analysis/${this.analysisId}/titles`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ exclude: [titleEn.value, titleAr.value] })
+                });
+                if (response.ok) {
+                    titles = (await response.json()).titles;
+                }
+            }
 
-            const data = await response.json();
-            document.getElementById('aiTitleEn').value = data.metadata.titles.en;
-            document.getElementById('aiTitleAr').value = data.metadata.titles.ar;
+            // The handle expired (or the server restarted): analyze the image again
+            if (!titles) {
+                const response = await fetch(`${this.apiUrl}/analyze`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({image: this.currentImageData.split(',')[1] })
+                });
+
+                const data = await response.json();
+                this.analysisId = data.analysis_id || null;
+                titles = data.metadata.titles;
+            }
+
+            titleEn.value = titles.en;
+            titleAr.value = titles.ar;
             this.updateStats();
 
         } catch (error) {
@@ -0,0 +1,234 @@
+# Arabs Stock AI Metadata Generator
+# Local fake OpenAI/Gemini server for exercising the provider layer
+#
+# Point the backend at it with:
+#   OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake
+#   GEMINI_API_ENDPOINT=http://127.0.0.1:8001 GEMINI_API_KEY=fake
+#
+# Latency, error rate, error status and hangs can be set on the command line or
+# changed at runtime with POST /_fake/config.
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+DEFAULT_ANALYSIS = {
+    "main_subject": "business meeting",
+    "people": ["businessman", "businesswoman"],
+    "objects": ["laptop", "documents", "coffee cup"],
+    "setting": "modern office",
+    "mood": "professional",
+    "colors": ["blue", "white", "gray"],
+    "style": "corporate",
+    "cultural_context": "arab business environment"
+}
+
+class FakeProviderConfig:
+    """Runtime-adjustable behaviour of the fake server"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, hang_rate: float = 0.0, retry_after: float = None,
+                 seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.retry_after = retry_after
+        self.analysis = dict(DEFAULT_ANALYSIS)
+        self.reply = None   # raw reply text instead of the JSON analysis, e.g. prose or truncated JSON
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "hangs": 0, "openai": 0, "gemini": 0, "images": 0}
+
+    def update(self, values: Dict):
+        with self.lock:
+            for name in ("latency", "jitter", "error_rate", "error_status", "hang_rate", "retry_after", "analysis", "reply"):
+                if name in values:
+                    setattr(self, name, values[name])
+
+    def draw(self) -> str:
+        """Decide the fate of one request: 'ok', 'error' or 'hang'"""
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.random.random()
+            if roll < self.hang_rate:
+                self.stats["hangs"] += 1
+                return "hang"
+            if roll < self.hang_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+            return "ok"
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """Speaks just enough of the OpenAI chat and Gemini generateContent APIs"""
+
+    protocol_version = 'HTTP/1.1'
+    config: FakeProviderConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    @staticmethod
+    def _image_count(kind: str, request: Dict) -> int:
+        """Images in a chat or generateContent request"""
+        if kind == "openai":
+            parts = [part for message in request.get("messages", []) if isinstance(message.get("content"), list)
+                     for part in message["content"]]
+            return sum(1 for part in parts if part.get("type") == "image_url")
+        parts = [part for content in request.get("contents", []) for part in content.get("parts", [])]
+        return sum(1 for part in parts if "inline_data" in part or "inlineData" in part)
+
+    def do_GET(self):
+        if self.path.startswith('/_fake/stats'):
+            with self.config.lock:
+                self._send_json(200, dict(self.config.stats))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.startswith('/_fake/config'):
+            self.config.update(self._read_json())
+            self._send_json(200, {"status": "ok"})
+            return
+
+        request = self._read_json()
+        if self.path.startswith('/v1/chat/completions'):
+            kind = "openai"
+        elif ':generateContent' in self.path:
+            kind = "gemini"
+        else:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        with self.config.lock:
+            self.config.stats[kind] += 1
+            self.config.stats["images"] += self._image_count(kind, request)
+
+        fate = self.config.draw()
+        if fate == "hang":
+            # Simulate a provider that accepts the request and never answers
+            time.sleep(3600)
+            return
+
+        time.sleep(self.config.delay())
+
+        if fate == "error":
+            status = int(self.config.error_status)
+            headers = {}
+            if self.config.retry_after is not None:
+                headers['Retry-After'] = str(self.config.retry_after)
+            self._send_json(status, {
+                "error": {"message": "fake provider error", "type": "server_error", "code": status, "status": "UNAVAILABLE"}
+            }, headers)
+            return
+
+        images = self._image_count(kind, request)
+        if self.config.reply is not None:
+            content = self.config.reply
+        elif images > 1:
+            # Multi-image requests get one numbered analysis per image
+            content = json.dumps([dict(self.config.analysis, image=number) for number in range(1, images + 1)])
+        else:
+            content = json.dumps(self.config.analysis)
+        if kind == "openai":
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 80, "total_tokens": 180}
+            })
+        else:
+            self._send_json(200, {
+                "candidates": [{
+                    "content": {"parts": [{"text": content}], "role": "model"},
+                    "finishReason": 1,
+                    "index": 0
+                }],
+                "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": 80, "totalTokenCount": 180}
+            })
+
+class FakeProviderServer:
+    """Fake provider running on a background thread, for scripts and benchmarks"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, **config):
+        self.config = FakeProviderConfig(**config)
+        handler = type('BoundFakeProviderHandler', (FakeProviderHandler,), {"config": self.config})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeProviderServer':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'FakeProviderServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI/Gemini provider server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform +/- delay jitter in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status of injected failures')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='share of requests that never answer')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After header on failures')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeProviderServer(
+        args.host, args.port,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        error_status=args.error_status, hang_rate=args.hang_rate,
+        retry_after=args.retry_after, seed=args.seed
+    )
+    print(f'🧪 Fake provider listening on {server.url}')
+    print(f'     OPENAI_BASE_URL={server.url}/v1')
+    print(f'     GEMINI_API_ENDPOINT={server.url}')
+    server.server.serve_forever()
+
+if __name__ == '__main__':
+    main()
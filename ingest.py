@@ -0,0 +1,300 @@
+# Arabs Stock AI Metadata Generator
+# Bulk directory ingest: metadata for an existing photo archive
+#
+#   python ingest.py /photos --output metadata.jsonl [--provider offline|openai|gemini]
+#
+# Worker processes hash, decode and downsize the files. In offline mode they also run
+# the analysis, so throughput scales with cores. With a remote provider the analysis
+# runs on threads in this process, where the generator's provider slots and rate
+# limits keep the provider saturated but not flooded. Every result is appended to the
+# output file as one JSON line; rerunning the same command resumes, skipping files
+# already done (by path, size and mtime) and files whose content was already seen.
+# With --embed-dir, a copy of each analyzed JPEG carrying the metadata as XMP and
+# IPTC is written under that directory, with the same relative path.
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app import (
+    ArabStockMetadataGenerator, AIProvider, ImagePacker, ImageUpload, IMAGE_PROFILES, PROVIDER_CONCURRENCY,
+    embed_metadata_file, prepare_image
+)
+
+INGEST_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp', '.gif')
+
+# Per-process state of the worker pool, set by _init_worker
+_worker = {}
+
+def _init_worker(provider: str, model: Optional[str], seen_digests: Set[str]):
+    _worker["provider"] = AIProvider(provider)
+    _worker["seen"] = seen_digests
+    if _worker["provider"] == AIProvider.OFFLINE:
+        generator = ArabStockMetadataGenerator()
+        generator.set_ai_provider('offline', None, model)
+        _worker["generator"] = generator
+
+def _process_file(path: str) -> Dict:
+    """Hash and downsize one file; in offline mode analyze it too"""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in _worker["seen"]:
+            return {"status": "duplicate", "digest": digest}
+
+        prepared = prepare_image(data, **IMAGE_PROFILES[_worker["provider"]])
+        generator = _worker.get("generator")
+        if generator is None:
+            # The remote analysis runs in the parent; the downsized image travels there encoded
+            return {"status": "prepared", "digest": digest, "prepared": prepared}
+        return {"digest": digest, **_analyze(generator, None, ImageUpload(data, digest, prepared))}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+def _analyze(generator: ArabStockMetadataGenerator, packer: Optional[ImagePacker], upload: ImageUpload) -> Dict:
+    """Analysis -> metadata for one downsized image, as an output record"""
+    try:
+        result = generator.analyze_image(upload, packer)
+        if result.source == "fallback":
+            # The provider never answered; leave the file for the next run
+            raise RuntimeError("analysis failed, provider returned no result")
+        return {
+            "status": "success",
+            "metadata": generator.build_metadata(result.analysis),
+            "ai_provider": generator.current_ai_config.provider.value,
+            "model_used": generator.current_ai_config.model,
+            **result.details()
+        }
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+def find_images(root: str) -> List[str]:
+    """Image files under root, relative to it, in a stable order"""
+    found = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(INGEST_EXTENSIONS) and not name.startswith('.'):
+                found.append(os.path.relpath(os.path.join(directory, name), root))
+    return found
+
+def load_checkpoint(output: str) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, str]]:
+    """Files already done (path -> (size, mtime_ns)) and content already seen (digest -> path)"""
+    done_files = {}
+    digests = {}
+    if not os.path.exists(output):
+        return done_files, digests
+    with open(output, encoding='utf-8') as checkpoint:
+        for line in checkpoint:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue    # a line cut short by an interrupted run
+            if record.get("status") not in ("success", "duplicate"):
+                continue
+            done_files[record["path"]] = (record["size"], record["mtime_ns"])
+            if record["status"] == "success":
+                digests.setdefault(record["digest"], record["path"])
+    return done_files, digests
+
+class Progress:
+    """Counts and throughput, printed every `interval` seconds"""
+
+    def __init__(self, total: int, skipped: int, interval: float):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.counts = {"success": 0, "duplicate": 0, "error": 0}
+        self.started = time.perf_counter()
+        self._printed = self.started
+
+    def add(self, status: str):
+        self.counts[status] += 1
+        now = time.perf_counter()
+        if now - self._printed >= self.interval:
+            self._printed = now
+            self.report()
+
+    def report(self, final: bool = False):
+        elapsed = time.perf_counter() - self.started
+        processed = sum(self.counts.values())
+        rate = processed / elapsed if elapsed else 0.0
+        remaining = self.total - self.skipped - processed
+        eta = f", ETA {remaining / rate / 60:.1f} min" if rate and remaining and not final else ""
+        print(f"{'✅' if final else '📊'} {processed + self.skipped}/{self.total} files: "
+              f"{self.counts['success']} analyzed, {self.counts['duplicate']} duplicates, {self.counts['error']} failed, "
+              f"{self.skipped} already done | {rate:.1f} files/s{eta}", flush=True)
+
+def ingest(root: str, output: str, provider: str = 'offline', model: str = None, workers: int = None,
+           concurrency: int = None, progress_interval: float = 5.0, embed_dir: str = None) -> Dict[str, int]:
+    """Analyze every new image under root, appending one JSON line per file to output"""
+    workers = workers or os.cpu_count() or 1
+    provider = AIProvider(provider)
+    concurrency = concurrency or PROVIDER_CONCURRENCY[provider] * 2
+
+    done_files, digests = load_checkpoint(output)
+    paths = find_images(root)
+    todo = []
+    for path in paths:
+        stat = os.stat(os.path.join(root, path))
+        if done_files.get(path) != (stat.st_size, stat.st_mtime_ns):
+            todo.append((path, stat.st_size, stat.st_mtime_ns))
+    progress = Progress(len(paths), len(paths) - len(todo), progress_interval)
+    print(f"🗂️  {len(paths)} image(s) under {root}, {len(todo)} to process with {workers} process(es)")
+
+    generator = packer = threads = None
+    if provider != AIProvider.OFFLINE:
+        generator = ArabStockMetadataGenerator()
+        if not generator.set_ai_provider(provider.value, None, model):
+            raise SystemExit(f"❌ {provider.value} is not available, check its API key")
+        packer = ImagePacker.for_batch(generator)
+        threads = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ingest')
+        print(f"🌐 {generator.current_ai_config.provider.value} ({generator.current_ai_config.model}), "
+              f"up to {concurrency} image(s) in flight")
+
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(workers, context, initializer=_init_worker,
+                               initargs=(provider.value, model, frozenset(digests)))
+
+    # Bounded windows keep memory flat however large the archive is
+    prepare_window = workers * 4
+    analyze_window = concurrency * 2
+    queue: Iterator = iter(todo)
+    pending = {}    # future -> (stage, (path, size, mtime_ns), digest)
+    copies = {}     # digest being analyzed remotely -> [(item, prepared)] of later files with the same content
+    in_stage = {"prepare": 0, "analyze": 0}
+
+    if os.path.exists(output) and os.path.getsize(output):
+        with open(output, 'rb') as existing:
+            existing.seek(-1, os.SEEK_END)
+            needs_newline = existing.read(1) != b'\n'
+    else:
+        needs_newline = False
+
+    with open(output, 'a', encoding='utf-8') as out:
+        if needs_newline:
+            out.write("\n")
+
+        def write(item: Tuple[str, int, int], digest: Optional[str], result: Dict):
+            path, size, mtime_ns = item
+            record = {"path": path, "size": size, "mtime_ns": mtime_ns, "digest": digest, **result}
+            if record["status"] == "duplicate":
+                record["duplicate_of"] = digests.get(digest)
+            elif record["status"] == "success":
+                digests.setdefault(digest, path)
+                if embed_dir and path.lower().endswith(('.jpg', '.jpeg')):
+                    record["embedded"] = embed(path, record["metadata"])
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            progress.add(record["status"])
+
+        def embed(path: str, metadata: Dict) -> Optional[str]:
+            # Header splicing only, so this stays in the milliseconds even for large files
+            destination = os.path.join(embed_dir, path)
+            try:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                return embed_metadata_file(os.path.join(root, path), metadata, destination)
+            except Exception as e:
+                print(f"Metadata embed error for {path}: {e}")
+                return None
+
+        def submit_analysis(item: Tuple[str, int, int], digest: str, prepared):
+            upload = ImageUpload(prepared.encoded(), digest, prepared)
+            pending[threads.submit(_analyze, generator, packer, upload)] = ("analyze", item, digest)
+            in_stage["analyze"] += 1
+
+        def settle_copies(digest: str, succeeded: bool):
+            """Resolve the copies held back while their content was being analyzed"""
+            waiting = copies.pop(digest, [])
+            if succeeded:
+                for item, _ in waiting:
+                    write(item, digest, {"status": "duplicate"})
+            elif waiting:
+                # The analysis failed; the next copy gets its own, the rest keep waiting
+                (item, prepared), *rest = waiting
+                copies[digest] = rest
+                submit_analysis(item, digest, prepared)
+
+        def top_up():
+            while in_stage["prepare"] < prepare_window and in_stage["analyze"] < analyze_window:
+                item = next(queue, None)
+                if item is None:
+                    return
+                pending[pool.submit(_process_file, os.path.join(root, item[0]))] = ("prepare", item, None)
+                in_stage["prepare"] += 1
+
+        try:
+            top_up()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, item, digest = pending.pop(future)
+                    in_stage[stage] -= 1
+                    result = future.result()
+                    digest = result.pop("digest", digest)
+                    if stage == "analyze":
+                        write(item, digest, result)
+                        settle_copies(digest, result["status"] == "success")
+                    elif result["status"] in ("prepared", "success") and digest in digests:
+                        # Same content already analyzed, in this run or an earlier one (offline workers
+                        # only know earlier runs, so they analyze an in-run copy before it is caught here)
+                        write(item, digest, {"status": "duplicate"})
+                    elif result["status"] == "prepared" and digest in copies:
+                        # Same content as an analysis still in flight; wait for its outcome
+                        copies[digest].append((item, result["prepared"]))
+                    elif result["status"] == "prepared":
+                        copies[digest] = []
+                        submit_analysis(item, digest, result["prepared"])
+                    else:
+                        write(item, digest, result)
+                top_up()
+        except (KeyboardInterrupt, BrokenProcessPool) as e:
+            print(f"\n🛑 Stopped ({type(e).__name__}); rerun the same command to resume")
+            pool.shutdown(wait=False, cancel_futures=True)
+            if threads:
+                threads.shutdown(wait=False, cancel_futures=True)
+            raise SystemExit(1)
+
+    pool.shutdown()
+    if threads:
+        threads.shutdown()
+    progress.report(final=True)
+    return dict(progress.counts, skipped=progress.skipped)
+
+def main():
+    """Command line entry point for bulk ingest"""
+    parser = argparse.ArgumentParser(description='Arabs Stock AI Metadata Generator (bulk directory ingest)')
+    parser.add_argument('directory', help='archive to walk for images')
+    parser.add_argument('--output', default='metadata.jsonl',
+                        help='JSON lines results file, also the checkpoint for resuming')
+    parser.add_argument('--provider', choices=[provider.value for provider in AIProvider], default='offline')
+    parser.add_argument('--model', default=None, help='model for the provider (its default if omitted)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 1))),
+                        help='processes that hash and downsize images (and analyze them offline)')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='remote analyses in flight (default: twice the provider concurrency limit)')
+    parser.add_argument('--progress', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--embed-dir', default=None,
+                        help='write copies of analyzed JPEGs with XMP/IPTC metadata under this directory')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        parser.error(f'{args.directory} is not a directory')
+    if args.embed_dir and os.path.abspath(args.embed_dir) == os.path.abspath(args.directory):
+        parser.error('--embed-dir must differ from the archive directory')
+
+    print('🚀 Arab Stock AI Metadata Generator bulk ingest starting...')
+    counts = ingest(args.directory, args.output, args.provider, args.model, args.workers,
+                    args.concurrency, args.progress, args.embed_dir)
+    sys.exit(1 if counts["error"] else 0)
+
+if __name__ == '__main__':
+    main()
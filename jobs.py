@@ -0,0 +1,64 @@
+# Arabs Stock AI Metadata Generator
+# Worker pool for the background job queue
+#
+# Images queued with POST /api/jobs are stored in JOB_DB / JOB_DIR. This launcher
+# runs worker processes that claim jobs and write results back, so a large catalog
+# backfill survives closed tabs and server restarts and scales with cores.
+
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from app import JobQueue, run_job_worker, JOB_WORKER_THREADS
+
+def _start(context, threads: int):
+    process = context.Process(target=run_job_worker, args=(threads,), daemon=False)
+    process.start()
+    return process
+
+def main():
+    """Run and supervise job worker processes"""
+    parser = argparse.ArgumentParser(description='Arabs Stock AI Metadata Generator (job workers)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('JOB_WORKERS', str(os.cpu_count() or 1))),
+                        help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=JOB_WORKER_THREADS,
+                        help='concurrent jobs per worker process')
+    args = parser.parse_args()
+
+    # Jobs left running by workers that died with a previous launcher are requeued (or failed) now
+    recovered = JobQueue().recover(socket.gethostname())
+    print('🚀 Arab Stock AI Metadata Generator job workers starting...')
+    print(f'⚙️  {args.workers} process(es) x {args.threads} thread(s), {recovered} interrupted job(s) recovered')
+
+    context = multiprocessing.get_context('spawn')
+    processes = [_start(context, args.threads) for _ in range(args.workers)]
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        time.sleep(1.0)
+        for index, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                # A crashed worker's job counts as an attempt; it is requeued and the process replaced
+                print(f'⚠️  Worker {process.pid} exited ({process.exitcode}), restarting')
+                JobQueue().recover(socket.gethostname())
+                processes[index] = _start(context, args.threads)
+
+    print('🛑 Stopping workers, in-flight jobs finish first...')
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':
+    main()
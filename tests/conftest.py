@@ -0,0 +1,45 @@
+# Arabs Stock AI Metadata Generator
+# Shared fixtures: a fake provider server and generators pointed at it
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_provider import FakeProviderServer
+
+@pytest.fixture
+def fake_provider():
+    server = FakeProviderServer().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def provider_env(fake_provider, monkeypatch):
+    """Environment for a Gemini generator talking to the fake provider with fast, small resilience settings"""
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    for name, value in {
+        "GEMINI_API_KEY": "fake",
+        "GEMINI_API_ENDPOINT": fake_provider.url,
+        "TRANSLATOR_BACKEND": "dictionary",
+        "ANALYSIS_CACHE_SIZE": "0",
+        "NEAR_DUPLICATE_DISTANCE": "0",
+        "GEMINI_RPM": "0",
+        "GEMINI_TPM": "0",
+        "PROVIDER_TIMEOUT": "0.5",
+        "PROVIDER_DEADLINE": "1.5",
+        "PROVIDER_MAX_RETRIES": "2",
+        "PROVIDER_BACKOFF_BASE": "0.01",
+        "PROVIDER_BACKOFF_MAX": "0.5",
+        "BREAKER_FAILURE_THRESHOLD": "2",
+        "BREAKER_RESET_TIMEOUT": "0.3"
+    }.items():
+        monkeypatch.setenv(name, value)
+    return monkeypatch
+
+@pytest.fixture
+def image() -> bytes:
+    from benchmarks.corpus import synthetic_image
+    return synthetic_image(0)
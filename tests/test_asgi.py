@@ -0,0 +1,135 @@
+# Arabs Stock AI Metadata Generator
+# ASGI request handling, driven through the raw ASGI interface
+
+import asyncio
+import json
+
+import pytest
+
+def _post(path: str, body: bytes, content_type: str = 'application/json'):
+    """Status and JSON body of one POST to the ASGI app"""
+    status, body = _send(path, body, content_type)
+    return status, json.loads(body)
+
+def _send(path: str, body: bytes, content_type: str = 'application/json'):
+    """Status and raw body of one POST to the ASGI app"""
+    from asgi import app
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80)
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def run():
+        complete = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # The client stays connected until the whole response is in
+            await complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                complete.set()
+
+        await app(scope, receive, send)
+
+    asyncio.run(run())
+    status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return status, body
+
+@pytest.mark.parametrize("body", [b"", b"not json", b"[1, 2]"])
+def test_analyze_without_a_json_object_is_a_400(provider_env, body):
+    assert _post('/api/analyze', body) == (400, {"error": "No image data provided"})
+
+def test_batch_without_a_json_object_is_a_400(provider_env):
+    assert _post('/api/analyze/batch', b"not json") == (400, {"error": "No images provided"})
+
+@pytest.mark.parametrize("path", ['/api/analyze/batch', '/api/analyze/stream'])
+def test_oversized_requests_are_rejected(provider_env, path):
+    import asgi
+    provider_env.setattr(asgi, 'BATCH_MAX_ITEMS', 2)
+
+    body = json.dumps({"images": ["a", "b", "c"]}).encode()
+    assert _post(path, body) == (400, {"error": "Batch is limited to 2 images"})
+
+def test_empty_stream_is_a_400(provider_env):
+    body = json.dumps({"images": []}).encode()
+    assert _post('/api/analyze/stream', body) == (400, {"error": "No images provided"})
+
+def test_disconnecting_cancels_pending_analyses(provider_env):
+    from asgi import app
+    from app import get_generator
+
+    provider_env.setattr('app._generator', None)
+    cancelled = []
+
+    async def analyze_batch_item_async(image_data, packer=None):
+        if image_data != "fast":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(image_data)
+                raise
+        return {"status": "success"}
+
+    provider_env.setattr(get_generator(), 'analyze_batch_item_async', analyze_batch_item_async)
+    body = json.dumps({"images": ["fast", "slow", "slower"]}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/analyze/stream", "raw_path": b"/api/analyze/stream", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80)
+    }
+
+    async def run():
+        first_result = asyncio.Event()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # The client goes away as soon as it has seen the first result
+            await first_result.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message.get("body"):
+                first_result.set()
+
+        await asyncio.wait_for(app(scope, receive, send), 5)
+        # Let the cancelled analyses unwind; left running they would sleep on
+        await asyncio.sleep(0.1)
+        return sorted(cancelled)
+
+    assert asyncio.run(run()) == ["slow", "slower"]
+
+def _stream_latency_total() -> float:
+    from app import REQUEST_LATENCY
+    return sum(entry["sum"] for entry in REQUEST_LATENCY.snapshot() if entry["endpoint"] == '/api/analyze/stream')
+
+def test_stream_latency_covers_the_whole_body(provider_env):
+    from app import get_generator
+
+    provider_env.setattr('app._generator', None)
+
+    async def analyze_batch_item_async(image_data, packer=None):
+        await asyncio.sleep(0.3)
+        return {"status": "success"}
+
+    provider_env.setattr(get_generator(), 'analyze_batch_item_async', analyze_batch_item_async)
+    before = _stream_latency_total()
+
+    status, body = _send('/api/analyze/stream', json.dumps({"images": ["a"]}).encode())
+
+    assert status == 200
+    assert json.loads(body.splitlines()[-1])["count"] == 1
+    assert _stream_latency_total() - before >= 0.3
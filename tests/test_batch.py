@@ -0,0 +1,70 @@
+# Arabs Stock AI Metadata Generator
+# Batch endpoint: per-item status for good and unusable images
+
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+@pytest.fixture
+def client(provider_env):
+    import app
+    provider_env.setattr(app, '_generator', None)
+    return app.app.test_client()
+
+def test_unreadable_items_are_reported_as_errors(client, image):
+    response = client.post('/api/analyze/batch', json={"images": [
+        {"id": "good", "image": base64.b64encode(image).decode()},
+        {"id": "not_an_image", "image": base64.b64encode(b"plain text, not pixels").decode()},
+        {"id": "empty", "image": ""}
+    ]})
+
+    assert response.status_code == 200
+    results = {result["id"]: result for result in response.get_json()["results"]}
+    assert results["good"]["status"] == "success"
+    assert results["not_an_image"]["status"] == "error"
+    assert "decode" in results["not_an_image"]["error"]
+    assert results["empty"]["status"] == "error"
+    assert response.get_json()["failed"] == 2
+    assert results["not_an_image"]["metadata"]["titles"]
+
+@pytest.mark.parametrize("path", ['/api/analyze/batch', '/api/analyze/stream'])
+def test_oversized_requests_are_rejected(client, provider_env, path):
+    import app
+    provider_env.setattr(app, 'BATCH_MAX_ITEMS', 2)
+
+    response = client.post(path, json={"images": ["a", "b", "c"]})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Batch is limited to 2 images"}
+
+@pytest.mark.parametrize("path", ['/api/analyze/batch', '/api/analyze/stream'])
+def test_empty_requests_are_rejected(client, path):
+    response = client.post(path, json={"images": []})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "No images provided"}
+
+def test_closing_the_stream_cancels_waiting_items(client, provider_env):
+    import app
+    started = []
+
+    def analyze_batch_item(image_data, packer=None):
+        started.append(image_data)
+        time.sleep(0.2)
+        return {"status": "success"}
+
+    executor = ThreadPoolExecutor(1)
+    provider_env.setattr(app, 'get_batch_executor', lambda: executor)
+    provider_env.setattr(app.get_generator(), 'analyze_batch_item', analyze_batch_item)
+
+    response = client.post('/api/analyze/stream', json={"images": ["a", "b", "c", "d", "e", "f"]})
+    first = json.loads(next(iter(response.response)))
+    response.close()
+    executor.shutdown(wait=True)
+
+    assert first["status"] == "success"
+    # The item already running finishes; the rest never reach a worker
+    assert len(started) <= 2
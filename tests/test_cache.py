@@ -0,0 +1,85 @@
+# Arabs Stock AI Metadata Generator
+# Content-addressed analysis cache
+
+import time
+
+import pytest
+
+from app import AnalysisCache, ArabStockMetadataGenerator
+
+ANALYSIS = {"main_subject": "desk", "objects": ["laptop"]}
+
+def test_hits_misses_and_copies():
+    cache = AnalysisCache(max_entries=10)
+    key = AnalysisCache.make_key("digest", "gemini", "model")
+
+    assert cache.get(key) is None
+    cache.put(key, ANALYSIS)
+    cached = cache.get(key)
+    cached["objects"].append("mutated")
+
+    # Callers get their own copy
+    assert cache.get(key) == ANALYSIS
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+def test_keys_cover_provider_and_model():
+    keys = {AnalysisCache.make_key("digest", provider, model)
+            for provider, model in (("gemini", "a"), ("gemini", "b"), ("openai", "a"))}
+
+    assert len(keys) == 3
+
+def test_least_recently_used_entries_are_evicted():
+    cache = AnalysisCache(max_entries=2)
+    cache.put("a", ANALYSIS)
+    cache.put("b", ANALYSIS)
+    cache.get("a")
+    cache.put("c", ANALYSIS)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ANALYSIS and cache.get("c") == ANALYSIS
+    assert cache.stats()["evictions"] == 1
+
+def test_entries_expire():
+    cache = AnalysisCache(ttl=0.05)
+    cache.put("a", ANALYSIS)
+
+    time.sleep(0.1)
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    AnalysisCache(db_path=db_path).put("a", ANALYSIS)
+
+    cache = AnalysisCache(db_path=db_path)
+
+    assert cache.get("a") == ANALYSIS
+    assert cache.stats()["disk_hits"] == 1
+    # Promoted to memory
+    cache.get("a")
+    assert cache.stats()["hits"] == 1
+
+def test_expired_disk_entries_are_dropped(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    AnalysisCache(ttl=0.05, db_path=db_path).put("a", ANALYSIS)
+    time.sleep(0.1)
+
+    assert AnalysisCache(db_path=db_path).get("a") is None
+
+@pytest.fixture
+def generator(provider_env) -> ArabStockMetadataGenerator:
+    provider_env.setenv('ANALYSIS_CACHE_SIZE', '100')
+    return ArabStockMetadataGenerator()
+
+def test_repeat_images_are_served_from_the_cache(generator, fake_provider, image):
+    assert generator.analyze_image(image).source == "provider"
+    assert generator.analyze_image(image).source == "cache"
+    assert fake_provider.config.stats["images"] == 1
+
+def test_fallbacks_are_not_cached(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0, "error_status": 400})
+    assert generator.analyze_image(image).source == "fallback"
+
+    fake_provider.config.update({"error_rate": 0.0})
+    assert generator.analyze_image(image).source == "provider"
@@ -0,0 +1,118 @@
+# Arabs Stock AI Metadata Generator
+# XMP/IPTC embedding by JPEG header splicing
+
+import io
+
+import pytest
+from PIL import Image, IptcImagePlugin
+
+from app import MetadataEmbedError, _read_jpeg_header, embed_metadata, embed_metadata_file
+
+METADATA = {
+    "titles": {"en": "Business meeting in Riyadh", "ar": "اجتماع عمل في الرياض"},
+    "keywords": {"en": ["business", "meeting"], "ar": ["أعمال", "اجتماع"]},
+    "category": {"en": "Business", "ar": "أعمال"},
+    "license": "commercial"
+}
+
+def _split(jpeg: bytes):
+    """Header segments and everything from the SOS marker on"""
+    source = io.BytesIO(jpeg)
+    segments = _read_jpeg_header(source)
+    return segments, jpeg[source.tell():]
+
+def _xmp(segments) -> bytes:
+    packets = [payload for marker, payload in segments if marker == 0xE1 and b"<x:xmpmeta" in (payload or b"")]
+    assert len(packets) == 1
+    return packets[0]
+
+@pytest.fixture
+def exif_jpeg(image) -> bytes:
+    picture = Image.open(io.BytesIO(image))
+    exif = Image.Exif()
+    exif[0x010F] = "Camera maker"
+    buffer = io.BytesIO()
+    picture.save(buffer, "JPEG", quality=90, exif=exif.tobytes())
+    return buffer.getvalue()
+
+def test_round_trip_keeps_the_scan_data(exif_jpeg):
+    embedded = embed_metadata(exif_jpeg, METADATA)
+
+    segments, scan = _split(embedded)
+    assert scan == _split(exif_jpeg)[1]
+    # JFIF/Exif stay first
+    assert segments[0][0] in (0xE0, 0xE1) and b"Exif" in b"".join(p or b"" for m, p in segments[:2])
+
+    xmp = _xmp(segments).decode("utf-8")
+    for value in ("Business meeting in Riyadh", "اجتماع عمل في الرياض", "business", "أعمال"):
+        assert value in xmp
+
+    picture = Image.open(io.BytesIO(embedded))
+    iptc = IptcImagePlugin.getiptcinfo(picture)
+    assert iptc[(2, 5)] == "Business meeting in Riyadh".encode("utf-8")
+    keywords = iptc[(2, 25)]
+    assert b"business" in keywords and "أعمال".encode("utf-8") in keywords
+    assert picture.getexif()[0x010F] == "Camera maker"
+    assert picture.tobytes() == Image.open(io.BytesIO(exif_jpeg)).tobytes()
+
+def test_embedding_again_replaces_the_previous_metadata(exif_jpeg):
+    once = embed_metadata(exif_jpeg, METADATA)
+    changed = dict(METADATA, titles={"en": "Desert at dusk", "ar": "صحراء عند الغروب"})
+
+    twice = embed_metadata(once, changed)
+
+    segments, scan = _split(twice)
+    assert scan == _split(exif_jpeg)[1]
+    xmp = _xmp(segments).decode("utf-8")
+    assert "Desert at dusk" in xmp and "Business meeting" not in xmp
+    assert sum(1 for marker, _ in segments if marker == 0xED) == 1
+
+def test_file_embedding_streams_to_a_destination(tmp_path, image):
+    source = tmp_path / "photo.jpg"
+    source.write_bytes(image)
+    destination = tmp_path / "out" / "photo.jpg"
+    destination.parent.mkdir()
+
+    embed_metadata_file(str(source), METADATA, str(destination))
+
+    assert source.read_bytes() == image
+    assert _split(destination.read_bytes())[1] == _split(image)[1]
+
+def test_non_jpeg_is_rejected():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "PNG")
+
+    with pytest.raises(MetadataEmbedError):
+        embed_metadata(buffer.getvalue(), METADATA)
+
+@pytest.fixture
+def client(provider_env):
+    import app
+    provider_env.setattr(app, '_generator', None)
+    return app.app.test_client()
+
+def test_route_rejects_a_non_jpeg_before_analyzing_it(client, fake_provider):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "PNG")
+
+    response = client.post('/api/metadata/embed', data=buffer.getvalue(), content_type='application/octet-stream')
+
+    assert response.status_code == 400
+    assert fake_provider.config.stats["images"] == 0
+
+def test_route_rejects_malformed_metadata(client, image):
+    response = client.post('/api/metadata/embed', data={
+        "image": (io.BytesIO(image), "photo.jpg"), "metadata": "{not json"
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "'metadata' must be a JSON object"}
+
+def test_route_analyzes_and_embeds(client, fake_provider, image):
+    response = client.post('/api/metadata/embed', data=image, content_type='application/octet-stream')
+
+    assert response.status_code == 200
+    segments, scan = _split(response.data)
+    assert scan == _split(image)[1]
+    assert b"business" in _xmp(segments)
+    assert fake_provider.config.stats["images"] == 1
@@ -0,0 +1,102 @@
+# Arabs Stock AI Metadata Generator
+# Export: keyset pagination over finished jobs and the streamed CSV / JSON lines
+
+import json
+
+import pytest
+
+from app import ImageUpload, JobQueue
+from benchmarks.corpus import synthetic_images
+
+CATEGORIES = [("Business", "أعمال"), ("Nature", "طبيعة")]
+
+def _metadata(number: int) -> dict:
+    category_en, category_ar = CATEGORIES[number % 2]
+    return {
+        "titles": {"en": f"Image {number}", "ar": f"صورة {number}"},
+        "keywords": {"en": ["office", f"tag{number}"], "ar": ["مكتب"]},
+        "category": {"en": category_en, "ar": category_ar},
+        "license": "commercial"
+    }
+
+@pytest.fixture
+def queue(tmp_path) -> JobQueue:
+    queue = JobQueue(str(tmp_path / "jobs.db"), str(tmp_path / "images"))
+    for number, data in enumerate(synthetic_images(5)):
+        job, _ = queue.submit(ImageUpload(data), f"{number}.jpg")
+        queue.claim("host:1")
+        queue.complete(job["job_id"], {"metadata": _metadata(number)})
+    return queue
+
+def _set_completed_at(queue: JobQueue, updated_at: float):
+    with queue._lock:
+        queue._db.execute("UPDATE jobs SET updated_at = ?", (updated_at,))
+
+def test_pages_break_ties_on_job_id(queue):
+    # Every job finished in the same second: the cursor must not skip or repeat any
+    _set_completed_at(queue, 1000.0)
+
+    job_ids = [job["job_id"] for job in queue.iter_done(page_size=2)]
+
+    assert job_ids == sorted(job_ids)
+    assert len(set(job_ids)) == 5
+
+def test_page_size_does_not_change_the_result(queue):
+    everything = [job["job_id"] for job in queue.iter_done()]
+
+    assert [job["job_id"] for job in queue.iter_done(page_size=1)] == everything
+    assert [job["job_id"] for job in queue.iter_done(page_size=5)] == everything
+
+def test_filters(queue):
+    jobs = list(queue.iter_done())
+    middle = jobs[2]["updated_at"]
+
+    assert [job["job_id"] for job in queue.iter_done(since=middle, page_size=2)] == [job["job_id"] for job in jobs[2:]]
+    assert [job["job_id"] for job in queue.iter_done(until=middle, page_size=2)] == [job["job_id"] for job in jobs[:2]]
+    assert [job["job_id"] for job in queue.iter_done(job_ids=[jobs[4]["job_id"], "missing"])] == [jobs[4]["job_id"]]
+    assert [job["label"] for job in queue.iter_done(category="business")] == ["0.jpg", "2.jpg", "4.jpg"]
+    assert [job["label"] for job in queue.iter_done(category="طبيعة")] == ["1.jpg", "3.jpg"]
+
+def test_unfinished_jobs_are_not_exported(queue):
+    queue.submit(ImageUpload(synthetic_images(6)[5]), "pending.jpg")
+
+    assert "pending.jpg" not in [job["label"] for job in queue.iter_done()]
+
+@pytest.fixture
+def client(provider_env, queue):
+    import app
+    provider_env.setattr(app, '_generator', None)
+    provider_env.setattr(app, '_job_queue', queue)
+    return app.app.test_client()
+
+def test_csv_export(client):
+    response = client.get('/api/export?format=csv&category=Nature')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.headers["Content-Disposition"].endswith('.csv"')
+    text = response.get_data(as_text=True)
+    assert text.startswith("\ufeff")
+    lines = text.lstrip("\ufeff").splitlines()
+    assert len(lines) == 3
+    assert lines[1].startswith("1.jpg,Image 1,صورة 1,")
+    assert "طبيعة" in lines[1]
+
+def test_jsonl_export(client, queue):
+    job_id = next(queue.iter_done())["job_id"]
+
+    response = client.get(f'/api/export?format=jsonl&job_id={job_id}')
+
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(records) == 1
+    assert records[0]["job_id"] == job_id
+    assert records[0]["title"] == {"en": "Image 0", "ar": "صورة 0"}
+    assert records[0]["license"] == "commercial"
+
+@pytest.mark.parametrize("query", ["format=xml", "since=yesterday"])
+def test_bad_export_parameters_are_a_400(client, query):
+    response = client.get(f'/api/export?{query}')
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
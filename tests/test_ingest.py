@@ -0,0 +1,96 @@
+# Arabs Stock AI Metadata Generator
+# Bulk directory ingest: duplicates, resuming and the prepared-image hand-off
+
+import json
+import pickle
+
+import pytest
+
+from app import PreparedImage, prepare_image
+from ingest import ingest
+
+def _archive(tmp_path, image, other):
+    root = tmp_path / "photos"
+    (root / "a").mkdir(parents=True)
+    (root / "a" / "1.jpg").write_bytes(image)
+    (root / "a" / "2.jpg").write_bytes(image)
+    (root / "b.jpg").write_bytes(other)
+    (root / "c.jpg").write_bytes(image)
+    return root
+
+def _records(output):
+    with open(output, encoding='utf-8') as lines:
+        return {record["path"]: record for record in map(json.loads, lines)}
+
+@pytest.fixture
+def other_image() -> bytes:
+    from benchmarks.corpus import synthetic_image
+    return synthetic_image(1)
+
+def _check_duplicates(records):
+    statuses = sorted(record["status"] for record in records.values())
+    assert statuses == ["duplicate", "duplicate", "success", "success"]
+    first = next(path for path, record in records.items()
+                 if record["status"] == "success" and path != "b.jpg")
+    for record in records.values():
+        if record["status"] == "duplicate":
+            assert record["duplicate_of"] == first
+
+def test_offline_ingest_marks_in_run_duplicates(tmp_path, image, other_image):
+    root = _archive(tmp_path, image, other_image)
+    output = str(tmp_path / "metadata.jsonl")
+
+    counts = ingest(str(root), output, 'offline', workers=2, progress_interval=60)
+
+    assert counts["success"] == 2 and counts["duplicate"] == 2
+    _check_duplicates(_records(output))
+    # A rerun finds everything done
+    assert ingest(str(root), output, 'offline', workers=1, progress_interval=60)["skipped"] == 4
+
+def test_remote_ingest_marks_in_run_duplicates(tmp_path, provider_env, fake_provider, image, other_image):
+    root = _archive(tmp_path, image, other_image)
+    output = str(tmp_path / "metadata.jsonl")
+
+    counts = ingest(str(root), output, 'gemini', workers=2, progress_interval=60)
+
+    assert counts["success"] == 2 and counts["duplicate"] == 2
+    _check_duplicates(_records(output))
+    assert fake_provider.config.stats["images"] == 2
+
+def test_copies_of_a_failed_analysis_are_analyzed_again(tmp_path, provider_env, fake_provider, image, other_image):
+    root = tmp_path / "photos"
+    root.mkdir()
+    for name, data in (("1.jpg", image), ("2.jpg", image), ("3.jpg", other_image), ("4.jpg", image)):
+        (root / name).write_bytes(data)
+    output = str(tmp_path / "metadata.jsonl")
+    config = fake_provider.config
+    draw = config.draw
+
+    def first_analysis_fails() -> str:
+        # Request 1 is the connection test, 2-4 the first analysis and its retries
+        fate = draw()
+        return "error" if 2 <= config.stats["requests"] <= 4 else fate
+
+    config.draw = first_analysis_fails
+    ingest(str(root), output, 'gemini', workers=1, concurrency=1, progress_interval=60)
+
+    records = _records(output)
+    assert records["1.jpg"]["status"] == "error"
+    assert records["3.jpg"]["status"] == "success"
+    copies = [records[path] for path in ("2.jpg", "4.jpg")]
+    assert sorted(record["status"] for record in copies) == ["duplicate", "success"]
+    original = next(path for path in ("2.jpg", "4.jpg") if records[path]["status"] == "success")
+    assert all(record["duplicate_of"] == original for record in copies if record["status"] == "duplicate")
+
+def test_prepared_images_pickle_as_their_encoded_bytes(image):
+    prepared = prepare_image(image, max_edge=64)
+    prepared.features()
+
+    restored = pickle.loads(pickle.dumps(prepared))
+
+    assert isinstance(restored, PreparedImage)
+    assert restored.original_size == prepared.original_size
+    assert restored.image.size == prepared.image.size
+    assert restored.encoded() == prepared.encoded()
+    assert restored.features() == prepared.features()
+    assert len(pickle.dumps(prepared)) < len(prepared.image.tobytes())
@@ -0,0 +1,86 @@
+# Arabs Stock AI Metadata Generator
+# SQLite job queue: dedupe, leases, retries and crashed workers
+
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app import ImageUpload, JobQueue
+
+@pytest.fixture
+def queue(tmp_path) -> JobQueue:
+    return JobQueue(str(tmp_path / "jobs.db"), str(tmp_path / "images"), lease=60, max_attempts=2)
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def test_resubmitting_an_image_returns_its_job(queue, image):
+    job, created = queue.submit(ImageUpload(image), "first")
+    again, created_again = queue.submit(ImageUpload(image), "second")
+
+    assert created and not created_again
+    assert again["job_id"] == job["job_id"]
+    assert queue.stats()["queued"] == 1
+
+def test_claim_and_complete(queue, image):
+    job, _ = queue.submit(ImageUpload(image))
+
+    claimed = queue.claim("host:1")
+    assert claimed["job_id"] == job["job_id"]
+    assert claimed["attempts"] == 1
+    assert queue.claim("host:2") is None
+
+    queue.complete(job["job_id"], {"status": "success"})
+    assert queue.get(job["job_id"])["status"] == "done"
+    assert queue.get(job["job_id"])["result"] == {"status": "success"}
+
+def test_failures_are_retried_until_max_attempts(queue, image):
+    job, _ = queue.submit(ImageUpload(image))
+
+    queue.claim("host:1")
+    queue.fail(job["job_id"], "provider down")
+    assert queue.get(job["job_id"])["status"] == "queued"
+
+    queue.claim("host:1")
+    queue.fail(job["job_id"], "provider down")
+    assert queue.get(job["job_id"])["status"] == "failed"
+
+    # Submitting a failed image queues it again from scratch
+    again, created = queue.submit(ImageUpload(image))
+    assert created and again["status"] == "queued" and again["attempts"] == 0
+
+def test_expired_leases_are_claimed_again(tmp_path, image):
+    queue = JobQueue(str(tmp_path / "jobs.db"), str(tmp_path / "images"), lease=0.05, max_attempts=3)
+    job, _ = queue.submit(ImageUpload(image))
+    queue.claim("host:1")
+
+    time.sleep(0.1)
+    claimed = queue.claim("host:2")
+
+    assert claimed["job_id"] == job["job_id"]
+    assert claimed["attempts"] == 2
+
+def test_a_job_that_keeps_crashing_its_worker_fails(queue, image):
+    job, _ = queue.submit(ImageUpload(image))
+
+    for attempt in range(2):
+        assert queue.claim(f"host:{_dead_pid()}")["attempts"] == attempt + 1
+        assert queue.recover("host") == 1
+
+    job = queue.get(job["job_id"])
+    assert job["status"] == "failed"
+    assert job["error"] == "worker process died"
+    assert queue.claim("host:1") is None
+
+def test_recover_only_touches_workers_on_this_host(queue, image):
+    queue.submit(ImageUpload(image))
+    queue.claim(f"web_1:{_dead_pid()}")
+
+    # "_" is a LIKE wildcard; another host's jobs must not match
+    assert queue.recover("web%") == 0
+    assert queue.recover("webX1") == 0
+    assert queue.recover("web_1") == 1
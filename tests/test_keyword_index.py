@@ -0,0 +1,64 @@
+# Arabs Stock AI Metadata Generator
+# Keyword suggestion index: which analyses feed the co-occurrence counts
+
+import pytest
+
+from app import ArabStockMetadataGenerator
+
+@pytest.fixture
+def generator(provider_env) -> ArabStockMetadataGenerator:
+    provider_env.setenv('ANALYSIS_CACHE_SIZE', '100')
+    return ArabStockMetadataGenerator()
+
+def _keyword_sets(generator) -> int:
+    return generator.keyword_index.stats()["languages"].get("en", {}).get("keyword_sets", 0)
+
+def test_fresh_analyses_are_indexed_once(generator, fake_provider, image):
+    result = generator.analyze_image(image)
+    generator.build_metadata(result.analysis)
+    assert result.source == "provider"
+    assert _keyword_sets(generator) == 1
+
+    # Cache hits and metadata regenerations reuse the analysis, they don't add a keyword set
+    cached = generator.analyze_image(image)
+    generator.build_metadata(cached.analysis)
+    generator.build_metadata(cached.analysis)
+    assert cached.source == "cache"
+    assert _keyword_sets(generator) == 1
+
+def test_fallback_analyses_are_not_indexed(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0})
+
+    result = generator.analyze_image(image)
+    generator.build_metadata(result.analysis)
+
+    assert result.source == "fallback"
+    assert _keyword_sets(generator) == 0
+
+@pytest.fixture
+def client(provider_env):
+    import app
+    provider_env.setattr(app, '_generator', None)
+    return app.app.test_client()
+
+@pytest.mark.parametrize("body", [
+    {"title": "desk", "keywords": ["desk"], "language": "fr"},
+    {"title": "desk", "keywords": "desk, office", "language": "en"},
+    {"title": "desk", "keywords": ["desk", 3], "language": "en"},
+    {"title": ["desk"], "keywords": ["desk"], "language": "en"}
+])
+def test_optimize_rejects_invalid_input_before_learning_it(client, body):
+    import app
+
+    response = client.post('/api/optimize', json=body)
+
+    assert response.status_code == 400
+    assert app.get_generator().keyword_index.stats()["languages"] == {}
+
+def test_optimize_learns_valid_keyword_sets(client):
+    import app
+
+    response = client.post('/api/optimize', json={"title": "desk", "keywords": ["desk", "office"], "language": "en"})
+
+    assert response.status_code == 200
+    assert app.get_generator().keyword_index.stats()["languages"]["en"]["keyword_sets"] == 1
@@ -0,0 +1,39 @@
+# Arabs Stock AI Metadata Generator
+# Keyword, category and license rules
+
+from app import MetadataRules
+
+rules = MetadataRules()
+
+def test_terms_match_at_the_start_of_a_word():
+    hits = rules.scan({"main_subject": "businessman at a desk", "setting": "tall buildings"})
+
+    assert rules.category(hits)[0] == "Business"
+    assert "architecture" in rules.keywords(hits)["en"]
+
+def test_terms_do_not_match_inside_a_word():
+    hits = rules.scan({"main_subject": "birthday party", "style": "candid"})
+
+    assert "Art" not in [en for en, _ in rules.matching_categories(hits)]
+
+def test_hits_stay_in_their_field():
+    # "news" in the mood field must not fire the editorial rule, which only looks at subject, objects and setting
+    hits = rules.scan({"main_subject": "family dinner", "mood": "good news", "objects": ["dates", "coffee"]})
+
+    assert rules.license(hits) == "commercial"
+    assert rules.category(hits)[0] == "People"
+    assert "food" in rules.keywords(hits)["en"]
+
+def test_terms_do_not_span_fields():
+    hits = rules.scan({"main_subject": "camel", "setting": "race track"})
+
+    assert rules.category(hits)[0] != "Sports"
+
+def test_longer_terms_carry_the_rules_of_terms_inside_them():
+    hits = rules.scan({"main_subject": "breaking news coverage"})
+
+    assert rules.license(hits) == "editorial"
+
+def test_presence_rules_need_a_non_empty_field():
+    assert "people" in rules.keywords(rules.scan({"people": ["woman"]}))["en"]
+    assert "people" not in rules.keywords(rules.scan({"people": ["  "]}))["en"]
@@ -0,0 +1,45 @@
+# Arabs Stock AI Metadata Generator
+# Prometheus exposition of the component stats
+
+import time
+
+import pytest
+
+@pytest.fixture
+def client(provider_env):
+    import app
+    provider_env.setattr(app, '_generator', None)
+    return app.app.test_client()
+
+def test_cumulative_stats_are_counters(client, image):
+    client.post('/api/analyze', data=image, content_type='application/octet-stream')
+    lines = client.get('/metrics').get_data(as_text=True).splitlines()
+
+    for name in ("arabstock_analysis_cache_hits_total", "arabstock_analysis_cache_misses_total",
+                 "arabstock_translation_memory_hits_total", "arabstock_provider_retries_total"):
+        assert f"# TYPE {name} counter" in lines
+    assert "# TYPE arabstock_analysis_cache_entries gauge" in lines
+    assert "# TYPE arabstock_breaker_open gauge" in lines
+    assert not any(line.startswith("# TYPE") and line.split()[2].endswith("_total") and line.endswith("gauge")
+                   for line in lines)
+
+def test_stream_latency_covers_the_whole_body(client, provider_env):
+    import app
+
+    def analyze_batch_item(image_data, packer=None):
+        time.sleep(0.3)
+        return {"status": "success"}
+
+    provider_env.setattr(app.get_generator(), 'analyze_batch_item', analyze_batch_item)
+
+    def stream_latency_total() -> float:
+        return sum(entry["sum"] for entry in app.REQUEST_LATENCY.snapshot()
+                   if entry["endpoint"] == '/api/analyze/stream')
+
+    before = stream_latency_total()
+    response = client.post('/api/analyze/stream', json={"images": ["a"]})
+    assert stream_latency_total() == before
+
+    assert response.get_data(as_text=True).count("\n") == 2
+    response.close()
+    assert stream_latency_total() - before >= 0.3
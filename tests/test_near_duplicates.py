@@ -0,0 +1,68 @@
+# Arabs Stock AI Metadata Generator
+# Near-duplicate reuse: perceptual hashes, the BK-tree index and the generator hook
+
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from app import ArabStockMetadataGenerator, BKTree, NearDuplicateIndex, dhash, hamming_distance
+
+def test_bk_tree_search_matches_a_linear_scan():
+    rolls = random.Random(7)
+    hashes = [rolls.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for index, hash_value in enumerate(hashes):
+        tree.add(hash_value, index)
+
+    for query in hashes[:20] + [rolls.getrandbits(64) for _ in range(20)]:
+        expected = sorted(distance for distance in (hamming_distance(query, h) for h in hashes) if distance <= 24)
+        assert [distance for distance, _ in tree.search(query, 24)] == expected
+
+def test_nearest_match_within_the_scope():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add("gemini:a", 0b1111, "far", {"main_subject": "far"})
+    index.add("gemini:a", 0b0001, "near", {"main_subject": "near"})
+    index.add("gemini:b", 0b0000, "other scope", {"main_subject": "other"})
+
+    distance, digest, analysis = index.find("gemini:a", 0b0000)
+
+    assert (distance, digest, analysis) == (1, "near", {"main_subject": "near"})
+    assert index.find("openai:a", 0b0000) is None
+    assert index.find("gemini:a", (1 << 64) - 1) is None
+
+def test_oldest_entries_are_dropped_when_full():
+    index = NearDuplicateIndex(max_distance=1, max_entries=4)
+    for value in range(5):
+        index.add("scope", 0xFFFF << (16 * value), str(value), {"value": value})
+
+    assert index.stats()["entries"] == 4
+    assert index.find("scope", 0xFFFF) is None
+    assert index.find("scope", 0xFFFF << 64)[1] == "4"
+
+def test_dhash_is_stable_under_recompression(image):
+    picture = Image.open(io.BytesIO(image))
+    buffer = io.BytesIO()
+    picture.resize((picture.width * 9 // 10, picture.height * 9 // 10)).save(buffer, "JPEG", quality=60)
+
+    assert hamming_distance(dhash(picture), dhash(Image.open(buffer))) <= 6
+
+@pytest.fixture
+def generator(provider_env) -> ArabStockMetadataGenerator:
+    provider_env.setenv('NEAR_DUPLICATE_DISTANCE', '6')
+    return ArabStockMetadataGenerator()
+
+def test_a_recompressed_copy_reuses_the_analysis(generator, fake_provider, image):
+    picture = Image.open(io.BytesIO(image))
+    buffer = io.BytesIO()
+    picture.save(buffer, "JPEG", quality=60)
+
+    first = generator.analyze_image(image)
+    second = generator.analyze_image(buffer.getvalue())
+
+    assert first.source == "provider"
+    assert second.source == "near_duplicate"
+    assert second.near_duplicate["distance"] <= 6
+    assert second.analysis["main_subject"] == first.analysis["main_subject"]
+    assert fake_provider.config.stats["images"] == 1
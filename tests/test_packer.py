@@ -0,0 +1,78 @@
+# Arabs Stock AI Metadata Generator
+# Batch packing: concurrent items sharing one multi-image provider request
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import ArabStockMetadataGenerator, ImagePacker, prepare_image
+from benchmarks.corpus import synthetic_images
+
+@pytest.fixture
+def generator(provider_env, fake_provider) -> ArabStockMetadataGenerator:
+    generator = ArabStockMetadataGenerator()
+    fake_provider.config.stats["images"] = 0
+    return generator
+
+@pytest.fixture
+def prepared():
+    return [prepare_image(data) for data in synthetic_images(4)]
+
+def _packer(generator, size: int = 4, linger: float = 2.0) -> ImagePacker:
+    return ImagePacker(generator, generator.current_ai_config, size=size, linger=linger)
+
+def test_concurrent_items_share_one_request(generator, fake_provider, prepared):
+    packer = _packer(generator)
+    requests = fake_provider.config.stats["requests"]
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(packer.analyze, prepared))
+
+    assert all(result is not None and result["main_subject"] for result in results)
+    assert fake_provider.config.stats["requests"] == requests + 1
+    assert fake_provider.config.stats["images"] == 4
+
+def test_linger_sends_a_partial_pack(generator, fake_provider, prepared):
+    packer = _packer(generator, size=8, linger=0.2)
+
+    with ThreadPoolExecutor(2) as pool:
+        results = list(pool.map(packer.analyze, prepared[:2]))
+
+    assert all(result is not None for result in results)
+    assert fake_provider.config.stats["images"] == 2
+
+def test_a_lone_item_makes_its_own_call(generator, fake_provider, prepared):
+    packer = _packer(generator, linger=0.05)
+    requests = fake_provider.config.stats["requests"]
+
+    assert packer.analyze(prepared[0]) is None
+    assert fake_provider.config.stats["requests"] == requests
+
+def test_a_failed_pack_falls_back_to_single_calls(generator, fake_provider, prepared):
+    fake_provider.config.update({"error_rate": 1.0})
+    packer = _packer(generator, size=2)
+
+    with ThreadPoolExecutor(2) as pool:
+        assert list(pool.map(packer.analyze, prepared[:2])) == [None, None]
+
+def test_packed_images_are_shrunk(generator, prepared):
+    packer = ImagePacker(generator, generator.current_ai_config, max_edge=64)
+
+    shrunk = packer._shrink(prepared[0])
+
+    assert max(shrunk.image.size) == 64
+    assert shrunk.original_size == prepared[0].original_size
+
+def test_async_items_share_one_request(generator, fake_provider, prepared):
+    packer = _packer(generator, size=3)
+    requests = fake_provider.config.stats["requests"]
+
+    async def analyze_all():
+        return await asyncio.gather(*(packer.analyze_async(item) for item in prepared[:3]))
+
+    results = asyncio.run(analyze_all())
+
+    assert all(result is not None for result in results)
+    assert fake_provider.config.stats["requests"] == requests + 1
+    assert fake_provider.config.stats["images"] == 3
@@ -0,0 +1,42 @@
+# Arabs Stock AI Metadata Generator
+# Tolerant parsing of provider replies
+
+import time
+
+from app import JSON_MAX_STARTS, extract_json_array, extract_json_object, parse_analysis
+
+def test_json_after_prose_and_placeholders():
+    reply = 'Sure! Fill in {title} and {keywords}:\n```json\n{"main_subject": "desk", "objects": ["laptop"]}\n```'
+
+    assert extract_json_object(reply) == {"main_subject": "desk", "objects": ["laptop"]}
+
+def test_truncated_reply_is_closed_at_its_last_complete_member():
+    reply = '{"main_subject": "desk", "objects": ["laptop", "lamp"], "mood": "cal'
+
+    assert extract_json_object(reply) == {"main_subject": "desk", "objects": ["laptop", "lamp"]}
+
+def test_wrapped_array():
+    reply = '{"images": [{"image": 1, "main_subject": "desk"}]}'
+
+    assert extract_json_array(reply) == [{"image": 1, "main_subject": "desk"}]
+
+def test_bracket_heavy_replies_stay_linear():
+    started = time.monotonic()
+
+    assert extract_json_object("{" * 50000) is None
+    assert extract_json_array("[" * 50000) is None
+    assert extract_json_object("{x} " * 50000) is None
+    assert time.monotonic() - started < 2
+
+def test_only_the_first_brackets_are_tried():
+    placeholders = "{x} " * JSON_MAX_STARTS
+
+    assert extract_json_object(placeholders + '{"main_subject": "desk"}') is None
+    assert extract_json_object(placeholders[4:] + '{"main_subject": "desk"}') == {"main_subject": "desk"}
+
+def test_prose_reply_falls_back_to_labelled_lines():
+    analysis, from_json = parse_analysis("Main subject: camel race\nColors: gold, brown")
+
+    assert not from_json
+    assert analysis["main_subject"] == "camel race"
+    assert analysis["colors"] == ["gold", "brown"]
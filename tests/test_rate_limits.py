@@ -0,0 +1,92 @@
+# Arabs Stock AI Metadata Generator
+# Provider rate limiter: token buckets, timeouts and round-robin fairness
+
+import asyncio
+import threading
+import time
+
+from app import AIConfig, AIProvider, ProviderRateLimiter, ProviderRateLimits, TokenBucket
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket.updated
+    bucket.take(60)
+
+    assert bucket.wait_time(1, now) == 1.0
+    assert bucket.wait_time(1, now + 1.0) == 0.0
+    # Never more than a minute's worth
+    assert bucket.wait_time(60, now + 600) == 0.0
+    assert bucket.available == 60
+
+def test_unlimited_buckets_never_wait():
+    bucket = TokenBucket(per_minute=0)
+    bucket.take(10 ** 6)
+
+    assert bucket.wait_time(10 ** 6, time.monotonic()) == 0.0
+
+def _drained(rpm: float, tpm: float = 0) -> ProviderRateLimiter:
+    limiter = ProviderRateLimiter(rpm, tpm)
+    limiter.requests.take(rpm)
+    limiter.tokens.take(tpm)
+    return limiter
+
+def test_calls_over_budget_wait_for_capacity():
+    limiter = _drained(rpm=600)   # one request per 0.1 s
+
+    started = time.monotonic()
+    assert limiter.acquire(100, timeout=2)
+
+    assert time.monotonic() - started >= 0.08
+    assert limiter.stats()["granted"] == 1
+
+def test_token_budget_is_charged_too():
+    limiter = ProviderRateLimiter(rpm=0, tpm=600)
+
+    assert limiter.acquire(600, timeout=0.1)
+    assert not limiter.acquire(300, timeout=0.1)
+    assert limiter.stats()["timeouts"] == 1
+    assert limiter.stats()["queue_depth"] == 0
+
+def test_waiting_callers_are_served_round_robin():
+    limiter = _drained(rpm=1200)   # one request per 0.05 s
+    order = []
+
+    def call(caller: str):
+        assert limiter.acquire(1, caller, timeout=5)
+        order.append(caller)
+
+    batch = [threading.Thread(target=call, args=("batch",)) for _ in range(4)]
+    for thread in batch:
+        thread.start()
+    while limiter.stats()["queue_depth"] < 4:
+        time.sleep(0.005)
+    single = threading.Thread(target=call, args=("single",))
+    single.start()
+    for thread in batch + [single]:
+        thread.join(5)
+
+    # The late single call goes ahead of the batch's remaining three
+    assert order.index("single") == 1
+    assert limiter.stats()["waiting_callers"] == 0
+
+def test_cancelled_async_waiters_leave_the_queue():
+    limiter = _drained(rpm=6)
+
+    async def cancel_while_waiting():
+        task = asyncio.ensure_future(limiter.acquire_async(1, timeout=30))
+        await asyncio.sleep(0.1)
+        assert limiter.stats()["queue_depth"] == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel_while_waiting())
+    assert limiter.stats()["queue_depth"] == 0
+
+def test_limiters_are_shared_per_provider_and_key():
+    limits = ProviderRateLimits({AIProvider.GEMINI: (60, 0)})
+
+    first = limits.limiter(AIConfig(AIProvider.GEMINI, "key-a"))
+
+    assert limits.limiter(AIConfig(AIProvider.GEMINI, "key-a", model="other")) is first
+    assert limits.limiter(AIConfig(AIProvider.GEMINI, "key-b")) is not first
+    assert "key-a" not in str(limits.stats())
@@ -0,0 +1,170 @@
+# Arabs Stock AI Metadata Generator
+# Provider resilience against the fake provider: retries, breaker and deadlines
+
+import asyncio
+import time
+
+import pytest
+
+from app import AIProvider, ArabStockMetadataGenerator, CircuitBreaker, ProviderResilience, current_caller
+
+def _fail_first(config, failures: int):
+    """Make the fake provider fail its first `failures` requests and answer the rest"""
+    draw = config.draw
+
+    def scripted() -> str:
+        fate = draw()
+        if config.stats["requests"] >= failures:
+            config.error_rate = 0.0
+        return fate
+
+    config.error_rate = 1.0
+    config.draw = scripted
+
+@pytest.fixture
+def generator(provider_env) -> ArabStockMetadataGenerator:
+    generator = ArabStockMetadataGenerator()
+    assert generator.current_ai_config.provider == AIProvider.GEMINI
+    return generator
+
+def _stats(generator):
+    return generator.resilience.stats()[AIProvider.GEMINI.value]
+
+@pytest.mark.parametrize("status", [500, 503, 429])
+def test_retries_until_the_provider_recovers(generator, fake_provider, image, status):
+    fake_provider.config.update({"error_status": status})
+    _fail_first(fake_provider.config, 2)
+
+    result = generator.analyze_image(image)
+
+    assert result.source == "provider"
+    assert fake_provider.config.stats["requests"] == 3
+    stats = _stats(generator)
+    assert stats["retries"] == 2
+    assert stats["failures"] == 0
+
+def test_persistent_503_fails_fast_without_sdk_retries(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0, "error_status": 503})
+
+    started = time.monotonic()
+    result = generator.analyze_image(image)
+
+    # One call plus PROVIDER_MAX_RETRIES retries, well inside PROVIDER_DEADLINE
+    assert result.source == "fallback"
+    assert time.monotonic() - started < 1.5
+    assert fake_provider.config.stats["requests"] == 3
+    assert _stats(generator)["failures"] == 1
+    assert generator.resilience.breakers[AIProvider.GEMINI].consecutive_failures == 1
+
+def test_async_503_fails_fast(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0, "error_status": 503})
+
+    started = time.monotonic()
+    result = asyncio.run(generator.analyze_image_async(image))
+
+    assert result.source == "fallback"
+    assert time.monotonic() - started < 1.5
+    assert fake_provider.config.stats["requests"] == 3
+
+def test_retry_after_sets_the_backoff(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0, "error_status": 429, "retry_after": 0.2})
+
+    started = time.monotonic()
+    generator.analyze_image(image)
+
+    # Two retries, each waiting at least the advertised Retry-After
+    assert time.monotonic() - started >= 0.4
+    assert fake_provider.config.stats["requests"] == 3
+
+def test_client_errors_are_not_retried(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0, "error_status": 400})
+
+    assert generator.analyze_image(image).source == "fallback"
+    assert fake_provider.config.stats["requests"] == 1
+    assert _stats(generator)["retries"] == 0
+
+def test_breaker_opens_and_short_circuits(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0})
+    breaker = generator.resilience.breakers[AIProvider.GEMINI]
+
+    generator.analyze_image(image)
+    generator.analyze_image(image)
+    assert breaker.state == CircuitBreaker.OPEN
+    requests = fake_provider.config.stats["requests"]
+
+    # While open, calls fall back without reaching the provider
+    assert generator.analyze_image(image).source == "fallback"
+    assert fake_provider.config.stats["requests"] == requests
+    assert _stats(generator)["short_circuited"] == 1
+
+def test_half_open_probe_closes_the_breaker(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0})
+    breaker = generator.resilience.breakers[AIProvider.GEMINI]
+    generator.analyze_image(image)
+    generator.analyze_image(image)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    fake_provider.config.update({"error_rate": 0.0})
+    time.sleep(0.35)
+    requests = fake_provider.config.stats["requests"]
+
+    assert generator.analyze_image(image).source == "provider"
+    assert fake_provider.config.stats["requests"] == requests + 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_failed_probe_reopens_the_breaker(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0})
+    breaker = generator.resilience.breakers[AIProvider.GEMINI]
+    generator.analyze_image(image)
+    generator.analyze_image(image)
+    opened = breaker.snapshot()["times_opened"]
+
+    time.sleep(0.35)
+    assert generator.analyze_image(image).source == "fallback"
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()["times_opened"] == opened + 1
+
+def test_hang_falls_back_at_the_deadline(generator, fake_provider, image):
+    fake_provider.config.update({"hang_rate": 1.0})
+
+    started = time.monotonic()
+    result = generator.analyze_image(image)
+    elapsed = time.monotonic() - started
+
+    # Per-attempt timeouts are retried but the whole call stops at PROVIDER_DEADLINE
+    assert result.source == "fallback"
+    assert elapsed < 1.5 + 0.5 + 1.0
+    assert _stats(generator)["timeouts"] >= 1
+    assert _stats(generator)["failures"] == 1
+
+def test_async_hang_falls_back_at_the_deadline(generator, fake_provider, image):
+    fake_provider.config.update({"hang_rate": 1.0})
+
+    started = time.monotonic()
+    result = asyncio.run(generator.analyze_image_async(image))
+
+    assert result.source == "fallback"
+    assert time.monotonic() - started < 1.5 + 0.5 + 1.0
+    assert _stats(generator)["timeouts"] >= 1
+
+def test_hedged_calls_run_in_the_callers_context():
+    resilience = ProviderResilience(hedge_enabled=True, hedge_min_samples=1)
+    resilience._latencies[AIProvider.GEMINI].append(0.01)
+    seen = []
+
+    def primary():
+        seen.append(("primary", current_caller.get()))
+        time.sleep(0.2)
+        return "primary"
+
+    def secondary():
+        seen.append(("secondary", current_caller.get()))
+        return "secondary"
+
+    token = current_caller.set("contributor-7")
+    try:
+        assert resilience.hedge(AIProvider.GEMINI, primary, secondary) == "secondary"
+    finally:
+        current_caller.reset(token)
+
+    assert sorted(seen) == [("primary", "contributor-7"), ("secondary", "contributor-7")]
@@ -0,0 +1,55 @@
+# Arabs Stock AI Metadata Generator
+# Complexity routing: tiers, breaker bypass and what gets cached where
+
+import time
+
+import pytest
+
+from app import AIProvider, AnalysisCache, ArabStockMetadataGenerator, CircuitBreaker, ImageUpload
+
+@pytest.fixture
+def generator(provider_env) -> ArabStockMetadataGenerator:
+    # Every image scores as complex, so only breaker state moves it off the selected model
+    provider_env.setenv('ROUTING', 'complexity')
+    provider_env.setenv('ROUTING_OFFLINE_BELOW', '0')
+    provider_env.setenv('ROUTING_FAST_BELOW', '0')
+    provider_env.setenv('ANALYSIS_CACHE_SIZE', '100')
+    return ArabStockMetadataGenerator()
+
+def _open_breaker(generator, fake_provider, image):
+    fake_provider.config.update({"error_rate": 1.0})
+    generator.analyze_image(image)
+    generator.analyze_image(image)
+    assert generator.resilience.breakers[AIProvider.GEMINI].state == CircuitBreaker.OPEN
+    fake_provider.config.update({"error_rate": 0.0})
+
+def test_complex_images_use_the_selected_model(generator, fake_provider, image):
+    result = generator.analyze_image(image)
+
+    assert result.source == "provider"
+    assert result.route["tier"] == "accurate"
+    assert generator.analyze_image(image).source == "cache"
+
+def test_unhealthy_provider_routes_offline_without_caching_as_the_provider(generator, fake_provider, image):
+    _open_breaker(generator, fake_provider, image)
+    config = generator.current_ai_config
+
+    result = generator.analyze_image(image)
+
+    assert result.source == "offline"
+    assert result.route["reason"] == "provider_unhealthy"
+    digest = ImageUpload.from_data(image).digest
+    assert generator.analysis_cache.get(AnalysisCache.make_key(digest, config.provider.value, config.model)) is None
+    offline = generator.router.offline_config
+    assert generator.analysis_cache.get(AnalysisCache.make_key(digest, offline.provider.value, offline.model)) is not None
+
+def test_half_open_probe_brings_the_provider_back(generator, fake_provider, image):
+    _open_breaker(generator, fake_provider, image)
+    assert generator.analyze_image(image).route["reason"] == "provider_unhealthy"
+
+    time.sleep(0.35)
+    result = generator.analyze_image(image)
+
+    assert result.source == "provider"
+    assert result.route["tier"] == "accurate"
+    assert generator.resilience.breakers[AIProvider.GEMINI].state == CircuitBreaker.CLOSED
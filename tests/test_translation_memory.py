@@ -0,0 +1,103 @@
+# Arabs Stock AI Metadata Generator
+# Translation memory with the local dictionary backend
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import DictionaryBackend, TranslationMemory
+
+ENTRIES = {
+    ("en", "ar", "office"): "مكتب",
+    ("en", "ar", "laptop"): "حاسوب محمول",
+    ("en", "ar", "coffee cup"): "فنجان قهوة"
+}
+
+@pytest.fixture
+def memory() -> TranslationMemory:
+    return TranslationMemory(DictionaryBackend(dict(ENTRIES)))
+
+def test_misses_are_deduplicated_into_one_upstream_call(memory):
+    translated = memory.translate_many(["office", "Laptop", "office", "  laptop "], 'ar')
+
+    assert translated == ["مكتب", "حاسوب محمول", "مكتب", "حاسوب محمول"]
+    assert memory.backend.calls == 1
+    assert memory.stats()["misses"] == 2
+
+def test_repeated_terms_are_served_from_memory(memory):
+    memory.translate_many(["office", "laptop"], 'ar')
+    assert memory.translate_many(["laptop", "office"], 'ar') == ["حاسوب محمول", "مكتب"]
+
+    stats = memory.stats()
+    assert memory.backend.calls == 1
+    assert stats["hits"] == 2
+    assert stats["upstream_calls"] == 1
+
+def test_seed_terms_are_pinned_both_ways(memory):
+    memory.seed([("Business", "أعمال")])
+
+    assert memory.translate("business", 'ar') == "أعمال"
+    assert memory.translate("أعمال", 'en') == "Business"
+    assert memory.backend.calls == 0
+
+def test_lru_evicts_but_keeps_pinned_terms():
+    memory = TranslationMemory(DictionaryBackend(dict(ENTRIES)), max_entries=1)
+    memory.seed([("Business", "أعمال")])
+    memory.translate_many(["office", "laptop"], 'ar')
+
+    assert memory.lookup("office", 'ar') is None
+    assert memory.lookup("laptop", 'ar') == "حاسوب محمول"
+    assert memory.lookup("business", 'ar') == "أعمال"
+
+def test_sqlite_store_survives_a_restart(tmp_path):
+    db_path = str(tmp_path / "translations.db")
+    TranslationMemory(DictionaryBackend(dict(ENTRIES)), db_path=db_path).translate("coffee cup", 'ar')
+
+    backend = DictionaryBackend()
+    assert TranslationMemory(backend, db_path=db_path).translate("coffee cup", 'ar') == "فنجان قهوة"
+    assert backend.calls == 0
+
+def test_concurrent_callers_share_one_upstream_request():
+    release = threading.Event()
+
+    class SlowBackend(DictionaryBackend):
+        def translate(self, texts, src, dest):
+            release.wait(5)
+            return super().translate(texts, src, dest)
+
+    memory = TranslationMemory(SlowBackend(dict(ENTRIES)))
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(memory.translate, "office", 'ar') for _ in range(4)]
+        while memory.stats()["shared_waits"] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        assert [future.result() for future in futures] == ["مكتب"] * 4
+
+    assert memory.backend.calls == 1
+
+def test_short_backend_reply_fails_every_waiter():
+    release = threading.Event()
+
+    class ShortBackend(DictionaryBackend):
+        def translate(self, texts, src, dest):
+            release.wait(5)
+            return super().translate(texts, src, dest)[:-1]
+
+    memory = TranslationMemory(ShortBackend(dict(ENTRIES)))
+    with ThreadPoolExecutor(2) as pool:
+        owner = pool.submit(memory.translate_many, ["office", "laptop"], 'ar')
+        while not memory._inflight:
+            threading.Event().wait(0.01)
+        # Waits on the in-flight "laptop" fetch, which the short reply never answers
+        waiter = pool.submit(memory.translate, "laptop", 'ar')
+        while memory.stats()["shared_waits"] < 1:
+            threading.Event().wait(0.01)
+        release.set()
+        with pytest.raises(ValueError):
+            owner.result(5)
+        with pytest.raises(ValueError):
+            waiter.result(5)
+
+    assert not memory._inflight
+    assert memory.lookup("office", 'ar') is None